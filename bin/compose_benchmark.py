@@ -0,0 +1,87 @@
+# // Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# // SPDX-License-Identifier: Apache-2.0
+# Times the Compose variable interpolation of d2k on a generated compose file
+# against the previous per value get_ext_value lookup.
+# Usage: python bin/compose_benchmark.py [-n 2000] [-e 30] [-r 3]
+import os
+import re
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from specctl.dc2k8s.dc_interpolation import Interpolator
+
+# services share most of their variables like real compose files do
+def sample_compose(services, env_count):
+    values = {"HOST_%d"%(i): "host-%d.internal"%(i) for i in range(env_count)}
+    values.update({"PORT_%d"%(i): str(8000+i) for i in range(env_count)})
+    compose = {"services": {}}
+    for s in range(services):
+        env = {}
+        for i in range(env_count):
+            env["URL_%d"%(i)] = "http://${HOST_%d}:${PORT_%d}/v1"%(i, i)
+            env["OPT_%d"%(i)] = "${MISSING_%d:-default-%d}"%(i, i)
+        compose["services"]["svc-%d"%(s)] = {
+            "image": "nginx",
+            "ports": ["${PORT_%d}:80"%(s % env_count)],
+            "environment": env
+        }
+    return compose, values
+
+# get_ext_value before the interpolation engine, first variable only
+def previous_get_ext_value(key, ext_values):
+    expr = re.compile(r'\$\{[\:a-zA-Z0-9_-]+\}')
+    mo = expr.search(str(key))
+    value = key
+    if mo is None: return value
+    key_var = mo.group()[2:-1]
+    split1 = key_var.split(":-")
+    key_var=split1[0]
+    if len(split1)>1:
+        value = split1[1]
+    lookup_value = ext_values.get(key_var)
+    if lookup_value is not None:
+        value = lookup_value
+    if value.isdigit():
+        value = int(value)
+    return value
+
+def previous(compose, values):
+    for svc in compose["services"].values():
+        for p in svc["ports"]:
+            for part in p.split(":"):
+                previous_get_ext_value(part, values)
+        for v in svc["environment"].values():
+            previous_get_ext_value(v, values)
+
+def current(compose, values):
+    Interpolator(values).interpolate_all(compose)
+
+def run(fn, compose, values, rounds):
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn(compose, values)
+        elapsed = time.perf_counter()-start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Compose variable interpolation")
+    parser.add_argument("-n", "--services", type=int, default=2000, help="Number of services")
+    parser.add_argument("-e", "--env", type=int, default=30, help="Environment variable pairs per service")
+    parser.add_argument("-r", "--rounds", type=int, default=3, help="Rounds per engine, the best one is reported")
+    args = parser.parse_args()
+
+    compose, values = sample_compose(args.services, args.env)
+    strings = args.services*(2*args.env+1)
+    old = run(previous, compose, values, args.rounds)
+    new = run(current, compose, values, args.rounds)
+    print("%-28s %10s %14s"%("ENGINE", "SECONDS", "STRINGS/SECOND"))
+    print("%-28s %10.3f %14.0f"%("get_ext_value per value", old, strings/old))
+    print("%-28s %10.3f %14.0f"%("Interpolator whole document", new, strings/new))
+    print("%d services, %d interpolated strings. The previous lookup only expands the first variable of a string"%(args.services, strings))
+
+if __name__ == "__main__":
+    main()
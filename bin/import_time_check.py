@@ -0,0 +1,87 @@
+# // Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# // SPDX-License-Identifier: Apache-2.0
+# Runs specctl once per mode under python -X importtime and fails when the
+# import time it adds to a bare interpreter is over budget, or when a mode
+# imports a package it doesn't need, like boto3 for d2k.
+# Usage: python bin/import_time_check.py [-r 3] [--budget d2k=400] [-v]
+import os
+import sys
+import tempfile
+import argparse
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# mode: (specctl arguments, budget in ms, packages the mode must not import)
+# e2k replays an empty recording so that it runs without AWS credentials
+MODES = {
+    "help": (["--help"], 250, ["boto3", "botocore", "kubernetes", "pick", "dotenv"]),
+    "d2k": (["-m", "d2k", "-s", "tests/docker_compose/nginx/docker_compose.yml"], 300, ["boto3", "botocore", "kubernetes", "pick"]),
+    "k2e": (["-m", "k2e", "-s", "tests/nginx"], 300, ["boto3", "botocore", "kubernetes", "pick", "dotenv"]),
+    "e2k": (["-m", "e2k", "--replay", "{tmp}/replay", "--ecs_region_name", "*"], 1500, ["kubernetes", "dotenv"]),
+}
+
+# returns {top level import: cumulative us} and all imported module names
+def import_times(code):
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    top_level = {}
+    modules = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        name = parts[2].rstrip()
+        modules.add(name.strip())
+        if not name.startswith("  "):
+            top_level[name.strip()] = int(parts[1])
+    return top_level, modules, result.returncode
+
+def run_mode(mode, tmp, rounds):
+    args, _, _ = MODES[mode]
+    args = [a.replace("{tmp}", tmp) for a in args]+(["-o", os.path.join(tmp, "output"), "-l", "CRITICAL"] if mode != "help" else [])
+    code = "from specctl.specctl import transform; transform(%r)"%(args)
+    base, _, _ = import_times("pass")
+    best = None
+    for _ in range(rounds):
+        top_level, modules, returncode = import_times(code)
+        added = {k: v for k, v in top_level.items() if k not in base}
+        total = sum(added.values())
+        if best is None or total < best[0]:
+            best = (total, added, modules, returncode)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the import time of every specctl mode")
+    parser.add_argument("-r", "--rounds", type=int, default=3, help="Runs per mode, the fastest one is checked")
+    parser.add_argument("--budget", action="append", default=[], help="MODE=MS to override the budget of a mode, can be repeated")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Print the slowest top level imports of every mode")
+    args = parser.parse_args()
+
+    budgets = {mode: budget for mode, (_, budget, _) in MODES.items()}
+    for b in args.budget:
+        mode, _, ms = b.partition("=")
+        budgets[mode] = int(ms)
+
+    failed = False
+    print("%-6s %10s %10s  %s"%("MODE", "IMPORT MS", "BUDGET MS", "STATUS"))
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(os.path.join(tmp, "replay"))
+        for mode, (_, _, forbidden) in MODES.items():
+            total, added, modules, returncode = run_mode(mode, tmp, args.rounds)
+            problems = []
+            if returncode != 0:
+                problems.append("exit code %d"%(returncode))
+            if total/1000 > budgets[mode]:
+                problems.append("over budget")
+            unneeded = [p for p in forbidden if p in modules]
+            if len(unneeded) > 0:
+                problems.append("imports "+", ".join(unneeded))
+            failed = failed or len(problems) > 0
+            print("%-6s %10.1f %10d  %s"%(mode, total/1000, budgets[mode], "; ".join(problems) or "ok"))
+            if args.verbose:
+                for name, us in sorted(added.items(), key=lambda i: -i[1])[:5]:
+                    print("       %10.1f  %s"%(us/1000, name))
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
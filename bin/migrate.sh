@@ -1,5 +1,4 @@
 # // Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # // SPDX-License-Identifier: Apache-2.0
-find . -type f -name "*.tfvars" -exec sh -c 'echo "${0%/*}"' {} \; \
-   | sort -u \
-   | xargs -I{} sh -c "cd {}; terraform init && terraform $1 --auto-approve"
+# Kept for compatibility, run from the output directory with apply or destroy
+specctl -m apply -o . --tf_command "${1:-apply}" -j "${2:-4}"
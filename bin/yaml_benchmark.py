@@ -0,0 +1,86 @@
+# // Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# // SPDX-License-Identifier: Apache-2.0
+# Compares the YAML emission used for e2k and d2k specs with the previous
+# one document at a time yaml.Dumper path and checks both give the same text.
+# Usage: python bin/yaml_benchmark.py [-n 2000] [-r 3]
+import os
+import sys
+import copy
+import time
+import argparse
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from specctl import k8s_objects
+from specctl.yaml_writer import dump_yaml
+
+# a deployment, service and configmap per service, shaped like e2k output
+def sample_specs(count):
+    specs = []
+    for i in range(count):
+        name = "svc-%d"%(i)
+        labels = {"ecs-task-definition": name+"-3", "ecs-cluster": "core-infra"}
+        dep = copy.deepcopy(k8s_objects.K8S_DEPLOYMENT)
+        dep["metadata"]["name"] = name
+        dep["spec"]["selector"]["matchLabels"] = labels
+        dep["spec"]["template"]["metadata"]["labels"] = labels
+        dep["spec"]["template"]["spec"]["containers"] = [{
+            "image": "public.ecr.aws/nginx/nginx:1.25",
+            "name": "app",
+            "ports": [{"containerPort": 8080, "protocol": "TCP"}],
+            "env": [{"name": "VAR_%d"%(j), "value": "value %d"%(j)} for j in range(20)]
+        }]
+        svc = copy.deepcopy(k8s_objects.K8S_SERVICE)
+        svc["metadata"]["name"] = name
+        svc["spec"]["selector"] = labels
+        svc["spec"]["ports"] = [{"port": 8080, "targetPort": 8080, "protocol": "TCP"}]
+        cm = copy.deepcopy(k8s_objects.K8S_CONFIGMAP)
+        cm["metadata"]["name"] = name
+        cm["data"] = {"key-%d"%(j): "x"*40 for j in range(10)}
+        specs.append([dep, svc, cm])
+    return specs
+
+# the write_yaml body before the shared writer
+class PreviousDumper(yaml.Dumper):
+    def ignore_aliases(self, data):
+        return True
+
+def previous_dump(spec_list):
+    content = []
+    for spec in spec_list:
+        content.append(yaml.dump(spec, Dumper=PreviousDumper))
+        content.append("---\n")
+    return "".join(content)
+
+def run(dump, files, rounds):
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for spec_list in files:
+            dump(spec_list)
+        elapsed = time.perf_counter()-start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark YAML emission of generated K8s specs")
+    parser.add_argument("-n", "--services", type=int, default=2000, help="Number of services, 3 documents each")
+    parser.add_argument("-r", "--rounds", type=int, default=3, help="Rounds per writer, the best one is reported")
+    args = parser.parse_args()
+
+    files = sample_specs(args.services)
+    for spec_list in files:
+        if previous_dump(spec_list) != dump_yaml(spec_list):
+            print("Output differs for %s"%(spec_list[0]["metadata"]["name"]))
+            sys.exit(1)
+    documents = sum(len(f) for f in files)
+    previous = run(previous_dump, files, args.rounds)
+    current = run(dump_yaml, files, args.rounds)
+    print("libyaml available: %s"%(yaml.__with_libyaml__))
+    print("%-28s %10s %12s"%("WRITER", "SECONDS", "DOCS/SECOND"))
+    print("%-28s %10.3f %12.0f"%("yaml.Dumper per document", previous, documents/previous))
+    print("%-28s %10.3f %12.0f"%("shared dump_all writer", current, documents/current))
+    print("Speedup %.1fx for %d documents, output identical"%(previous/current, documents))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+# // Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# // SPDX-License-Identifier: Apache-2.0
+import os
+import json
+import fnmatch
+import yaml
+from .output_writer import MemoryWriter, OutputWriter
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Python API to run the conversions in process. The converters write
+# through a MemoryWriter so the generated files come back in a
+# ConversionResult instead of landing in an output directory:
+#
+#   from specctl.api import convert_k8s_to_ecs
+#   result = convert_k8s_to_ecs(open("deployment.yaml").read(), tf_modules_directory="./terraform")
+#   result.collect("taskdefinition.json")   # {"default/nginx/taskdefinition.json": {...}}
+#   result.text("default/nginx/terraform.tfvars")
+#   result.write("./output")                # optional, same files as the CLI
+#
+# Keyword options are the options of the specctl command, for example
+# tf_layout="namespace" or jobs=4, and default to the same values.
+# Conversions can run on several threads at once. The AWS clients of e2k
+# are shared by the process, so concurrent e2k calls must use the same
+# record, replay and api_rate options.
+
+DEFAULT_OPTIONS = {
+    "namespaces": [],
+    "td_file": "taskdefinition.json",
+    "sd_file": "servicedefinition.json",
+    "input_file": "",
+    "tfvars_file": "terraform.tfvars",
+    "tf_modules_directory": "./terraform",
+    "tf_modules_name_map": "namespaces:namespaces,ecs-lb-service:ecs-lb-service,ecs-backend-service:ecs-backend-service",
+    "tf_files": "main.tf,versions.tf,variables.tf,outputs.tf",
+    "tf_layout": "service",
+    "output_directory": ".",
+    "output_format": "dir",
+    "cluster_name": "",
+    "region_name": "",
+    "launch_types": ["FARGATE"],
+    "scheduling_strategies": ["REPLICA"],
+    "api_rate": 0,
+    "full_export": True,
+    "record": "",
+    "replay": "",
+    "sgp": False,
+    "env_file": "",
+    "tf_command": "apply",
+    "jobs": 1
+}
+
+# The files of one conversion, paths are relative like in the output directory
+class ConversionResult:
+    def __init__(self, writer):
+        self.files = {k: v.decode("utf-8") for k, v in writer.contents.items()}
+        self.manifest = writer.manifest()
+
+    def text(self, path):
+        return self.files[path]
+
+    # JSON files give one object, YAML files the list of their documents,
+    # tfvars and Terraform files their text
+    def load(self, path):
+        content = self.files[path]
+        if path.endswith(".json"):
+            return json.loads(content)
+        if path.endswith((".yaml", ".yml")):
+            return [d for d in yaml.safe_load_all(content) if d is not None]
+        return content
+
+    # {path: loaded file} of the files named file_name in any directory, for
+    # example collect("taskdefinition.json") or collect("*_deployment.yaml")
+    def collect(self, file_name):
+        return {path: self.load(path) for path in sorted(self.files) if fnmatch.fnmatchcase(path.rpartition("/")[2], file_name)}
+
+    # writes the files and manifest.json to output_directory like the CLI
+    # does, unchanged files are not rewritten. returns the files written
+    def write(self, output_directory):
+        writer = OutputWriter(output_directory)
+        for path in sorted(self.files):
+            sources = self.manifest["files"].get(path, {}).get("sources", [])
+            writer.write(os.path.join(output_directory, path), self.files[path], sources)
+        writer.close()
+        return sorted(writer.changed)
+
+def conversion_options(overrides):
+    unknown = [k for k in overrides if k not in DEFAULT_OPTIONS and k != "env_values"]
+    if len(unknown) > 0:
+        raise TypeError("Unknown options %s"%(", ".join(sorted(unknown))))
+    options = dict(DEFAULT_OPTIONS, **overrides)
+    options["output_writer"] = MemoryWriter(options["output_directory"])
+    return options
+
+TYPE_NAMES = {dict: "a mapping", list: "a list", str: "a string", int: "a number", bool: "a boolean"}
+
+# raises ValueError unless value is None or one of types, returns value
+def check_type(value, types, where):
+    types = types if isinstance(types, tuple) else (types,)
+    if value is not None and not isinstance(value, types):
+        raise ValueError("%s must be %s, got %s"%(where, " or ".join(TYPE_NAMES.get(t, t.__name__) for t in types), type(value).__name__))
+    return value
+
+def check_list_of(items, types, where):
+    for i, item in enumerate(check_type(items, list, where) or []):
+        check_type(item, types, "%s[%d]"%(where, i))
+    return items or []
+
+def check_pod_spec(spec, where):
+    for key in ["containers", "initContainers"]:
+        for i, container in enumerate(check_list_of(spec.get(key), dict, where+"."+key)):
+            container_where = "%s.%s[%d]"%(where, key, i)
+            check_type(container.get("name"), str, container_where+".name")
+            check_type(container.get("image"), str, container_where+".image")
+            check_type(container.get("resources"), dict, container_where+".resources")
+            for k in ["ports", "env", "envFrom", "volumeMounts"]:
+                check_list_of(container.get(k), dict, container_where+"."+k)
+
+# raises ValueError for the parts of a K8s object the parser reads that
+# have the wrong type, like a number where a mapping belongs
+def check_k8s_object(k8s_obj, i):
+    where = "document %d"%(i)
+    kind = check_type(k8s_obj.get("kind"), str, where+" kind")
+    metadata = check_type(k8s_obj.get("metadata"), dict, where+" metadata") or {}
+    for k in ["name", "namespace"]:
+        check_type(metadata.get(k), str, "%s metadata.%s"%(where, k))
+    for k in ["labels", "annotations"]:
+        check_type(metadata.get(k), dict, "%s metadata.%s"%(where, k))
+    spec = check_type(k8s_obj.get("spec"), dict, where+" spec") or {}
+    if kind == "Deployment":
+        template = check_type(spec.get("template"), dict, where+" spec.template") or {}
+        check_type(template.get("metadata"), dict, where+" spec.template.metadata")
+        check_pod_spec(check_type(template.get("spec"), dict, where+" spec.template.spec") or {}, where+" spec.template.spec")
+    elif kind == "Pod":
+        check_pod_spec(spec, where+" spec")
+    elif kind == "Service":
+        check_list_of(spec.get("ports"), dict, where+" spec.ports")
+    elif kind in ["ConfigMap", "Secret"]:
+        check_type(k8s_obj.get("data"), dict, where+" data")
+
+COMPOSE_SERVICE_TYPES = {
+    "image": str, "build": (str, dict), "command": (str, list), "entrypoint": (str, list),
+    "environment": (dict, list), "labels": (dict, list), "ports": list, "expose": list,
+    "volumes": list, "depends_on": (dict, list), "deploy": dict, "healthcheck": dict, "extends": (str, dict)
+}
+
+# raises ValueError for compose services of the wrong shape
+def check_compose_document(document, i):
+    services = check_type(document.get("services"), dict, "document %d services"%(i)) or {}
+    for name, svc in services.items():
+        where = "document %d service %s"%(i, name)
+        for k, types in COMPOSE_SERVICE_TYPES.items():
+            check_type((check_type(svc, dict, where) or {}).get(k), types, where+" "+k)
+        check_list_of((svc or {}).get("ports"), (str, int, dict), where+" ports")
+
+# specs are dicts, or YAML text with one or more documents, or a list of them.
+# raises ValueError for text that isn't YAML and documents that aren't mappings
+def yaml_documents(specs):
+    if isinstance(specs, (str, bytes)):
+        try:
+            documents = [d for d in yaml.safe_load_all(specs) if d is not None]
+        except yaml.YAMLError as error:
+            raise ValueError("Invalid YAML %s"%(error))
+    elif isinstance(specs, dict):
+        documents = [specs]
+    elif isinstance(specs, (list, tuple)):
+        documents = []
+        for spec in specs:
+            documents += yaml_documents(spec)
+    else:
+        raise ValueError("Expected YAML text, a mapping or a list of them, got %s"%(type(specs).__name__))
+    for document in documents:
+        if not isinstance(document, dict):
+            raise ValueError("Expected a mapping in every YAML document, got %s"%(type(document).__name__))
+    return documents
+
+# K8s objects to ECS task and service definitions and Terraform
+def convert_k8s_to_ecs(specs, **options):
+    from .k8s2ecs.k8s_parser import k8s_parser
+    from .k8s2ecs.ecs_output import EcsJsonSink
+    from .k8s2ecs.tf_output import TerraformSink
+    from .k8s2ecs.emitter import k2e_emit
+    options = conversion_options(options)
+    writer = options["output_writer"]
+    spec_list = yaml_documents(specs)
+    if len(spec_list) <= 0:
+        logger.warning("Found no K8s specification object")
+    else:
+        for i, k8s_obj in enumerate(spec_list):
+            check_k8s_object(k8s_obj, i)
+        k2e_emit(k8s_parser(spec_list), options, [EcsJsonSink(options, writer), TerraformSink(options, writer)])
+    writer.close()
+    return ConversionResult(writer)
+
+# the K8s objects of a kubeconfig context to ECS, namespaces limits the
+# namespaces that are read
+def convert_k8s_cluster_to_ecs(context, namespaces=[], **options):
+    check_type(context, str, "context")
+    check_list_of(namespaces, str, "namespaces")
+    if len(context or "") <= 0:
+        raise ValueError("context is required")
+    from .k8s2ecs.k8s_reader import k8s_cluster_extract
+    return convert_k8s_to_ecs(k8s_cluster_extract(namespaces, context), namespaces=namespaces, **options)
+
+# the services of ECS clusters to K8s YAML, cluster_name and region_name
+# take the comma separated names and globs of the CLI
+def convert_ecs_to_k8s(cluster_name, region_name="", **options):
+    from .ecs2k8s.ecs_reader_writer import ecs_reader_writer
+    check_type(cluster_name, str, "cluster_name")
+    check_type(region_name, str, "region_name")
+    if len(cluster_name or "") <= 0:
+        raise ValueError("cluster_name is required")
+    options = conversion_options(dict(options, cluster_name=cluster_name, region_name=region_name))
+    ecs_reader_writer(options)
+    return ConversionResult(options["output_writer"])
+
+# Compose documents to K8s YAML, several documents are layered in order
+# like compose files. env holds the values for variable interpolation
+def convert_compose_to_k8s(documents, env=None, **options):
+    from .dc2k8s.dc_loader import load_compose_documents
+    from .dc2k8s.dc_reader_writer import dc_reader_writer
+    check_type(env, dict, "env")
+    options = conversion_options(dict(options, env_values=env or {}))
+    documents = yaml_documents(documents)
+    for i, document in enumerate(documents):
+        check_compose_document(document, i)
+    dc_reader_writer([load_compose_documents(documents)], options)
+    return ConversionResult(options["output_writer"])
@@ -0,0 +1,168 @@
+# // Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# // SPDX-License-Identifier: Apache-2.0
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .api import DEFAULT_OPTIONS
+from .output_writer import open_output_writer
+from .yaml_reader import read_yaml_file
+from .profiler import stage
+import logging
+
+logger = logging.getLogger(__name__)
+
+# specctl -m batch -s jobs.yaml runs many conversions in one process,
+# -j jobs at a time. The jobs share the parsed YAML files, the AWS clients
+# and the Terraform module files.
+#
+# jobs.yaml
+#   defaults:                        # options of every job
+#     tf_modules_directory: ./terraform
+#     output_directory: out          # default <-o>, jobs write to <name> in it
+#   jobs:
+#   - name: shop                     # default job-<n>
+#     mode: k2e                      # k2e, e2k or d2k
+#     source: shop/k8s               # file, directory or list of them
+#     output_directory: out/shop     # default <output_directory>/<name>
+#     tf_layout: namespace           # any other option of this job
+#   - name: legacy
+#     mode: e2k
+#     cluster_name: legacy
+#     region_name: us-east-1
+#
+# Relative paths are relative to the directory of jobs.yaml. Options are
+# named like in specctl.api, for example cluster_name or launch_types.
+# The AWS client mode is global to the process, so record, replay and
+# api_rate come from the command line for all the jobs.
+
+BATCH_MODES = ["k2e", "e2k", "d2k"]
+PATH_OPTIONS = ["output_directory", "tf_modules_directory", "input_file", "env_file"]
+CLIENT_OPTIONS = ["record", "replay", "api_rate"]
+JOB_KEYS = ["name", "mode", "source", "context"]
+
+def run_k2e(job, options):
+    from .k8s2ecs.k8s_parser import k8s_parser
+    from .k8s2ecs.ecs_output import EcsJsonSink
+    from .k8s2ecs.tf_output import TerraformSink
+    from .k8s2ecs.emitter import k2e_emit
+    from .yaml_reader import yaml_reader
+    writer = options["output_writer"]
+    if len(job["sources"]) > 0:
+        spec_list = []
+        for source in job["sources"]:
+            spec_list += yaml_reader(source)
+    else:
+        from .k8s2ecs.k8s_reader import k8s_cluster_extract
+        if len(job.get("context") or "") <= 0:
+            raise ValueError("k2e job needs a source or a context")
+        spec_list = k8s_cluster_extract(options.get("namespaces"), job["context"])
+    if len(spec_list) <= 0:
+        raise ValueError("Found no K8s specification object")
+    k2e_emit(k8s_parser(spec_list), options, [EcsJsonSink(options, writer), TerraformSink(options, writer)])
+    writer.close()
+
+def run_e2k(job, options):
+    from .ecs2k8s.ecs_reader_writer import ecs_reader_writer
+    if len(options.get("cluster_name") or "") <= 0:
+        raise ValueError("e2k job needs a cluster_name")
+    if not ecs_reader_writer(options):
+        raise ValueError("No ECS clusters match %s"%(options["cluster_name"]))
+
+def run_d2k(job, options):
+    from .dc2k8s.dc_reader_writer import dc_compose_reader_writer
+    if len(job["sources"]) <= 0:
+        raise ValueError("d2k job needs a source")
+    if not dc_compose_reader_writer(job["sources"], options):
+        raise ValueError("Compose conversion failed")
+
+RUNNERS = {"k2e": run_k2e, "e2k": run_e2k, "d2k": run_d2k}
+
+# returns (job, options) with the paths resolved, raises ValueError for
+# a job that can't run. client_options are the CLIENT_OPTIONS of the
+# command line
+def job_options(job, defaults, base_dir, output_directory, client_options):
+    unknown = [k for k in list(job)+list(defaults) if k not in DEFAULT_OPTIONS and k not in JOB_KEYS]
+    if len(unknown) > 0:
+        raise ValueError("Unknown options %s"%(", ".join(sorted(set(unknown)))))
+    per_job = [k for k in list(job)+list(defaults) if k in CLIENT_OPTIONS]
+    if len(per_job) > 0:
+        raise ValueError("Options %s can only be set on the command line"%(", ".join(sorted(set(per_job)))))
+    mode = str(job.get("mode", "")).lower()
+    if mode not in BATCH_MODES:
+        raise ValueError("mode must be one of %s"%(", ".join(BATCH_MODES)))
+    options = dict(DEFAULT_OPTIONS, full_export=False, jobs=1)
+    options.update({k: v for k, v in defaults.items() if k not in JOB_KEYS})
+    options.update({k: v for k, v in job.items() if k not in JOB_KEYS})
+    options.update(client_options)
+    # -o is relative to the working directory, the paths of jobs.yaml to
+    # its directory
+    if job.get("output_directory"):
+        options["output_directory"] = job["output_directory"]
+    elif defaults.get("output_directory"):
+        options["output_directory"] = os.path.join(defaults["output_directory"], job["name"])
+    else:
+        options["output_directory"] = os.path.join(os.path.abspath(output_directory), job["name"])
+    for k in PATH_OPTIONS:
+        if isinstance(options.get(k), str) and len(options[k]) > 0 and not os.path.isabs(options[k]):
+            options[k] = os.path.join(base_dir, options[k])
+    if isinstance(options.get("namespaces"), str):
+        options["namespaces"] = [n for n in options["namespaces"].split(",") if len(n) > 0]
+    sources = job.get("source") or []
+    if isinstance(sources, str):
+        sources = [sources]
+    job = dict(job, mode=mode, sources=[s if os.path.isabs(s) else os.path.join(base_dir, s) for s in sources])
+    os.makedirs(options["output_directory"], exist_ok=True)
+    return job, options
+
+def run_job(job, defaults, base_dir, output_directory, client_options):
+    start = time.time()
+    result = {"name": job["name"], "mode": job.get("mode", ""), "status": "ok", "files": 0, "written": 0, "error": ""}
+    try:
+        job, options = job_options(job, defaults, base_dir, output_directory, client_options)
+        writer = open_output_writer(options)
+        options["output_writer"] = writer
+        logger.info("Starting %s job %s"%(job["mode"], job["name"]))
+        with stage("job", job=job["name"], mode=job["mode"]):
+            RUNNERS[job["mode"]](job, options)
+        result["files"] = len(writer.files)
+        result["written"] = len(writer.changed)
+    except Exception as error:
+        logger.error("%s job failed %s"%(job["name"], error))
+        result["status"] = "failed"
+        result["error"] = str(error)
+    result["seconds"] = time.time()-start
+    return result
+
+def print_batch_summary(results, elapsed):
+    lines = ["%-30s %-5s %-7s %8s %8s %9s  %s"%("JOB", "MODE", "STATUS", "FILES", "WRITTEN", "SECONDS", "ERROR")]
+    for r in results:
+        lines.append("%-30s %-5s %-7s %8d %8d %9.2f  %s"%(r["name"], r["mode"], r["status"], r["files"], r["written"], r["seconds"], r["error"]))
+    ok = [r for r in results if r["status"] == "ok"]
+    files = sum(r["files"] for r in results)
+    lines.append("%d of %d jobs succeeded, %d files in %.2f seconds, %.1f jobs/second, %.0f files/second"%(len(ok), len(results), files, elapsed, len(results)/elapsed if elapsed > 0 else 0, files/elapsed if elapsed > 0 else 0))
+    logger.log(100, "\n".join(lines))
+
+# returns the job results in the order of the jobs file
+def run_batch(jobs_file, options):
+    start = time.time()
+    spec = (read_yaml_file(jobs_file) or [None])[0]
+    if not isinstance(spec, dict) or not isinstance(spec.get("jobs"), list):
+        logger.error("%s has no jobs list"%(jobs_file))
+        return []
+    defaults = spec.get("defaults") or {}
+    base_dir = os.path.dirname(os.path.abspath(jobs_file))
+    jobs = []
+    for i, job in enumerate(spec["jobs"]):
+        job = dict(job) if isinstance(job, dict) else {"mode": ""}
+        job["name"] = str(job.get("name") or "job-%d"%(i+1))
+        jobs.append(job)
+    names = [j["name"] for j in jobs]
+    if len(set(names)) != len(names):
+        logger.error("Job names in %s must be unique"%(jobs_file))
+        return []
+    client_options = {k: options[k] for k in CLIENT_OPTIONS if k in options}
+    with ThreadPoolExecutor(max_workers=options.get("jobs", 1)) as executor:
+        futures = [executor.submit(run_job, job, defaults, base_dir, options.get("output_directory"), client_options) for job in jobs]
+        results = [f.result() for f in futures]
+    print_batch_summary(results, time.time()-start)
+    return results
@@ -0,0 +1,120 @@
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Compose variable interpolation
+# https://github.com/compose-spec/compose-spec/blob/master/spec.md#interpolation
+#   $$                  literal $
+#   $VAR ${VAR}         value of VAR, empty if unset
+#   ${VAR:-default}     default if VAR is unset or empty
+#   ${VAR-default}      default if VAR is unset
+#   ${VAR:?error}       ValueError if VAR is unset or empty
+#   ${VAR?error}        ValueError if VAR is unset
+#   ${VAR:+replacement} replacement if VAR is set and not empty
+#   ${VAR+replacement}  replacement if VAR is set
+# defaults, errors and replacements can hold interpolations themselves
+NAME_PATTERN = re.compile(r"[_a-zA-Z][_a-zA-Z0-9]*")
+BRACED_PATTERN = re.compile(r"([_a-zA-Z][_a-zA-Z0-9]*)(?:(:?[-?+])(.*))?\Z", re.DOTALL)
+
+# Interpolates compose documents with the values of an env file. Every
+# distinct string is interpolated once and every missing variable is
+# reported once however often it is used.
+class Interpolator:
+    def __init__(self, values):
+        self.values = values
+        self.resolved = {}
+        self.reported = set()
+
+    # returns a copy of obj with every string value interpolated,
+    # mapping keys are left as they are
+    def interpolate_all(self, obj):
+        if isinstance(obj, dict):
+            return {k: self.interpolate_all(v) for k, v in obj.items()}
+        if isinstance(obj, list):
+            return [self.interpolate_all(v) for v in obj]
+        if isinstance(obj, str):
+            return self.interpolate(obj)
+        return obj
+
+    def interpolate(self, text):
+        if "$" not in text:
+            return text
+        value = self.resolved.get(text)
+        if value is None:
+            value = self.substitute(text)
+            self.resolved[text] = value
+        return value
+
+    def lookup(self, name):
+        return self.values.get(name)
+
+    def report(self, level, message):
+        if message in self.reported:
+            return
+        self.reported.add(message)
+        logger.log(level, message)
+
+    def substitute(self, text):
+        out = []
+        i = 0
+        while True:
+            j = text.find("$", i)
+            if j < 0:
+                out.append(text[i:])
+                return "".join(out)
+            out.append(text[i:j])
+            if text.startswith("$$", j):
+                out.append("$")
+                i = j+2
+                continue
+            mo = NAME_PATTERN.match(text, j+1)
+            if mo is not None:
+                out.append(self.expand(mo.group(), None, None))
+                i = mo.end()
+                continue
+            if text.startswith("${", j):
+                end = closing_brace(text, j+2)
+                mo = BRACED_PATTERN.match(text, j+2, end) if end >= 0 else None
+                if mo is None:
+                    self.report(logging.ERROR, "Invalid interpolation format in %s"%(text))
+                    out.append(text[j:])
+                    return "".join(out)
+                out.append(self.expand(mo.group(1), mo.group(2), mo.group(3)))
+                i = end+1
+                continue
+            out.append("$")
+            i = j+1
+
+    def expand(self, name, op, arg):
+        value = self.lookup(name)
+        if op is None:
+            if value is None:
+                self.report(logging.WARNING, "%s key is not found in env file"%(name))
+                return ""
+            return value
+        is_set = value is not None and (not op.startswith(":") or len(value) > 0)
+        if op in [":-", "-"]:
+            return value if is_set else self.interpolate(arg)
+        if op in [":+", "+"]:
+            return self.interpolate(arg) if is_set else ""
+        # :? and ?
+        if not is_set:
+            raise ValueError("%s is required: %s"%(name, self.interpolate(arg) or "not set in env file"))
+        return value
+
+# index of the } closing the ${ before start, -1 if there is none
+def closing_brace(text, start):
+    depth = 1
+    i = start
+    while i < len(text):
+        if text.startswith("${", i):
+            depth += 1
+            i += 2
+            continue
+        if text[i] == "}":
+            depth -= 1
+            if depth == 0:
+                return i
+        i += 1
+    return -1
@@ -0,0 +1,189 @@
+import os
+import copy
+from ..utils import dict_check
+from ..yaml_reader import read_yaml_file
+from ..profiler import timed
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Loads one or more Compose files into one model the way
+# docker compose -f a.yml -f b.yml does
+# https://github.com/compose-spec/compose-spec/blob/master/13-merge.md
+# - mappings are merged key by key, later files win for scalars
+# - sequences are appended
+# - command, entrypoint and healthcheck test are replaced
+# - ports, volumes, secrets and configs are merged by their target
+# - environment, labels and the other KEY=VALUE lists are merged as mappings
+# YAML anchors and merge keys are resolved by the YAML loader, extends is
+# resolved per file before the files are merged.
+
+REPLACED_KEYS = ["command", "entrypoint"]
+# key: separator of the list form
+MAPPING_LIST_KEYS = {"environment": "=", "labels": "=", "annotations": "=", "sysctls": "=", "extra_hosts": ":", "args": "="}
+UNIQUE_KEYS = ["ports", "volumes", "secrets", "configs", "expose", "dns", "dns_search", "tmpfs"]
+
+# ["KEY=VALUE", "KEY"] to {"KEY": "VALUE", "KEY": None}
+def list_to_mapping(items, separator):
+    mapping = {}
+    for item in items:
+        if isinstance(item, dict):
+            mapping.update(item)
+            continue
+        k, sep, v = str(item).partition(separator)
+        mapping[k.strip()] = v if sep else None
+    return mapping
+
+# the target a unique resource is identified by
+def unique_key(key, item):
+    if isinstance(item, dict):
+        if key == "ports":
+            return (item.get("host_ip"), str(item.get("published", "")), str(item.get("target")), item.get("protocol", "tcp"))
+        return item.get("target", item.get("source"))
+    if key == "volumes":
+        parts = str(item).split(":")
+        return parts[1] if len(parts) > 1 else parts[0]
+    return str(item)
+
+# puts the list forms of a service into the form that merges
+def normalize_service(svc):
+    svc = dict(svc)
+    for key, separator in MAPPING_LIST_KEYS.items():
+        if isinstance(svc.get(key), list):
+            svc[key] = list_to_mapping(svc[key], separator)
+    if isinstance(svc.get("build"), dict) and isinstance(svc["build"].get("args"), list):
+        svc["build"] = dict(svc["build"], args=list_to_mapping(svc["build"]["args"], "="))
+    for key in ["command", "entrypoint"]:
+        if isinstance(svc.get(key), str):
+            svc[key] = [svc[key]]
+    return svc
+
+def merge_unique(key, base, override):
+    merged = {}
+    for item in base+override:
+        merged[unique_key(key, item)] = item
+    return list(merged.values())
+
+def merge_service(base, override):
+    merged = dict(base)
+    for key, value in override.items():
+        if key in REPLACED_KEYS or key not in merged:
+            merged[key] = copy.deepcopy(value)
+        elif key == "healthcheck" and dict_check(value) and dict_check(merged[key]):
+            merged[key] = dict(merged[key], **value)
+        elif key in UNIQUE_KEYS and isinstance(value, list) and isinstance(merged[key], list):
+            merged[key] = merge_unique(key, merged[key], value)
+        else:
+            merged[key] = merge_values(merged[key], value)
+    return merged
+
+def merge_values(base, override):
+    if isinstance(base, dict) and isinstance(override, dict):
+        merged = dict(base)
+        for k, v in override.items():
+            merged[k] = merge_values(merged[k], v) if k in merged else copy.deepcopy(v)
+        return merged
+    if isinstance(base, list) and isinstance(override, list):
+        return base+copy.deepcopy(override)
+    return copy.deepcopy(override)
+
+# merges compose documents in order, services by name
+def merge_compose(documents):
+    merged = {}
+    for doc in documents:
+        for key, value in doc.items():
+            if key == "services" and dict_check(value):
+                services = merged.setdefault("services", {})
+                for name, svc in value.items():
+                    svc = normalize_service(svc or {})
+                    services[name] = merge_service(services[name], svc) if name in services else svc
+            elif key in merged:
+                merged[key] = merge_values(merged[key], value)
+            else:
+                merged[key] = copy.deepcopy(value)
+    return merged
+
+class ComposeLoader:
+    def __init__(self):
+        self.files = {}
+        self.resolved = {}
+
+    # every file is read once however many services extend from it
+    def load_file(self, path):
+        path = os.path.abspath(path)
+        if path not in self.files:
+            documents = [d for d in read_yaml_file(path) if dict_check(d)]
+            self.files[path] = merge_compose(documents) if len(documents) > 0 else {}
+        return self.files[path]
+
+    # returns the service with its extends chain merged in
+    def resolve_service(self, path, name, seen=()):
+        path = os.path.abspath(path)
+        if (path, name) in self.resolved:
+            return self.resolved[(path, name)]
+        if (path, name) in seen:
+            logger.error("Circular extends of service %s in %s"%(name, path))
+            return {}
+        svc = self.load_file(path).get("services", {}).get(name)
+        if svc is None:
+            logger.error("Service %s to extend not found in %s"%(name, path))
+            return {}
+        svc = normalize_service(svc)
+        extends = svc.pop("extends", None)
+        if extends is not None:
+            if isinstance(extends, str):
+                extends = {"service": extends}
+            base_path = path
+            if extends.get("file"):
+                base_path = os.path.join(os.path.dirname(path), extends["file"])
+            base = self.resolve_service(base_path, extends.get("service"), seen+((path, name),))
+            svc = merge_service(base, svc)
+        self.resolved[(path, name)] = svc
+        return svc
+
+    # returns the compose model of a file with extends resolved
+    def load(self, path):
+        model = dict(self.load_file(path))
+        services = model.get("services")
+        if dict_check(services):
+            model["services"] = {name: self.resolve_service(path, name) for name in services}
+        return model
+
+# the .yml and .yaml files of a directory in name order
+def compose_files(directory):
+    return [os.path.join(directory, f) for f in sorted(os.listdir(directory)) if os.path.isfile(os.path.join(directory, f)) and f.lower().endswith((".yaml", ".yml"))]
+
+# returns the compose models to convert one after the other. The compose
+# files given as sources are layers of one application and are merged in
+# order, later ones override. A directory holds alternative compose files,
+# like tests/docker_compose/plane, so each of its files is a model of its own
+@timed("read")
+def load_compose(sources):
+    loader = ComposeLoader()
+    models = []
+    layers = []
+    layers_index = 0
+    for source in sources:
+        if os.path.isdir(source):
+            models += [loader.load(path) for path in compose_files(source)]
+        elif os.path.isfile(source):
+            if len(layers) <= 0:
+                layers_index = len(models)
+            layers.append(loader.load(source))
+        else:
+            logger.error("Compose file %s not found"%(source))
+    # the merged layers take the place of the first compose file
+    if len(layers) > 0:
+        models.insert(layers_index, merge_compose(layers))
+    return models
+
+# like load_compose for compose documents that are already parsed, a
+# file of extends is relative to base_dir
+def load_compose_documents(documents, base_dir="."):
+    loader = ComposeLoader()
+    models = []
+    for i, doc in enumerate(documents):
+        path = os.path.abspath(os.path.join(base_dir, "<document %d>"%(i)))
+        loader.files[path] = merge_compose([doc]) if dict_check(doc) else {}
+        models.append(loader.load(path))
+    return merge_compose(models)
@@ -1,6 +1,8 @@
 import copy
+import math
+from decimal import Decimal, InvalidOperation
 from .. import k8s_objects
-from ..utils import dict_check
+from ..utils import dict_check, copy_spec
 import re
 import logging
 
@@ -9,75 +11,202 @@ logger = logging.getLogger(__name__)
 def k8s_conform(input_string):
     return(re.sub("[^a-zA-Z0-9]+","-", input_string).lower().rstrip("-"))
 
-def get_ext_value(key, ext_values):
-    # check if key is of form ${xyz}
-    expr = re.compile(r'\$\{[\:a-zA-Z0-9_-]+\}')
-    mo = expr.search(str(key))
-    value = key
-    if mo is None: return value
-    # strip the ${} to get the var
-    key_var = mo.group()[2:-1]
-    # see if default value is there var:-value or var-value
-    split1 = key_var.split(":-")
-    key_var=split1[0]
-    if len(split1)>1: 
-        value = split1[1]
-    lookup_value = ext_values.get(key_var)
-
-    if lookup_value is None:
-        logger.warning("%s key is not found in env file"%(key_var))
-        # just replace back to the original key
-    else:
-        value = lookup_value
+# a port or port range "8000-8010" to a list of ports, values that are
+# not numbers, like an unset variable, are kept as they are
+def dc_port_range(value):
+    value = str(value).strip()
     if value.isdigit():
-        value = int(value)
-    return value
+        return [int(value)]
+    start, sep, end = value.partition("-")
+    if sep and start.isdigit() and end.isdigit() and int(start) <= int(end):
+        return list(range(int(start), int(end)+1))
+    return [value]
 
-# ports are of the generic form [HOST:]CONTAINER[/PROTOCOL]
-# port ranges are not supported though in K8s 
+# ports are of the short form [[HOST_IP:]HOST:]CONTAINER[/PROTOCOL] where
+# HOST and CONTAINER can be ranges, or of the long form with target,
+# published and protocol keys.
 # mapped host port will be assigned to service port
-def dc_port_parser(dc_ports, ext_values):
+# variables in the ports are already interpolated
+def dc_port_parser(dc_ports):
     ports = []
-    for p in dc_ports:
-        p_split = p.split(":")
-        p_container_port_protocol  = p_split[-1]
-        port_protocol_list = p_container_port_protocol.split("/")
-        p_container_port = port_protocol_list[0]
-        if p_container_port.isdigit():
-            p_container_port = int(p_container_port)
+    for p in dc_ports or []:
+        if isinstance(p, dict):
+            container_ports = dc_port_range(p.get("target", ""))
+            published = p.get("published")
+            protocol = str(p.get("protocol", "tcp"))
         else:
-            p_container_port = get_ext_value(p_container_port, ext_values)
-        service_port = p_container_port
-        if len(p_split)>1:
-            service_port=p_split[-2]
-            if service_port.isdigit():
-                service_port = int(service_port)
-            else:
-                service_port = get_ext_value(service_port, ext_values)
-        p_container_protocol = "TCP"
-        if len(port_protocol_list)>1:
-            p_container_protocol = port_protocol_list[1].upper()
-        ports.append({"service_port":service_port, "container_port":p_container_port, "protocol":p_container_protocol})
+            port_protocol = str(p).rsplit("/", 1)
+            protocol = port_protocol[1] if len(port_protocol) > 1 else "tcp"
+            # rsplit keeps the colons of an IPv6 host ip together
+            p_split = port_protocol[0].rsplit(":", 2)
+            container_ports = dc_port_range(p_split[-1])
+            published = p_split[-2] if len(p_split) > 1 else None
+        service_ports = container_ports
+        if published is not None and str(published) != "":
+            service_ports = dc_port_range(published)
+            if len(service_ports) != len(container_ports):
+                logger.warning("Host ports %s do not match the container ports of %s, using the container ports"%(published, p))
+                service_ports = container_ports
+        for service_port, container_port in zip(service_ports, container_ports):
+            ports.append({"service_port":service_port, "container_port":container_port, "protocol":protocol.upper()})
     return ports
 
-def dc_container_parser(dc_svc, k8s_dep, ext_values):
+# compose byte values are like 1024, "300m", "1.5gb" with binary units
+# https://github.com/compose-spec/compose-spec/blob/master/spec.md#specifying-byte-values
+BYTE_UNITS = {"": 1, "b": 1, "k": 1024, "kb": 1024, "m": 1024**2, "mb": 1024**2, "g": 1024**3, "gb": 1024**3}
+BYTE_PATTERN = re.compile(r"\s*([0-9]*\.?[0-9]+)\s*([a-zA-Z]*)\s*\Z")
+# durations are like "1m30s" or "10s"
+DURATION_UNITS = {"h": 3600, "m": 60, "s": 1, "ms": Decimal("0.001"), "us": Decimal("0.000001"), "ns": Decimal("0.000000001")}
+DURATION_PATTERN = re.compile(r"([0-9]*\.?[0-9]+)(h|ms|us|ns|m|s)")
+# docker defaults for healthcheck fields that are not set
+HEALTHCHECK_DEFAULTS = {"interval": 30, "timeout": 30, "retries": 3, "start_period": 0}
+
+# compose cpus "0.5" to K8s quantity "500m", rounded up to 1m
+def dc_cpus_to_k8s(cpus):
+    try:
+        millis = math.ceil(Decimal(str(cpus))*1000)
+    except InvalidOperation:
+        raise ValueError("Invalid cpus value: %s"%(cpus))
+    if millis <= 0:
+        raise ValueError("Invalid cpus value: %s"%(cpus))
+    if millis % 1000 == 0:
+        return str(millis//1000)
+    return "%dm"%(millis)
+
+# compose byte value "1.5g" to K8s quantity "1536Mi"
+def dc_bytes_to_k8s(value):
+    mo = BYTE_PATTERN.match(str(value))
+    if mo is None or mo.group(2).lower() not in BYTE_UNITS:
+        raise ValueError("Invalid byte value: %s"%(value))
+    size = math.ceil(Decimal(mo.group(1))*BYTE_UNITS[mo.group(2).lower()])
+    if size <= 0:
+        raise ValueError("Invalid byte value: %s"%(value))
+    for suffix, base in [("Gi", 1024**3), ("Mi", 1024**2), ("Ki", 1024)]:
+        if size % base == 0:
+            return "%d%s"%(size//base, suffix)
+    return str(size)
+
+# compose duration "1m30s" to whole seconds, rounded up
+def dc_duration_seconds(value):
+    if isinstance(value, (int, float)):
+        return math.ceil(value)
+    value = str(value).strip()
+    seconds = Decimal(0)
+    end = 0
+    for mo in DURATION_PATTERN.finditer(value):
+        if mo.start() != end:
+            break
+        seconds += Decimal(mo.group(1))*DURATION_UNITS[mo.group(2)]
+        end = mo.end()
+    if end == 0 or end != len(value):
+        raise ValueError("Invalid duration: %s"%(value))
+    return math.ceil(seconds)
+
+# deploy.resources limits and reservations, with the older mem_limit,
+# mem_reservation and cpus attributes when deploy does not set them
+def dc_resources_parser(dc_svc):
     dc_svc_name = dc_svc.get("service_name")
-    pod_container = copy.deepcopy(k8s_objects.K8S_POD_CONTAINER)
-    ports = []
+    deploy = dc_svc.get("deploy") or {}
+    dc_resources = deploy.get("resources") or {}
+    dc_limits = dict(dc_resources.get("limits") or {})
+    dc_reservations = dict(dc_resources.get("reservations") or {})
+    if dc_svc.get("cpus") is not None: dc_limits.setdefault("cpus", dc_svc.get("cpus"))
+    if dc_svc.get("mem_limit") is not None: dc_limits.setdefault("memory", dc_svc.get("mem_limit"))
+    if dc_svc.get("mem_reservation") is not None: dc_reservations.setdefault("memory", dc_svc.get("mem_reservation"))
+
+    resources = {}
+    for dc_key, k8s_key in [("limits", "limits"), ("reservations", "requests")]:
+        dc_values = dc_limits if dc_key == "limits" else dc_reservations
+        k8s_values = {}
+        try:
+            if dc_values.get("cpus") is not None:
+                k8s_values["cpu"] = dc_cpus_to_k8s(dc_values.get("cpus"))
+            if dc_values.get("memory") is not None:
+                k8s_values["memory"] = dc_bytes_to_k8s(dc_values.get("memory"))
+        except ValueError as e:
+            logger.warning("%s service resource %s are skipped. %s"%(dc_svc_name, dc_key, e))
+            continue
+        if dict_check(k8s_values):
+            resources[k8s_key] = k8s_values
+    return resources
+
+# healthcheck test to a probe handler
+# ["CMD", args...] runs args, ["CMD-SHELL", cmd] and a plain string run a shell
+def dc_healthcheck_command(test):
+    if isinstance(test, str):
+        return ["/bin/sh", "-c", test]
+    if not isinstance(test, list) or len(test) <= 0:
+        return None
+    if test[0] == "CMD":
+        return [str(t) for t in test[1:]]
+    if test[0] == "CMD-SHELL":
+        return ["/bin/sh", "-c", " ".join(str(t) for t in test[1:])]
+    return None
+
+# healthcheck to the same readiness and liveness probe
+def dc_healthcheck_parser(dc_svc):
+    dc_svc_name = dc_svc.get("service_name")
+    healthcheck = dc_svc.get("healthcheck")
+    if not dict_check(healthcheck) or healthcheck.get("disable") is True:
+        return None
+    command = dc_healthcheck_command(healthcheck.get("test"))
+    if not command:
+        if healthcheck.get("test") != ["NONE"]:
+            logger.warning("%s service healthcheck test %s is not supported"%(dc_svc_name, healthcheck.get("test")))
+        return None
+    values = dict(HEALTHCHECK_DEFAULTS)
+    try:
+        for k in ["interval", "timeout", "start_period"]:
+            if healthcheck.get(k) is not None:
+                values[k] = dc_duration_seconds(healthcheck.get(k))
+        if healthcheck.get("retries") is not None:
+            values["retries"] = int(healthcheck.get("retries"))
+    except ValueError as e:
+        logger.warning("%s service healthcheck is skipped. %s"%(dc_svc_name, e))
+        return None
+    probe = {"exec": {"command": command},
+             "periodSeconds": max(values["interval"], 1),
+             "timeoutSeconds": max(values["timeout"], 1),
+             "failureThreshold": max(values["retries"], 1)}
+    if values["start_period"] > 0:
+        probe["initialDelaySeconds"] = values["start_period"]
+    return probe
+
+# deploy.replicas, or the older scale attribute
+def dc_replicas_parser(dc_svc):
+    deploy = dc_svc.get("deploy") or {}
+    replicas = deploy.get("replicas", dc_svc.get("scale"))
+    if replicas is None:
+        return None
+    try:
+        return int(replicas)
+    except ValueError:
+        logger.warning("%s service replicas %s is not a number"%(dc_svc.get("service_name"), replicas))
+        return None
+
+# dc_ports are the ports of the service parsed by dc_port_parser
+def dc_container_parser(dc_svc, k8s_dep, ext_values, dc_ports):
+    dc_svc_name = dc_svc.get("service_name")
+    pod_container = copy_spec(k8s_objects.K8S_POD_CONTAINER)
     dc_image = dc_svc.get("image")
     if dc_image is None:
         # Then likely "build" is being used
-        img_key="${BUILD_"+dc_svc_name+"}"
-        logger.warning("%s service has no container image. looking up %s in env file"%(dc_svc_name, img_key))
-        dc_image=get_ext_value(img_key,ext_values)
+        img_key="BUILD_"+dc_svc_name
+        logger.warning("%s service has no container image. looking up ${%s} in env file"%(dc_svc_name, img_key))
+        dc_image=ext_values.get(img_key)
+        if dc_image is None:
+            logger.warning("%s key is not found in env file"%(img_key))
+            dc_image="${"+img_key+"}"
 
     pod_container["image"]=dc_image
     pod_container["name"]  = k8s_dep["metadata"]["name"]
-    dc_ports_raw = dc_svc.get("ports",[])
-    dc_ports = dc_port_parser(dc_ports_raw, ext_values)
+    # several host ports can map to the same container port
     ports = []
-
+    seen = set()
     for p in dc_ports:
+        key = (p["container_port"], p["protocol"])
+        if key in seen: continue
+        seen.add(key)
         ports.append({"containerPort":p["container_port"],"protocol":p["protocol"]})
     
     pod_container["ports"]=ports
@@ -86,38 +215,57 @@ def dc_container_parser(dc_svc, k8s_dep, ext_values):
     if dc_env is not None:
         if isinstance(dc_env, dict):
             for k,v in dc_env.items():
-                pod_container["env"].append({"name":k,"value":get_ext_value(v, ext_values)})
+                # KEY without a value is taken from the shell in compose
+                if v is None:
+                    logger.warning("%s environment variable of %s service has no value"%(k, dc_svc_name))
+                    v = ""
+                pod_container["env"].append({"name":k,"value":v})
         if isinstance(dc_env, list):
             for env_item in dc_env:
                 for k,v in env_item.items():
-                    pod_container["env"].append({"name":k,"value":get_ext_value(v, ext_values)})
+                    pod_container["env"].append({"name":k,"value":v})
+    resources = dc_resources_parser(dc_svc)
+    if dict_check(resources):
+        pod_container["resources"] = resources
+    probe = dc_healthcheck_parser(dc_svc)
+    if probe is not None:
+        pod_container["readinessProbe"] = probe
+        pod_container["livenessProbe"] = copy.deepcopy(probe)
     k8s_dep["spec"]["template"]["spec"]["containers"].append(pod_container)    
     return
 
 def dc_service_parser(dc_svc, ext_values):
     k8s_obj_list = []
     dc_svc_name = dc_svc.get("service_name")
-    k8s_dep = copy.deepcopy(k8s_objects.K8S_DEPLOYMENT)
-    k8s_svc = copy.deepcopy(k8s_objects.K8S_SERVICE)
-    k8s_svc_account = copy.deepcopy(k8s_objects.K8S_SERVICE_ACCOUNT)
+    k8s_dep = copy_spec(k8s_objects.K8S_DEPLOYMENT)
+    k8s_svc = copy_spec(k8s_objects.K8S_SERVICE)
+    k8s_svc_account = copy_spec(k8s_objects.K8S_SERVICE_ACCOUNT)
 
     svc_name = k8s_conform(dc_svc_name)
     k8s_dep["metadata"]["name"] = svc_name
     k8s_svc["metadata"]["name"] = svc_name
     k8s_svc_account["metadata"]["name"] = svc_name
-    dc_container_parser(dc_svc, k8s_dep, ext_values)
+    # ports are parsed once for the container and the service
+    dc_ports = dc_port_parser(dc_svc.get("ports",[]))
+    dc_container_parser(dc_svc, k8s_dep, ext_values, dc_ports)
+    replicas = dc_replicas_parser(dc_svc)
+    if replicas is not None:
+        k8s_dep["spec"]["replicas"] = replicas
 
-    dc_ports_raw = dc_svc.get("ports",[])
-    dc_ports = dc_port_parser(dc_ports_raw, ext_values)
-    dc_expose = dc_svc.get("expose",[])
+    # expose entries can be ranges and carry a protocol too
+    dc_expose = set()
+    for e in dc_svc.get("expose") or []:
+        dc_expose.update(str(port) for port in dc_port_range(str(e).split("/")[0]))
     ports = []
     for p in dc_ports:
         container_port = p["container_port"]
-        if len(dc_expose) > 0:
-            if str(container_port) in dc_expose:
-                ports.append({"port":p["service_port"],"targetPort":container_port, "protocol":p["protocol"]})
-        else:
-            ports.append({"port":p["service_port"],"targetPort":container_port, "protocol":p["protocol"]})
+        if len(dc_expose) > 0 and str(container_port) not in dc_expose:
+            continue
+        ports.append({"port":p["service_port"],"targetPort":container_port, "protocol":p["protocol"]})
+    # K8s requires a name on every port of a service with more than one
+    if len(ports) > 1:
+        for port in ports:
+            port["name"] = "%s-%s"%(port["protocol"].lower(), port["port"])
     k8s_svc["spec"]["ports"] = ports
     # if labels are present we will use these as selector 
     selector_label = {"app":svc_name}
@@ -1,43 +1,76 @@
 import os
 import json
-import yaml
 from ..utils import dict_check
 from .dc_parser import dc_service_parser
+from .dc_interpolation import Interpolator
+from .dc_loader import load_compose
+from concurrent.futures import ThreadPoolExecutor
+from ..output_writer import open_output_writer
+from ..yaml_writer import write_yaml
+from ..profiler import stage, count
 from dotenv import dotenv_values
 
 import logging
 
 logger = logging.getLogger(__name__)
 
-def write_yaml(filename, spec_list):
-    logging.info("Writing K8s spec to %s"%(filename))
-    yaml.Dumper.ignore_aliases = lambda self, data: True
-    with open(filename, 'w') as kf:
-      for spec in spec_list:
-          kf.write(yaml.dump(spec, Dumper=yaml.Dumper))
-          kf.write("---\n")
+# converts one compose service and writes its K8s specs
+def dc_service_export(svc_name, dc_svc, ext_values, options, writer):
+    dc_svc = dict(dc_svc or {})
+    dc_svc["service_name"]=svc_name
+    with stage("dc_parser", service=svc_name):
+        k8s_yamls = dc_service_parser(dc_svc, ext_values)
+    count("compose.services")
 
+    output_dir = os.path.join(options.get("output_directory"), svc_name)
+    for k,v in k8s_yamls.items():
+        k8s_file = os.path.join(output_dir, svc_name+"_"+k+".yaml")
+        write_yaml(writer, k8s_file, [v], ["services/"+svc_name])
+
+# spec_list are compose documents converted one after the other, use
+# dc_compose_reader_writer to merge several compose files first.
+# With jobs > 1 the services of a document are converted in parallel.
+# raises ValueError for a required variable that is not set, before any
+# file is written
 def dc_reader_writer(spec_list, options):
     #first load any values supplied via env files
     ext_values_file = options.get("env_file")
-    ext_values = {}
+    ext_values = dict(options.get("env_values") or {})
     if os.path.isfile(ext_values_file):
-        ext_values = dotenv_values(ext_values_file)
+        ext_values.update(dotenv_values(ext_values_file))
+    interpolator = Interpolator(ext_values)
+    # variables are interpolated over the whole document in one pass
+    with stage("interpolate"):
+        spec_list = [interpolator.interpolate_all(spec) for spec in spec_list]
+    writer = open_output_writer(options)
+    jobs = options.get("jobs", 1)
     for spec in spec_list:
         services = spec.get("services")
         if not dict_check(services): continue
-        for svc_name,dc_svc in services.items():
-            dc_svc["service_name"]=svc_name
-            k8s_yamls = dc_service_parser(dc_svc, ext_values)
-        
-            output_dir = os.path.join(options.get("output_directory"), svc_name)
-            try:
-                os.makedirs(output_dir)
-            except FileExistsError:
-                pass
-            for k,v in k8s_yamls.items():
-                k8s_file = os.path.join(output_dir, svc_name+"_"+k+".yaml")
-                write_yaml(k8s_file,[v])
+        if jobs <= 1:
+            for svc_name,dc_svc in services.items():
+                dc_service_export(svc_name, dc_svc, ext_values, options, writer)
+            continue
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(dc_service_export, svc_name, dc_svc, ext_values, options, writer) for svc_name, dc_svc in services.items()]
+            for future in futures:
+                future.result()
     
+    writer.close()
     logger.log(100, "Please see %s directory for kubernetes artifacts" %(options.get("output_directory")))
-    return
\ No newline at end of file
+    return
+
+# merges the compose files of sources in order like docker compose -f
+# does and converts the merged services, the files of a directory source
+# are converted one at a time. returns False when the conversion failed
+def dc_compose_reader_writer(sources, options):
+    models = [m for m in load_compose(sources) if dict_check(m.get("services"))]
+    if len(models) <= 0:
+        logger.warning("Found no docker compose services")
+        return True
+    try:
+        dc_reader_writer(models, options)
+    except ValueError as error:
+        logger.critical("%s"%(error))
+        return False
+    return True
@@ -0,0 +1,183 @@
+# // Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# // SPDX-License-Identifier: Apache-2.0
+import os
+import time
+import fnmatch
+import threading
+import contextvars
+import boto3
+from botocore.config import Config
+from .aws_replay import RecordingClient, ReplayClient
+from ..profiler import stage, count
+import logging
+
+logger = logging.getLogger(__name__)
+
+# boto3 clients are thread safe once created and each holds its own
+# connection pool, so one client per (service, region, config) is shared by
+# every e2k call instead of building a new one per target group or task.
+# Creating clients from the default session is not thread safe, hence the lock.
+MAX_POOL_CONNECTIONS = 50
+RETRY_CONFIG = {"mode": "adaptive", "max_attempts": 10}
+
+_clients = {}
+_clients_lock = threading.Lock()
+# with a record directory every response is also saved there, with a
+# replay directory responses come from there and AWS is never called
+_client_mode = {"record": "", "replay": "", "api_rate": 0}
+
+# Token bucket shared by all clients of a region so concurrent cluster
+# exports in one region stay under rate calls per second between them.
+# The adaptive retry mode still backs off if AWS throttles anyway.
+class RateLimiter:
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self.tokens = self.rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens+(now-self.updated)*self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1-self.tokens)/self.rate
+            time.sleep(wait)
+
+_limiters = {}
+
+def get_limiter(region_name):
+    if _client_mode["api_rate"] <= 0 or len(_client_mode["replay"]) > 0:
+        return None
+    with _clients_lock:
+        if region_name not in _limiters:
+            _limiters[region_name] = RateLimiter(_client_mode["api_rate"])
+        return _limiters[region_name]
+
+# Counts the API calls made in the current context, e2k sets a new counter
+# per cluster and copies the context into its worker threads
+class CallCounter:
+    def __init__(self):
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def add(self):
+        with self.lock:
+            self.calls += 1
+
+api_call_counter = contextvars.ContextVar("api_call_counter", default=None)
+
+def count_api_call():
+    counter = api_call_counter.get()
+    if counter is not None:
+        counter.add()
+
+# rate limits and counts every call and paginated page of a client, with
+# --profile the time of the calls is the aws.<service> stage
+class MeteredClient:
+    def __init__(self, client, region_name, service_name=""):
+        self.client = client
+        self.region_name = region_name
+        self.service_name = service_name
+
+    def throttle(self):
+        limiter = get_limiter(self.region_name)
+        if limiter is not None:
+            with stage("aws.rate_limit", region=self.region_name):
+                limiter.acquire()
+
+    def count_call(self, operation):
+        count_api_call()
+        count("aws.calls")
+        count("aws.calls.%s.%s"%(self.service_name, operation))
+
+    def __getattr__(self, operation):
+        if operation.startswith("__"):
+            raise AttributeError(operation)
+        method = getattr(self.client, operation)
+        def call(**params):
+            self.throttle()
+            self.count_call(operation)
+            with stage("aws."+self.service_name, service=self.service_name, operation=operation, region=self.region_name):
+                return method(**params)
+        return call
+
+    def get_paginator(self, operation):
+        return MeteredPaginator(self, operation)
+
+class MeteredPaginator:
+    def __init__(self, metered, operation):
+        self.metered = metered
+        self.operation = operation
+
+    def paginate(self, **params):
+        pages = iter(self.metered.client.get_paginator(self.operation).paginate(**params))
+        while True:
+            self.metered.throttle()
+            try:
+                with stage("aws."+self.metered.service_name, service=self.metered.service_name, operation=self.operation, region=self.metered.region_name, paginated=True):
+                    page = next(pages)
+            except StopIteration:
+                return
+            self.metered.count_call(self.operation)
+            yield page
+
+def configure_clients(record_dir="", replay_dir="", api_rate=0):
+    with _clients_lock:
+        if _client_mode["record"] != record_dir or _client_mode["replay"] != replay_dir:
+            _clients.clear()
+        if _client_mode["api_rate"] != api_rate:
+            _limiters.clear()
+        _client_mode["record"] = record_dir
+        _client_mode["replay"] = replay_dir
+        _client_mode["api_rate"] = api_rate
+    if len(replay_dir) > 0:
+        logger.info("Replaying AWS responses from %s"%(replay_dir))
+    elif len(record_dir) > 0:
+        logger.info("Recording AWS responses to %s"%(record_dir))
+
+def get_client(service_name, region_name="", max_pool_connections=MAX_POOL_CONNECTIONS):
+    key = (service_name, region_name, max_pool_connections)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            if len(_client_mode["replay"]) > 0:
+                client = ReplayClient(service_name, region_name, _client_mode["replay"])
+            else:
+                config = Config(region_name=region_name or None, max_pool_connections=max_pool_connections, retries=RETRY_CONFIG)
+                logger.debug("Creating %s client for region %s"%(service_name, region_name))
+                client = boto3.client(service_name, config=config)
+                if len(_client_mode["record"]) > 0:
+                    client = RecordingClient(client, service_name, region_name, _client_mode["record"])
+            client = MeteredClient(client, region_name, service_name)
+            _clients[key] = client
+    return client
+
+# returns the regions matching the comma separated names or globs, from the
+# replay directory when replaying or from the regions boto3 knows for ECS
+def list_regions(patterns):
+    if len(_client_mode["replay"]) > 0:
+        regions = sorted(d for d in os.listdir(_client_mode["replay"]) if os.path.isdir(os.path.join(_client_mode["replay"], d)))
+    else:
+        regions = boto3.session.Session().get_available_regions("ecs")
+    selected = []
+    for pattern in patterns:
+        if not is_glob(pattern):
+            if pattern not in selected: selected.append(pattern)
+            continue
+        selected += [r for r in regions if fnmatch.fnmatchcase(r, pattern) and r not in selected]
+    return selected
+
+def is_glob(pattern):
+    return any(c in pattern for c in "*?[")
+
+def clear_clients():
+    with _clients_lock:
+        _clients.clear()
@@ -0,0 +1,158 @@
+# // Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# // SPDX-License-Identifier: Apache-2.0
+import os
+import json
+import hashlib
+import threading
+import botocore.exceptions
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Record and replay of AWS API responses for offline e2k runs.
+# Every call is stored as
+# <record dir>/<region>/<service>/<operation>/<sha256 of the parameters>.json
+# {"params": {}, "response": {}} or {"params": {}, "error": {}}
+# and paginators store their pages as {"params": {}, "pages": [{}]}.
+# Replay serves the same files through the same code path, so the e2k
+# parsers can be re-run over a recorded cluster without credentials.
+
+# Batched calls group their ARNs or names differently depending on what is
+# already cached, so on replay a batch that was not recorded as such is
+# assembled from the items of all recorded responses of that operation.
+# operation: (request list parameter, response list key, item id fields)
+BATCH_OPERATIONS = {
+    "describe_services": ("services", "services", ["serviceArn", "serviceName"]),
+    "get_parameters": ("Names", "Parameters", ["Name", "ARN"]),
+    "batch_get_secret_value": ("SecretIdList", "SecretValues", ["ARN", "Name"]),
+    "describe_target_groups": ("TargetGroupArns", "TargetGroups", ["TargetGroupArn"]),
+    "describe_load_balancers": ("LoadBalancerArns", "LoadBalancers", ["LoadBalancerArn"]),
+    "describe_tags": ("ResourceArns", "TagDescriptions", ["ResourceArn"]),
+}
+
+def params_hash(params):
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def operation_dir(root_dir, region_name, service_name, operation):
+    return os.path.join(root_dir, region_name or "default", service_name, operation)
+
+def strip_metadata(response):
+    return {k: v for k, v in response.items() if k != "ResponseMetadata"}
+
+# wraps a boto3 client and writes every response it returns
+class RecordingClient:
+    def __init__(self, client, service_name, region_name, record_dir):
+        self.client = client
+        self.service_name = service_name
+        self.region_name = region_name
+        self.record_dir = record_dir
+
+    def save(self, operation, entry):
+        dir_path = operation_dir(self.record_dir, self.region_name, self.service_name, operation)
+        os.makedirs(dir_path, exist_ok=True)
+        file_path = os.path.join(dir_path, params_hash(entry["params"])+".json")
+        tmp_file = "%s.%d.tmp"%(file_path, threading.get_ident())
+        with open(tmp_file, 'w') as f:
+            f.write(json.dumps(entry, sort_keys=True, indent=1, default=str))
+        os.replace(tmp_file, file_path)
+
+    def __getattr__(self, operation):
+        if operation.startswith("__"):
+            raise AttributeError(operation)
+        method = getattr(self.client, operation)
+        def call(**params):
+            try:
+                response = method(**params)
+            except botocore.exceptions.ClientError as error:
+                self.save(operation, {"params": params, "error": error.response})
+                raise
+            self.save(operation, {"params": params, "response": strip_metadata(response)})
+            return response
+        return call
+
+    def get_paginator(self, operation):
+        return RecordingPaginator(self, operation)
+
+class RecordingPaginator:
+    def __init__(self, recorder, operation):
+        self.recorder = recorder
+        self.operation = operation
+
+    def paginate(self, **params):
+        pages = []
+        for page in self.recorder.client.get_paginator(self.operation).paginate(**params):
+            pages.append(strip_metadata(page))
+            yield page
+        self.recorder.save(self.operation, {"params": params, "pages": pages})
+
+# serves the responses written by a RecordingClient
+class ReplayClient:
+    def __init__(self, service_name, region_name, replay_dir):
+        self.service_name = service_name
+        self.region_name = region_name
+        self.replay_dir = replay_dir
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    # returns {params hash: entry} of all recorded calls of operation
+    def load(self, operation):
+        with self.lock:
+            if operation not in self.entries:
+                entries = {}
+                dir_path = operation_dir(self.replay_dir, self.region_name, self.service_name, operation)
+                if os.path.isdir(dir_path):
+                    for file_name in sorted(os.listdir(dir_path)):
+                        if not file_name.endswith(".json"): continue
+                        with open(os.path.join(dir_path, file_name), 'r') as f:
+                            entries[file_name[:-len(".json")]] = json.loads(f.read())
+                self.entries[operation] = entries
+            return self.entries[operation]
+
+    def missing(self, operation, params):
+        logger.error("No recorded %s %s response for %s"%(self.service_name, operation, params))
+        return botocore.exceptions.ClientError({"Error": {"Code": "ReplayMissing", "Message": "not recorded"}}, operation)
+
+    def assemble(self, operation, params):
+        request_key, response_key, id_fields = BATCH_OPERATIONS[operation]
+        items = {}
+        for entry in self.load(operation).values():
+            for item in entry.get("response", {}).get(response_key, []):
+                for field in id_fields:
+                    if field in item: items[item[field]] = item
+        requested = params.get(request_key, [])
+        found = [items[name] for name in requested if name in items]
+        if len(found) <= 0:
+            raise self.missing(operation, params)
+        response = {response_key: found}
+        if operation == "get_parameters":
+            response["InvalidParameters"] = [name for name in requested if name not in items]
+        return response
+
+    def __getattr__(self, operation):
+        if operation.startswith("__"):
+            raise AttributeError(operation)
+        def call(**params):
+            entry = self.load(operation).get(params_hash(params))
+            if entry is None:
+                if operation in BATCH_OPERATIONS:
+                    return self.assemble(operation, params)
+                raise self.missing(operation, params)
+            if "error" in entry:
+                raise botocore.exceptions.ClientError(entry["error"], operation)
+            return entry["response"]
+        return call
+
+    def get_paginator(self, operation):
+        return ReplayPaginator(self, operation)
+
+class ReplayPaginator:
+    def __init__(self, replay, operation):
+        self.replay = replay
+        self.operation = operation
+
+    def paginate(self, **params):
+        entry = self.replay.load(self.operation).get(params_hash(params))
+        if entry is None:
+            raise self.replay.missing(self.operation, params)
+        for page in entry.get("pages", []):
+            yield page
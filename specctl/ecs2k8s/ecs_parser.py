@@ -39,7 +39,7 @@ def get_pod_containers(task_def, k8s_secrets_and_configmaps):
         for pm in portMappings:
             ports.append({"containerPort":pm.get("containerPort"),"protocol":pm.get("protocol","TCP").upper()})
         pod_container["ports"]=ports 
-        pod_container["env"] = task_container.get("environment",[])
+        pod_container["env"] = list(task_container.get("environment",[]))
         pod_containers.append(pod_container)
         secrets = task_container.get("secrets",[])
         for sec in secrets:
@@ -104,6 +104,10 @@ def ingress_parser(svc_def, svc_lbs):
         lb_details = tg_details.get("load_balancer")
         annotations[alb_anno_prefix+"group.name"] = lb_details.get("LoadBalancerName")
         annotations[alb_anno_prefix+"scheme"] = lb_details.get("Scheme","internet-facing")
+        # aws: tags are reserved and set by AWS itself
+        lb_tags = [t.get("Key")+"="+t.get("Value","") for t in lb_details.get("Tags",[]) if not t.get("Key","aws:").startswith("aws:")]
+        if len(lb_tags) > 0:
+            annotations[alb_anno_prefix+"tags"] = ",".join(lb_tags)
         listeners = tg_details.get("listeners")
         for l in listeners:
             l_arn = l.get("ListenerArn")
@@ -174,6 +178,24 @@ def namespace_parser(name):
     k8s_namespace["metadata"]["labels"] = { "cloudmap_namespace": name }
     return {"namespace": k8s_namespace}
 
+# moves name, selector, pod template and the rolling update limits of a
+# deployment onto a daemonset, it has no replicas
+def get_daemonset(k8s_dep):
+    k8s_ds = copy.deepcopy(k8s_objects.K8S_DAEMONSET)
+    k8s_ds["metadata"]["name"] = k8s_dep["metadata"]["name"]
+    k8s_ds["metadata"]["labels"] = copy.deepcopy(k8s_dep["spec"]["template"]["metadata"]["labels"])
+    k8s_ds["spec"]["selector"] = k8s_dep["spec"]["selector"]
+    k8s_ds["spec"]["template"] = k8s_dep["spec"]["template"]
+    rolling_update = copy.deepcopy(k8s_dep["spec"]["strategy"]["rollingUpdate"])
+    # a daemonset can't roll with both set to 0
+    if rolling_update.get("maxSurge") == "0%" and rolling_update.get("maxUnavailable") == "0%":
+        rolling_update["maxUnavailable"] = 1
+    k8s_ds["spec"]["updateStrategy"] = {
+        "rollingUpdate": rolling_update,
+        "type": "RollingUpdate"
+    }
+    return k8s_ds
+
 def ecs_parser(svc_def, task_def, k8s_secrets_and_configmaps):
     
     k8s_dep = copy.deepcopy(k8s_objects.K8S_DEPLOYMENT)
@@ -227,6 +249,12 @@ def ecs_parser(svc_def, task_def, k8s_secrets_and_configmaps):
     k8s_dep["spec"]["selector"]["matchLabels"] = selector_label
     k8s_dep["spec"]["template"]["spec"]["containers"] = get_pod_containers(task_def, k8s_secrets_and_configmaps)
     k8s_dep["spec"]["template"]["spec"]["serviceAccount"] = svc_name
+    # DAEMON services run one task per container instance like a DaemonSet
+    if svc_def.get("schedulingStrategy") == "DAEMON":
+        return({ "service" : k8s_svc,
+                "daemonset" : get_daemonset(k8s_dep),
+                "service_account" : k8s_svc_account,
+                "security_group_policy" : k8s_sgp })
     return({ "service" : k8s_svc,
             "deployment" : k8s_dep, 
             "service_account" : k8s_svc_account,
@@ -1,42 +1,60 @@
 # // Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # // SPDX-License-Identifier: Apache-2.0
-import boto3
 import botocore
 import botocore.exceptions
-from botocore.config import Config
 from pick import pick
+from .aws_clients import get_client, configure_clients, list_regions, is_glob, CallCounter, api_call_counter
+from .lookup_cache import LookupCache
 from .ecs_parser import ecs_parser, ssm_secret_parser, ingress_parser, namespace_parser
+from ..output_writer import open_output_writer
+from ..yaml_writer import write_yaml
+from ..profiler import stage, count
 import os
 import re
+import time
+import fnmatch
+import contextvars
 import json
-import yaml
 import base64
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 import logging
 
 
 logger = logging.getLogger(__name__)
 
+# SSM GetParameters takes up to 10 names, Secrets Manager BatchGetSecretValue
+# up to 20 secret ids and the ELB describe calls up to 20 ARNs per call
+SSM_BATCH_SIZE = 10
+SECRETS_BATCH_SIZE = 20
+ELB_BATCH_SIZE = 20
+
+# per cluster and service ARN, the state of every service exported by
+# the last run, see ecs_service_state
+STATE_FILE = ".specctl_e2k_state.json"
+
+def batches(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i+size]
+
 # gets namespace id from svc id 
 # returns namespace name
-def get_cloudmap_namespace(region_name, svc_registry_arn):
-    sd_client = boto3.client('servicediscovery')
-    if len(region_name) >0:
-        sd_client = boto3.client("servicediscovery", config=Config(region_name = region_name))
+def get_cloudmap_namespace(region_name, svc_registry_arn, cache=None):
+    cache = cache or LookupCache()
+    sd_client = get_client("servicediscovery", region_name)
     svc_id = svc_registry_arn.split("/")[-1]
-    response = sd_client.get_service(Id=svc_id)
+    response = cache.get("cloudmap_service", svc_id, lambda id: sd_client.get_service(Id=id))
     svc = response.get("Service",{})
     namespace_id = svc.get("NamespaceId")
-    response = sd_client.get_namespace(Id=namespace_id)
+    response = cache.get("cloudmap_namespace", namespace_id, lambda id: sd_client.get_namespace(Id=id))
     namespace = response.get("Namespace")
     namespace_name = namespace.get("Name")
     return namespace_name
 
-def get_listeners_and_rules(region_name, lb_arn, target_group_arn):
-    return_listeners = []
+# returns all listeners of a load balancer, each with all of its rules
+def get_lb_listeners(region_name, lb_arn):
     listeners = []
-    elbv2_client = boto3.client('elbv2')
-    if len(region_name) >0:
-        elbv2_client = boto3.client("elbv2", config=Config(region_name = region_name))
+    elbv2_client = get_client("elbv2", region_name)
     paginator = elbv2_client.get_paginator("describe_listeners")
     response_iterator = paginator.paginate(LoadBalancerArn=lb_arn)
     for i in response_iterator:
@@ -47,127 +65,337 @@ def get_listeners_and_rules(region_name, lb_arn, target_group_arn):
         paginator = elbv2_client.get_paginator("describe_rules")
         response_iterator = paginator.paginate(ListenerArn=listener_arn)
         for i in response_iterator:
-            for r in i["Rules"]:
-                actions = r.get("Actions",[])
-                for action in actions:
-                    type = action.get("Type")
-                    if type is None or type != "forward":
-                        continue
-                    action_tg_arn = action.get("TargetGroupArn")
-                    if action_tg_arn is None or action_tg_arn != target_group_arn: continue
-                    listener["rules"].append(r)
+            listener["rules"] += i["Rules"]
+    return listeners
+
+# listeners and rules are fetched once per load balancer and
+# filtered down to the rules forwarding to target_group_arn
+def get_listeners_and_rules(region_name, lb_arn, target_group_arn, cache=None):
+    cache = cache or LookupCache()
+    return_listeners = []
+    listeners = cache.get("listeners", lb_arn, lambda arn: get_lb_listeners(region_name, arn))
+    for lb_listener in listeners:
+        listener = dict(lb_listener)
+        listener["rules"]=[]
+        for r in lb_listener["rules"]:
+            actions = r.get("Actions",[])
+            for action in actions:
+                type = action.get("Type")
+                if type is None or type != "forward":
+                    continue
+                action_tg_arn = action.get("TargetGroupArn")
+                if action_tg_arn is None or action_tg_arn != target_group_arn: continue
+                listener["rules"].append(r)
         if len(listener["rules"])>0: return_listeners.append(listener)
     return return_listeners
 
-def get_tg_details(region_name, target_group_arn):
-    # get target group details
-    elbv2_client = boto3.client('elbv2')
-    if len(region_name) >0:
-        elbv2_client = boto3.client("elbv2", config=Config(region_name = region_name))
-
-    # todo: add exception handling 
-    response = elbv2_client.describe_target_groups(TargetGroupArns=[target_group_arn])
-    tgs = response.get("TargetGroups")
-    if tgs is None or len(tgs)<=0: 
-        logger.error("%s target group not found")
-        return {}
-    # we should only get 1 response!
-    tg = tgs[0] 
-    # get load balancer associated with target group 
-    lb_arns = tg.get("LoadBalancerArns")
-    if lb_arns is None or len(lb_arns) <= 0: 
-        logger.error("%s target group has no associated load balancer"%(tg.get("TargetGroupName","")))
-        return {}
-    describe_lb_response = elbv2_client.describe_load_balancers(LoadBalancerArns=lb_arns)
-    lb_description_list = describe_lb_response.get("LoadBalancers")
-    if lb_description_list is None or len(lb_description_list)<=0:
-        logger.error("ELB associated with %s target group couldn't be found")
-        return {}
-    # 1 target group can only be associated to 1 elb 
-    tg["load_balancer"] = lb_description_list[0]
-    tg_associated_lb_arn = tg["load_balancer"]["LoadBalancerArn"]
-    # get listener and rules associated with target group
-    tg["listeners"]= get_listeners_and_rules(region_name, tg_associated_lb_arn, target_group_arn)
-    return tg
+# returns {arn: target group} for the target group ARNs, 20 per call.
+# A missing ARN fails the whole call, that batch is split in halves
+# until the missing ARNs are isolated
+def describe_target_groups(elbv2_client, tg_arns):
+    tgs = {}
+    for batch in batches(tg_arns, ELB_BATCH_SIZE):
+        try:
+            response = elbv2_client.describe_target_groups(TargetGroupArns=batch)
+        except botocore.exceptions.ClientError as error:
+            if len(batch) == 1:
+                logger.error("%s target group not found %s"%(batch[0], error))
+                continue
+            half = len(batch)//2
+            tgs.update(describe_target_groups(elbv2_client, batch[:half]))
+            tgs.update(describe_target_groups(elbv2_client, batch[half:]))
+            continue
+        for tg in response.get("TargetGroups",[]):
+            tgs[tg.get("TargetGroupArn")] = tg
+    return tgs
+
+# returns {arn: load balancer} for the load balancer ARNs, 20 per call
+def describe_load_balancers(elbv2_client, lb_arns):
+    lbs = {}
+    for batch in batches(lb_arns, ELB_BATCH_SIZE):
+        try:
+            response = elbv2_client.describe_load_balancers(LoadBalancerArns=batch)
+        except botocore.exceptions.ClientError as error:
+            logger.error("Unable to describe load balancers %s %s"%(batch, error))
+            continue
+        for lb in response.get("LoadBalancers",[]):
+            lbs[lb.get("LoadBalancerArn")] = lb
+    return lbs
+
+# returns {arn: [{"Key":"", "Value":""}]} for target group and
+# load balancer ARNs, 20 per call
+def describe_elb_tags(elbv2_client, arns):
+    tags = {}
+    for batch in batches(arns, ELB_BATCH_SIZE):
+        try:
+            response = elbv2_client.describe_tags(ResourceArns=batch)
+        except botocore.exceptions.ClientError as error:
+            logger.error("Unable to describe tags of %s %s"%(batch, error))
+            continue
+        for description in response.get("TagDescriptions",[]):
+            tags[description.get("ResourceArn")] = description.get("Tags",[])
+    return tags
+
+# describes all target group ARNs with their load balancer, tags,
+# listeners and rules using as few describe calls as possible
+# returns {arn: target group details}
+def get_tgs_details(region_name, target_group_arns, cache=None):
+    cache = cache or LookupCache()
+    elbv2_client = get_client("elbv2", region_name)
+    tgs = describe_target_groups(elbv2_client, target_group_arns)
+    lb_arns = []
+    for arn, tg in tgs.items():
+        # 1 target group can only be associated to 1 elb 
+        tg_lb_arns = tg.get("LoadBalancerArns")
+        if tg_lb_arns is None or len(tg_lb_arns) <= 0:
+            logger.error("%s target group has no associated load balancer"%(tg.get("TargetGroupName","")))
+            continue
+        if tg_lb_arns[0] not in lb_arns: lb_arns.append(tg_lb_arns[0])
+    lbs = cache.get_many("load_balancer", lb_arns, lambda arns: describe_load_balancers(elbv2_client, arns))
+    tags = cache.get_many("elb_tags", list(tgs.keys())+lb_arns, lambda arns: describe_elb_tags(elbv2_client, arns))
+    details = {}
+    for arn, tg in tgs.items():
+        tg_lb_arns = tg.get("LoadBalancerArns") or [""]
+        lb = lbs.get(tg_lb_arns[0])
+        if lb is None:
+            logger.error("ELB associated with %s target group couldn't be found"%(tg.get("TargetGroupName","")))
+            continue
+        tg = dict(tg)
+        tg["Tags"] = tags.get(arn) or []
+        tg["load_balancer"] = dict(lb)
+        tg["load_balancer"]["Tags"] = tags.get(lb.get("LoadBalancerArn")) or []
+        # get listener and rules associated with target group
+        tg["listeners"]= get_listeners_and_rules(region_name, lb.get("LoadBalancerArn"), arn, cache)
+        details[arn] = tg
+    return details
+
+def get_tg_details(region_name, target_group_arn, cache=None):
+    return get_tgs_details(region_name, [target_group_arn], cache).get(target_group_arn, {})
 
 # ecs svc description returns svc_lbs as 
 # [{"targetGroupArn":"", containerName:"", containerPort:xx}]
 # below function will fetch all tg details and 
 # add to the svc_lbs dictionary
-def get_lb_details(region_name, svc_lbs):
+# target groups already described by prefetch_lb_details come from the cache
+def get_lb_details(region_name, svc_lbs, cache=None):
+    cache = cache or LookupCache()
+    tg_arns = [lb.get("targetGroupArn") for lb in svc_lbs if lb.get("targetGroupArn")]
+    tgs = cache.get_many("target_group", tg_arns, lambda arns: get_tgs_details(region_name, arns, cache))
     for lb in svc_lbs:
         tg_arn = lb.get("targetGroupArn")
         if tg_arn is None or len(tg_arn) <=0: continue
-        tg_details = get_tg_details(region_name, tg_arn)
-        lb["details"]=tg_details
+        lb["details"]=tgs.get(tg_arn) or {}
 
-def get_ssm_and_secrets(region_name, task_definition):
-    already_seen={}
-    ssm_client = boto3.client("ssm")
-    secret_mgr_client = boto3.client('secretsmanager')
-    if len(region_name) >0:
-        ssm_client = boto3.client("ssm", config=Config(region_name = region_name))
-        secret_mgr_client = boto3.client('secretsmanager', config=Config(region_name = region_name))
-    container_definitions = task_definition.get("containerDefinitions",[])
-    for cd in container_definitions:
-        secrets = cd.get("secrets",[])
-        for item in secrets:
-            valueFrom = item.get("valueFrom", None)
-            if valueFrom is None or valueFrom in already_seen:
-                continue
-            if "arn:aws:secretsmanager" in valueFrom:
-                try:
-                    response = retrieve_secret_value(secret_mgr_client, valueFrom)
-                except botocore.exceptions.ClientError as error:
-                    logger.error("Unable to get secret %s %s"%(valueFrom, error))
-                if response is None:
-                    continue
-                name = response.get("Name","")
-                type = "SecureString"
-                value = base64.b64encode(response.get("SecretString","").encode("ascii")).decode("ascii")
+# describes the target groups of all services of a cluster in batches
+# before the services are exported
+def prefetch_lb_details(region_name, svc_defs, cache):
+    tg_arns = []
+    for svc_def in svc_defs:
+        for lb in svc_def.get("loadBalancers") or []:
+            tg_arn = lb.get("targetGroupArn")
+            if tg_arn and tg_arn not in tg_arns: tg_arns.append(tg_arn)
+    if len(tg_arns) > 0:
+        cache.get_many("target_group", tg_arns, lambda arns: get_tgs_details(region_name, arns, cache))
+
+# returns {name: parameter} for the SSM parameter names or ARNs
+# that could be found, fetched 10 at a time. When GetParameters fails for
+# a batch, for example because one name is denied, the names of that
+# batch are fetched one by one like get_secret_values does
+def get_ssm_parameters(ssm_client, names):
+    parameters = {}
+    for batch in batches(names, SSM_BATCH_SIZE):
+        try:
+            response = ssm_client.get_parameters(Names=batch, WithDecryption=True)
+        except botocore.exceptions.ClientError as error:
+            logger.debug("GetParameters failed, fetching one by one %s"%(error))
+            response = {}
+        found = {}
+        for parameter in response.get("Parameters",[]):
+            name = parameter.get("Name","")
+            found[name] = parameter
+            found[name+parameter.get("Selector","")] = parameter
+            if "ARN" in parameter:
+                found[parameter["ARN"]] = parameter
+                found[parameter["ARN"]+parameter.get("Selector","")] = parameter
+        invalid = response.get("InvalidParameters",[])
+        for name in batch:
+            if name in found:
+                parameters[name] = found[name]
+            elif name in invalid:
+                logger.error("Unable to get parameter %s not found"%(name))
             else:
+                # the response names it differently than we asked
                 try:
-                    response = ssm_client.get_parameter(Name=valueFrom,WithDecryption=True)
+                    parameters[name] = ssm_client.get_parameter(Name=name, WithDecryption=True).get("Parameter",{})
                 except botocore.exceptions.ClientError as error:
-                    logger.error("Unable to get parameter %s %s"%(valueFrom, error))
-                if response is None: 
-                    continue
-                parameter = response.get("Parameter",{})
-                name = parameter.get("Name","")
-                type = parameter.get("Type","String")
-                value = base64.b64encode(parameter.get("Value","").encode("ascii")).decode("ascii")
-            if len(name)<=0:
+                    logger.error("Unable to get parameter %s %s"%(name, error))
+    return parameters
+
+# returns {secret id: secret value response} for the secret ARNs or
+# names that could be fetched, 20 at a time if BatchGetSecretValue is allowed
+# Secrets Manager ends the ARN of every secret with - and 6 random characters
+SECRET_SUFFIX_LENGTH = 6
+
+def is_partial_secret_arn(secret_id, arn):
+    suffix = arn[len(secret_id)+1:]
+    return arn.startswith(secret_id+"-") and len(suffix) == SECRET_SUFFIX_LENGTH and suffix.isalnum()
+
+def get_secret_values(secrets_client, secret_ids):
+    secrets = {}
+    remaining = list(secret_ids)
+    if hasattr(secrets_client, "batch_get_secret_value"):
+        remaining = []
+        for batch in batches(list(secret_ids), SECRETS_BATCH_SIZE):
+            try:
+                response = secrets_client.batch_get_secret_value(SecretIdList=batch)
+            except botocore.exceptions.ClientError as error:
+                logger.debug("BatchGetSecretValue failed, fetching one by one %s"%(error))
+                remaining += batch
                 continue
-            already_seen[valueFrom] = {"name":name, "value":value, "type":type}
-            if type == "String":
-               already_seen[valueFrom]["value"] = base64.b64decode(value.encode("ascii")).decode("ascii")
-    return(already_seen)
-    
+            by_arn = {secret.get("ARN",""): secret for secret in response.get("SecretValues",[])}
+            by_name = {secret.get("Name",""): secret for secret in response.get("SecretValues",[])}
+            for error in response.get("Errors",[]):
+                logger.error("Unable to get secret %s %s"%(error.get("SecretId"), error.get("Message", error.get("ErrorCode"))))
+            for secret_id in batch:
+                secret = by_arn.get(secret_id) or by_name.get(secret_id)
+                if secret is None:
+                    # a partial ARN matches a full ARN only with the -XXXXXX
+                    # suffix Secrets Manager adds, ambiguous ones are fetched
+                    # one by one below
+                    matches = [v for k,v in by_arn.items() if is_partial_secret_arn(secret_id, k)]
+                    secret = matches[0] if len(matches) == 1 else None
+                if secret is not None:
+                    secrets[secret_id] = secret
+                elif secret_id not in [e.get("SecretId") for e in response.get("Errors",[])]:
+                    remaining.append(secret_id)
+    for secret_id in remaining:
+        try:
+            secrets[secret_id] = secrets_client.get_secret_value(SecretId=secret_id)
+        except botocore.exceptions.ClientError as error:
+            logger.error("Unable to get secret %s %s"%(secret_id, error))
+    return secrets
 
-def retrieve_secret_value(secrets_client, value_from):
+# splits arn:aws:secretsmanager:...:secret:name:json-key:: into the secret
+# ARN and the JSON key, key is None when the whole secret is referenced
+def split_secret_reference(value_from):
     if not value_from.endswith("::"):
-        return secrets_client.get_secret_value(SecretId=value_from)
+        return value_from, None
     match = re.match(r"^(.*):([^:]+)::?$", value_from)
-    arn = match.group(1)
-    key = match.group(2)
-    response = secrets_client.get_secret_value(SecretId=arn)
+    return match.group(1), match.group(2)
+
+# parameters and secrets already fetched for another task definition
+# in this run come from the cache, only the rest are batched
+def get_ssm_and_secrets(region_name, task_definition, cache=None):
+    cache = cache or LookupCache()
+    already_seen={}
+    ssm_client = get_client("ssm", region_name)
+    secret_mgr_client = get_client("secretsmanager", region_name)
+    value_froms = []
+    for cd in task_definition.get("containerDefinitions",[]):
+        for item in cd.get("secrets",[]):
+            valueFrom = item.get("valueFrom", None)
+            if valueFrom is None or valueFrom in value_froms:
+                continue
+            value_froms.append(valueFrom)
+
+    # JSON key references to the same secret share one fetch
+    secret_ids = []
+    ssm_names = []
+    for valueFrom in value_froms:
+        if "arn:aws:secretsmanager" in valueFrom:
+            secret_id, _ = split_secret_reference(valueFrom)
+            if secret_id not in secret_ids: secret_ids.append(secret_id)
+        else:
+            ssm_names.append(valueFrom)
+    secrets = cache.get_many("secret", secret_ids, lambda ids: get_secret_values(secret_mgr_client, ids))
+    parameters = cache.get_many("ssm_parameter", ssm_names, lambda names: get_ssm_parameters(ssm_client, names))
+
+    for valueFrom in value_froms:
+        if "arn:aws:secretsmanager" in valueFrom:
+            response = retrieve_secret_value(secrets, valueFrom)
+            if response is None:
+                continue
+            name = response.get("Name","")
+            type = "SecureString"
+            value = base64.b64encode(response.get("SecretString","").encode("ascii")).decode("ascii")
+        else:
+            parameter = parameters.get(valueFrom)
+            if parameter is None:
+                continue
+            name = parameter.get("Name","")
+            type = parameter.get("Type","String")
+            value = base64.b64encode(parameter.get("Value","").encode("ascii")).decode("ascii")
+        if len(name)<=0:
+            continue
+        already_seen[valueFrom] = {"name":name, "value":value, "type":type}
+        if type == "String":
+           already_seen[valueFrom]["value"] = base64.b64decode(value.encode("ascii")).decode("ascii")
+    return(already_seen)
+    
+
+# picks the value for value_from out of the fetched secrets
+def retrieve_secret_value(secrets, value_from):
+    secret_id, key = split_secret_reference(value_from)
+    response = secrets.get(secret_id)
+    if response is None or key is None:
+        return response
     secret_json = json.loads(response['SecretString'])
     if key not in secret_json:
+        logger.error("Key %s not found in secret %s"%(key, secret_id))
         return None
     return {
-        'ARN': arn,
+        'ARN': secret_id,
         'Name': key,
         'SecretString': secret_json[key],
     }
     
 
-def ecs_get_task_definition(client, task_definition):
-    response = client.describe_task_definition(
-        taskDefinition= task_definition,
-        include=['TAGS']
+def ecs_get_task_definition(client, task_definition, cache=None):
+    cache = cache or LookupCache()
+    def describe(arn):
+        response = client.describe_task_definition(
+            taskDefinition= arn,
+            include=['TAGS']
+        )
+        return(response.get("taskDefinition", None))
+    return cache.get("task_definition", task_definition, describe)
+
+
+# list_services takes up to 100 results per page and one launch type and
+# scheduling strategy, describe_services up to 10 services
+LIST_PAGE_SIZE = 100
+DESCRIBE_SERVICES_BATCH_SIZE = 10
+
+def ecs_list_service_arns(client, cluster_name, launch_type, scheduling_strategy):
+    svc_arns = []
+    paginator = client.get_paginator('list_services')
+    response_iterator = paginator.paginate(
+        cluster = cluster_name,
+        launchType = launch_type,
+        schedulingStrategy = scheduling_strategy,
+        PaginationConfig={
+            'MaxItems': 5000,
+            'PageSize': LIST_PAGE_SIZE,
+        }
     )
-    return(response.get("taskDefinition", None))
+    for i in response_iterator:
+        svc_arns += i['serviceArns']
+    return svc_arns
 
+# runs one list paginator per launch type and scheduling strategy pair
+# concurrently, merges their service ARNs and describes them 10 at a time
+def ecs_list_services(client, cluster_name, launch_types, scheduling_strategies, jobs=1):
+    filters = [(lt, ss) for lt in launch_types for ss in scheduling_strategies]
+    with ThreadPoolExecutor(max_workers=max(1, min(max(jobs, len(filters)), 16))) as executor:
+        listings = [executor.submit(contextvars.copy_context().run, ecs_list_service_arns, client, cluster_name, lt, ss) for lt, ss in filters]
+        svc_arns = []
+        for listing in listings:
+            svc_arns += [arn for arn in listing.result() if arn not in svc_arns]
+        describes = [executor.submit(contextvars.copy_context().run, ecs_get_service_details, client, cluster_name, batch) for batch in batches(svc_arns, DESCRIBE_SERVICES_BATCH_SIZE)]
+        svc_defs = []
+        for describe in describes:
+            svc_defs += describe.result()
+    return svc_defs
 
 def ecs_get_service_details(client, cluster_name, services):
     response = client.describe_services(
@@ -178,7 +406,7 @@ def ecs_get_service_details(client, cluster_name, services):
     return(response.get("services",[]))
 
 
-def pick_ecs_cluster(client):
+def list_ecs_cluster_arns(client):
     cluster_list = []
     paginator = client.get_paginator('list_clusters')
     response_iterator = paginator.paginate(
@@ -189,6 +417,10 @@ def pick_ecs_cluster(client):
     )
     for i in response_iterator:
         cluster_list = cluster_list+i["clusterArns"]
+    return cluster_list
+
+def pick_ecs_cluster(client):
+    cluster_list = list_ecs_cluster_arns(client)
     if len(cluster_list)<=0:
         logger.critical("No ECS clusters found. Check AWS_REGION setting or pass --region_name")
         exit()
@@ -197,92 +429,245 @@ def pick_ecs_cluster(client):
     logger.info("Selected ECS cluster is %s"%(option))
     return(option.split("cluster/")[1])
 
-def write_yaml(filename, spec_list):
-    logging.info("Writing K8s spec to %s"%(filename))
-    yaml.Dumper.ignore_aliases = lambda self, data: True
-    with open(filename, 'w') as kf:
-      for spec in spec_list:
-          kf.write(yaml.dump(spec, Dumper=yaml.Dumper))
-          kf.write("---\n")
+# returns the names of the clusters matching any of the names or globs
+def list_ecs_clusters(client, patterns):
+    names = [arn.split("cluster/")[1] for arn in list_ecs_cluster_arns(client)]
+    return [name for name in names if any(fnmatch.fnmatchcase(name, p) for p in patterns)]
 
+# a service is exported again only if its task definition, deployments or
+# any of the service settings the parsers read have changed. SSM parameter
+# and secret values are not part of it, use --full_export to pick those up
+def ecs_service_state(svc_def, options):
+    config = {k: svc_def.get(k) for k in ["loadBalancers", "serviceRegistries", "desiredCount", "deploymentConfiguration", "networkConfiguration", "tags", "launchType", "schedulingStrategy"]}
+    config["sgp"] = bool(options.get("sgp"))
+    return {
+        "taskDefinition": svc_def.get("taskDefinition"),
+        "deployments": sorted(str(d.get("updatedAt","")) for d in svc_def.get("deployments",[])),
+        "config": hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    }
 
-def ecs_reader_writer(options):
-    client = boto3.client("ecs")
+def read_e2k_state(output_directory):
+    state_file = os.path.join(output_directory, STATE_FILE)
+    if not os.path.isfile(state_file):
+        return {}
+    with open(state_file, 'r') as sf:
+        try:
+            return json.loads(sf.read())
+        except ValueError:
+            logger.warning("Ignoring unreadable e2k state file %s"%(state_file))
+            return {}
+
+def write_e2k_state(output_directory, state):
+    state_file = os.path.join(output_directory, STATE_FILE)
+    with open(state_file, 'w') as sf:
+        sf.write(json.dumps(state, sort_keys=True, indent=2))
+        sf.write("\n")
+
+# returns True if the service was exported, False if it was skipped
+def ecs_service_export(svc_def, options, cluster_output_dir, writer, cache=None):
+    cache = cache or LookupCache()
     region_name = options.get("region_name","")
-    if len(region_name)>0:
-        client = boto3.client("ecs", config=Config(region_name = region_name))
-
-    cluster_name = options.get("cluster_name", "")
-    if len(cluster_name)<=0:
-        cluster_name = pick_ecs_cluster(client)
-
-    cluster_output_dir = os.path.join(options.get("output_directory"), cluster_name)
-    try:
-        os.makedirs(cluster_output_dir)
-    except FileExistsError:
-        pass
-    paginator = client.get_paginator('list_services')
-    response_iterator = paginator.paginate(
-        cluster = cluster_name,
-        launchType = "FARGATE",
-        schedulingStrategy = "REPLICA",
-        PaginationConfig={
-            'MaxItems': 5000,
-            'PageSize': 10,
-        }
-    )
-    for i in response_iterator:
-        svc_details = ecs_get_service_details(client, cluster_name, i['serviceArns'])
-        for svc_def in svc_details:
-            svc_name = svc_def.get("serviceName","")
-            if len(svc_name) <=0:
-                logger.error("Skipping ECS service without name")
-                continue
+    client = get_client("ecs", region_name)
+    svc_name = svc_def.get("serviceName","")
+    if len(svc_name) <=0:
+        logger.error("Skipping ECS service without name")
+        return False
 
-            task_def_arn = svc_def.get("taskDefinition")
-            if task_def_arn is None:
-                logger.error("Skipping service %s that has no task definition"%(svc_name))
-                continue
-            task_def = ecs_get_task_definition(client, task_def_arn) 
-            k8s_secrets_and_configmaps = get_ssm_and_secrets(region_name, task_def)
-            svc_lbs = svc_def.get("loadBalancers")
-            if svc_lbs is not None and len(svc_lbs)>0:
-                get_lb_details(region_name, svc_lbs)
-            svc_namespace = ""
-            svc_registries = svc_def.get("serviceRegistries")
-            if svc_registries is not None and len(svc_registries) > 0:
-                svc_registry_arn = svc_registries[0].get("registryArn")
-                if svc_registry_arn is not None and len(svc_registry_arn)>0:
-                    svc_namespace = get_cloudmap_namespace(region_name, svc_registry_arn)
-                
-            output_dir = os.path.join(cluster_output_dir, svc_name)
-            try:
-                os.makedirs(output_dir)
-            except FileExistsError:
-                pass
+    task_def_arn = svc_def.get("taskDefinition")
+    if task_def_arn is None:
+        logger.error("Skipping service %s that has no task definition"%(svc_name))
+        return False
+    # with --trace the lookups and files of the service are in this span
+    with stage("ecs_service_export", service=svc_name, cluster=options.get("cluster_name",""), region=region_name):
+        task_def = ecs_get_task_definition(client, task_def_arn, cache)
+        if task_def is None:
+            logger.error("Skipping service %s, task definition %s not found"%(svc_name, task_def_arn))
+            return False
+        k8s_secrets_and_configmaps = get_ssm_and_secrets(region_name, task_def, cache)
+        svc_lbs = svc_def.get("loadBalancers")
+        if svc_lbs is not None and len(svc_lbs)>0:
+            get_lb_details(region_name, svc_lbs, cache)
+        svc_namespace = ""
+        svc_registries = svc_def.get("serviceRegistries")
+        if svc_registries is not None and len(svc_registries) > 0:
+            svc_registry_arn = svc_registries[0].get("registryArn")
+            if svc_registry_arn is not None and len(svc_registry_arn)>0:
+                svc_namespace = get_cloudmap_namespace(region_name, svc_registry_arn, cache)
+        
+        output_dir = os.path.join(cluster_output_dir, svc_name)
+        sources = [svc_def.get("serviceArn", svc_name), task_def_arn]
+        with stage("ecs_parser"):
             k8s_yamls = ecs_parser(svc_def, task_def, k8s_secrets_and_configmaps)
-            for k,v in k8s_yamls.items():
-                if k == "security_group_policy" and not options.get("sgp"): continue
-                k8s_file = os.path.join(output_dir, svc_name+"_"+k+".yaml")
-                write_yaml(k8s_file,[v])
+        for k,v in k8s_yamls.items():
+            if k == "security_group_policy" and not options.get("sgp"): continue
+            k8s_file = os.path.join(output_dir, svc_name+"_"+k+".yaml")
+            write_yaml(writer, k8s_file, [v], sources)
 
+        with stage("ecs_parser"):
             k8s_yamls = ssm_secret_parser(k8s_secrets_and_configmaps)
-            for k,v in k8s_yamls.items():
-                k8s_file = os.path.join(output_dir, k+".yaml")
-                write_yaml(k8s_file, v)
-    
+        for k,v in k8s_yamls.items():
+            k8s_file = os.path.join(output_dir, k+".yaml")
+            write_yaml(writer, k8s_file, v, sources+list(k8s_secrets_and_configmaps.keys()))
+
+        with stage("ecs_parser"):
             k8s_yamls = ingress_parser(svc_def, svc_lbs)
-            for k,v in k8s_yamls.items():
+        for k,v in k8s_yamls.items():
+            k8s_file = os.path.join(output_dir, k+".yaml")
+            write_yaml(writer, k8s_file, v, sources+[lb.get("targetGroupArn","") for lb in svc_lbs])
+
+        if len(svc_namespace) > 0:
+            k8s_ns = namespace_parser(svc_namespace)
+            for k,v in k8s_ns.items():
                 k8s_file = os.path.join(output_dir, k+".yaml")
-                write_yaml(k8s_file, v)
-
-            if len(svc_namespace) > 0:
-                k8s_ns = namespace_parser(svc_namespace)
-                for k,v in k8s_ns.items():
-                    k8s_file = os.path.join(output_dir, k+".yaml")
-                    write_yaml(k8s_file, [v])
-            
-    logger.log(100, "Please see %s directory for kubernetes artifacts" %(options.get("output_directory")))
+                write_yaml(writer, k8s_file, [v], sources)
+    count("ecs.services_exported")
+    return True
 
+# All services of the cluster are described first. Services whose
+# ecs_service_state is the same as in previous_state keep their files from
+# the last run, the target groups and load balancers of the others are
+# described in batches and with jobs > 1 they are exported on a thread
+# pool. All workers share the pooled boto3 clients whose adaptive retry
+# mode backs off when the APIs throttle.
+# returns {"services": n, "unchanged": n, "failed": n, "api_calls": n,
+# "elapsed": seconds, "state": {service arn: state}}
+def ecs_cluster_export(options, cluster_output_dir, writer, previous_state={}):
+    start_time = time.time()
+    counter = CallCounter()
+    api_call_counter.set(counter)
+    region_name = options.get("region_name","")
+    cluster_name = options.get("cluster_name","")
+    client = get_client("ecs", region_name)
+    cache = LookupCache()
+    jobs = options.get("jobs", 1)
+    executor = None
+    futures = {}
+    failed = 0
+    with stage("ecs_list_services", cluster=cluster_name, region=region_name):
+        svc_defs = ecs_list_services(client, cluster_name, options.get("launch_types") or ["FARGATE"], options.get("scheduling_strategies") or ["REPLICA"], jobs)
+
+    state = {}
+    changed = []
+    for svc_def in svc_defs:
+        svc_arn = svc_def.get("serviceArn", svc_def.get("serviceName",""))
+        svc_state = ecs_service_state(svc_def, options)
+        if not options.get("full_export") and previous_state.get(svc_arn) == svc_state and writer.keep(os.path.join(cluster_output_dir, svc_def.get("serviceName",""))):
+            logger.debug("Skipping unchanged service %s"%(svc_arn))
+            state[svc_arn] = svc_state
+            continue
+        changed.append((svc_arn, svc_def, svc_state))
+    logger.info("%d of %d services in %s changed since the last run"%(len(changed), len(svc_defs), cluster_name))
+    count("ecs.services", len(svc_defs))
+    count("ecs.services_unchanged", len(svc_defs)-len(changed))
+    prefetch_lb_details(region_name, [svc_def for _, svc_def, _ in changed], cache)
+
+    # a failed or skipped service is counted and left out of the state so
+    # that the next run exports it again
+    def export_result(svc_arn, svc_name, svc_state, run):
+        try:
+            exported = run()
+        except Exception as error:
+            exported = False
+            logger.error("Failed to export service %s %s"%(svc_name, error))
+        if exported:
+            state[svc_arn] = svc_state
+        return 0 if exported else 1
+
+    if jobs > 1:
+        executor = ThreadPoolExecutor(max_workers=jobs)
+    for svc_arn, svc_def, svc_state in changed:
+        if executor is None:
+            failed += export_result(svc_arn, svc_def.get("serviceName",""), svc_state, lambda: ecs_service_export(svc_def, options, cluster_output_dir, writer, cache))
+        else:
+            # the copied context carries the call counter into the worker
+            futures[executor.submit(contextvars.copy_context().run, ecs_service_export, svc_def, options, cluster_output_dir, writer, cache)] = (svc_arn, svc_def.get("serviceName",""), svc_state)
+
+    if executor is not None:
+        for future, (svc_arn, svc_name, svc_state) in futures.items():
+            failed += export_result(svc_arn, svc_name, svc_state, future.result)
+        executor.shutdown()
+    if failed > 0:
+        logger.error("%d of %d services failed to export in %s"%(failed, len(changed), cluster_name))
+    cache.log_stats()
+    return {"services": len(svc_defs), "unchanged": len(svc_defs)-len(changed), "failed": failed, "api_calls": counter.calls, "elapsed": time.time()-start_time, "state": state}
 
+def print_export_summary(results, total_time):
+    lines = ["%-16s %-40s %8s %9s %8s %9s %8s"%("REGION", "CLUSTER", "SERVICES", "UNCHANGED", "FAILED", "API CALLS", "SECONDS")]
+    totals = {"services": 0, "unchanged": 0, "failed": 0, "api_calls": 0}
+    for region_name, cluster_name in sorted(results.keys()):
+        result = results[(region_name, cluster_name)]
+        if result is None:
+            lines.append("%-16s %-40s %8s"%(region_name or "default", cluster_name, "error"))
+            continue
+        lines.append("%-16s %-40s %8d %9d %8d %9d %8.1f"%(region_name or "default", cluster_name, result["services"], result["unchanged"], result["failed"], result["api_calls"], result["elapsed"]))
+        for k in totals:
+            totals[k] += result[k]
+    lines.append("Total %.1f seconds, %d clusters, %d services, %d unchanged, %d failed, %d API calls"%(total_time, len(results), totals["services"], totals["unchanged"], totals["failed"], totals["api_calls"]))
+    logger.log(100, "\n".join(lines))
 
+def cluster_state_key(region_name, cluster_name):
+    return (region_name or "default")+"/"+cluster_name
+
+# returns [(region, cluster, cluster output directory)]. A single cluster
+# is written to <output>/<cluster> as before, comma separated lists or
+# globs of clusters and regions are written to <output>/<region>/<cluster>
+def get_export_targets(options):
+    output_directory = options.get("output_directory")
+    region_patterns = [r.strip() for r in options.get("region_name","").split(",") if len(r.strip()) > 0] or [""]
+    cluster_patterns = [c.strip() for c in options.get("cluster_name","").split(",") if len(c.strip()) > 0]
+    if len(region_patterns) == 1 and len(cluster_patterns) <= 1 and not is_glob(region_patterns[0]) and not any(is_glob(c) for c in cluster_patterns):
+        region_name = region_patterns[0]
+        cluster_name = cluster_patterns[0] if len(cluster_patterns) > 0 else pick_ecs_cluster(get_client("ecs", region_name))
+        return [(region_name, cluster_name, os.path.join(output_directory, cluster_name))]
+    targets = []
+    for region_name in list_regions(region_patterns):
+        try:
+            clusters = list_ecs_clusters(get_client("ecs", region_name), cluster_patterns or ["*"])
+        except botocore.exceptions.ClientError as error:
+            logger.error("Unable to list ECS clusters in %s %s"%(region_name, error))
+            continue
+        for cluster_name in clusters:
+            targets.append((region_name, cluster_name, os.path.join(output_directory, region_name or "default", cluster_name)))
+    return targets
+
+# With several clusters, up to jobs clusters are exported at a time and
+# each of them exports up to jobs services at a time. With --api_rate the
+# clients of a region share one token bucket. returns False when no
+# cluster matches
+def ecs_reader_writer(options):
+    start_time = time.time()
+    configure_clients(options.get("record",""), options.get("replay",""), options.get("api_rate", 0))
+    targets = get_export_targets(options)
+    if len(targets) <= 0:
+        logger.critical("No ECS clusters match %s in %s"%(options.get("cluster_name",""), options.get("region_name","")))
+        return False
+    writer = open_output_writer(options)
+    # a writer that keeps the files in memory has nothing to compare with
+    state = read_e2k_state(options.get("output_directory")) if writer.on_disk else {}
+    results = {}
+    jobs = options.get("jobs", 1)
+    if len(targets) == 1:
+        region_name, cluster_name, cluster_output_dir = targets[0]
+        cluster_options = dict(options, region_name=region_name, cluster_name=cluster_name)
+        results[(region_name, cluster_name)] = contextvars.copy_context().run(ecs_cluster_export, cluster_options, cluster_output_dir, writer, state.get(cluster_state_key(region_name, cluster_name), {}))
+    else:
+        futures = {}
+        with ThreadPoolExecutor(max_workers=min(jobs, len(targets))) as executor:
+            for region_name, cluster_name, cluster_output_dir in targets:
+                cluster_options = dict(options, region_name=region_name, cluster_name=cluster_name)
+                futures[(region_name, cluster_name)] = executor.submit(contextvars.copy_context().run, ecs_cluster_export, cluster_options, cluster_output_dir, writer, state.get(cluster_state_key(region_name, cluster_name), {}))
+            for target, future in futures.items():
+                try:
+                    results[target] = future.result()
+                except Exception as error:
+                    results[target] = None
+                    logger.error("Failed to export cluster %s in %s %s"%(target[1], target[0] or "default", error))
+    print_export_summary(results, time.time()-start_time)
+    for (region_name, cluster_name), result in results.items():
+        if result is not None:
+            state[cluster_state_key(region_name, cluster_name)] = result["state"]
+    writer.close()
+    if writer.on_disk:
+        write_e2k_state(options.get("output_directory"), state)
+    logger.log(100, "Please see %s directory for kubernetes artifacts" %(options.get("output_directory")))
+    return True
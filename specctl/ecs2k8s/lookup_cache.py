@@ -0,0 +1,72 @@
+# // Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# // SPDX-License-Identifier: Apache-2.0
+import threading
+from concurrent.futures import Future
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Run-scoped memoization of AWS lookups. Services in a cluster often share
+# task definition revisions, SSM parameters, secrets and load balancers, so
+# each lookup is keyed by kind and ARN/name and made once per e2k run.
+# A key is claimed with a Future before it is fetched so concurrent workers
+# asking for the same key wait for the first fetch instead of repeating it.
+# Failed fetches are not cached.
+class LookupCache:
+    def __init__(self):
+        self.entries = {}
+        self.hits = {}
+        self.misses = {}
+        self.lock = threading.Lock()
+
+    def count(self, kind, hits, misses):
+        self.hits[kind] = self.hits.get(kind, 0) + hits
+        self.misses[kind] = self.misses.get(kind, 0) + misses
+
+    # returns fetch(key), calling it only if no one has yet for this key
+    def get(self, kind, key, fetch):
+        return self.get_many(kind, [key], lambda keys: {keys[0]: fetch(keys[0])}).get(key)
+
+    # returns {key: value} for keys, calling fetch(missing keys) once with
+    # the keys no one has fetched yet. fetch returns {key: value} and may
+    # leave out the keys it couldn't find, those are None for this call
+    # and are looked up again by the next one
+    def get_many(self, kind, keys, fetch):
+        claimed = []
+        waiting = {}
+        with self.lock:
+            for key in keys:
+                future = self.entries.get((kind, key))
+                if future is None:
+                    future = Future()
+                    self.entries[(kind, key)] = future
+                    claimed.append(key)
+                waiting[key] = future
+            self.count(kind, len(waiting)-len(claimed), len(claimed))
+        if len(claimed) > 0:
+            try:
+                values = fetch(claimed)
+            except BaseException as error:
+                self.release(kind, claimed, waiting)
+                for key in claimed:
+                    waiting[key].set_exception(error)
+                raise
+            missing = [key for key in claimed if values.get(key) is None]
+            self.release(kind, missing, waiting)
+            for key in claimed:
+                waiting[key].set_result(values.get(key))
+        return {key: future.result() for key, future in waiting.items()}
+
+    def release(self, kind, keys, futures):
+        with self.lock:
+            for key in keys:
+                if self.entries.get((kind, key)) is futures[key]:
+                    del self.entries[(kind, key)]
+
+    def stats(self):
+        with self.lock:
+            return {kind: {"hits": self.hits.get(kind, 0), "misses": self.misses[kind]} for kind in sorted(self.misses)}
+
+    def log_stats(self):
+        for kind, stat in self.stats().items():
+            logger.info("Lookup cache %s %d hits %d misses"%(kind, stat["hits"], stat["misses"]))
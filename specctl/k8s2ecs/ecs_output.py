@@ -2,6 +2,8 @@
 # // SPDX-License-Identifier: Apache-2.0
 import json
 from . import ecs_objects
+from .emitter import k2e_emit
+from ..output_writer import open_output_writer, OutputSink
 import os
 import copy
 import logging
@@ -92,40 +94,42 @@ def get_task_def(svc, additional_input):
 # additional input file input_file
 # The first two are to write the json output
 # The last input_file is to read additional json parameters for task/container/service
-def ecs_print(output_dict, options):
-    input_file = options.get("input_file")
-    additional_input = []
-    if len(input_file) > 0:
-        with open(input_file,'r') as ipf:
-            additional_input = json.loads(ipf.read())
-    for key, obj_list in output_dict.items():
-        if key == "services":
-            for svc in obj_list:
-                task_def = get_task_def(svc, additional_input)
-                svc_def = get_svc_def(svc, additional_input)
-                svc_namespace = svc.get("service_namespace")
-                svc_name = svc_def.get("serviceName","")
-                if svc_namespace is None or len(svc_namespace)<=0:
-                    svc_namespace = "default"
-
-                output_dir = os.path.join(options.get("output_directory"),svc_namespace, svc_name)
-
-                try:
-                    os.makedirs(output_dir)
-                except FileExistsError:
-                    pass
-
-                file_name = options.get("td_file")
-                td_file = os.path.join(output_dir, file_name)
-                logger.info("Writing task definition in %s"%(td_file))
-                with open(td_file,'w') as tdf:
-                    tdf.write(json.dumps(task_def,sort_keys=True, indent=2, separators=(',', ': ')))
-                    tdf.write("\n")
-                file_name = options.get("sd_file")
-                sd_file = os.path.join(output_dir, file_name)
-                logger.info("Writing service definition in %s"%(sd_file))
-                with open(sd_file,'w') as sdf:
-                    sdf.write(json.dumps(svc_def,sort_keys=True, indent=2, separators=(',', ': ')))
-                    sdf.write("\n")
-
-    logger.info("Please see %s directory for service and task definitions"%(options.get("output_directory")))
+class EcsJsonSink(OutputSink):
+    stage_name = "ecs_print"
+
+    def __init__(self, options, writer):
+        self.options = options
+        self.writer = writer
+        self.additional_input = []
+
+    def begin(self, output_dict):
+        input_file = self.options.get("input_file")
+        if len(input_file) > 0:
+            with open(input_file,'r') as ipf:
+                self.additional_input = json.loads(ipf.read())
+
+    def service(self, ctx):
+        svc = ctx["service"]
+        task_def = get_task_def(svc, self.additional_input)
+        svc_def = get_svc_def(svc, self.additional_input)
+        output_dir = ctx["output_dir"]
+
+        file_name = self.options.get("td_file")
+        td_file = os.path.join(output_dir, file_name)
+        logger.info("Writing task definition in %s"%(td_file))
+        self.writer.write(td_file, json.dumps(task_def,sort_keys=True, indent=2, separators=(',', ': '))+"\n", ctx["sources"])
+        file_name = self.options.get("sd_file")
+        sd_file = os.path.join(output_dir, file_name)
+        logger.info("Writing service definition in %s"%(sd_file))
+        self.writer.write(sd_file, json.dumps(svc_def,sort_keys=True, indent=2, separators=(',', ': '))+"\n", ctx["sources"])
+
+    def end(self, contexts):
+        logger.info("Please see %s directory for service and task definitions"%(self.options.get("output_directory")))
+
+def ecs_print(output_dict, options, writer=None):
+    own_writer = writer is None
+    if own_writer:
+        writer = open_output_writer(options)
+    k2e_emit(output_dict, options, [EcsJsonSink(options, writer)])
+    if own_writer:
+        writer.close()
@@ -0,0 +1,55 @@
+# // Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# // SPDX-License-Identifier: Apache-2.0
+import os
+from concurrent.futures import ThreadPoolExecutor
+from .k8s_parser import k8s_service_sources
+from ..profiler import stage
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Everything the sinks need to know about one service, computed once.
+# The parsed service itself is not modified so the result doesn't depend
+# on which sinks run or in what order.
+def service_context(svc, options):
+    svc_namespace = svc.get("service_namespace")
+    if svc_namespace is None or len(svc_namespace)<=0:
+        svc_namespace = "default"
+    svc_name = svc.get("service_name")
+    if svc_name is None or len(svc_name)<=0:
+        svc_name = svc.get("deployment",{}).get("deployment_name","")
+    return {
+        "service": svc,
+        "namespace": svc_namespace,
+        "name": svc_name,
+        "output_dir": os.path.join(options.get("output_directory"), svc_namespace, svc_name),
+        "sources": k8s_service_sources(svc)
+    }
+
+# Single pass over the parsed K8s services, every service is visited once
+# and handed to each sink (ECS JSON, Terraform, ...). With jobs > 1 the per
+# service work runs on a thread pool which helps on slow output disks.
+def k2e_emit(output_dict, options, sinks):
+    for sink in sinks:
+        with stage(sink.stage_name):
+            sink.begin(output_dict)
+    contexts = [service_context(svc, options) for svc in output_dict.get("services",[])]
+
+    def emit_service(ctx):
+        for sink in sinks:
+            with stage(sink.stage_name, namespace=ctx["namespace"], service=ctx["name"]):
+                sink.service(ctx)
+
+    jobs = options.get("jobs", 1)
+    if jobs > 1 and len(contexts) > 1:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            # list() re-raises the first exception of any worker
+            list(executor.map(emit_service, contexts))
+    else:
+        for ctx in contexts:
+            emit_service(ctx)
+
+    for sink in sinks:
+        with stage(sink.stage_name):
+            sink.end(contexts)
+    return
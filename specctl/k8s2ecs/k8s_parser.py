@@ -4,6 +4,7 @@ import base64
 import json
 from ..utils import dict_check, vcpu_k8s_to_ecs, mem_k8s_to_ecs, get_fargate_sku
 from .ingress import k8s_ingress_handler, merge_ingress, create_ingress_target_groups
+from ..profiler import stage, count
 import logging
 
 logger = logging.getLogger(__name__)
@@ -585,6 +586,22 @@ def associate_sgp_to_pod(sgps, sas, svcs):
                     dep["security_group_ids"]=sgp["sgp_ids"]
                     dep["create_security_group"]=False
 
+# reference to a K8s object like Deployment/default/nginx
+# used to record which input objects produced an output file
+def k8s_object_ref(kind, namespace, name):
+    if namespace is None or len(namespace) <= 0:
+        namespace = "default"
+    return "%s/%s/%s"%(kind, namespace, str(name))
+
+def k8s_service_sources(svc):
+    sources = []
+    if "service_type" in svc:
+        sources.append(k8s_object_ref("Service", svc.get("service_namespace"), svc.get("service_name")))
+    dep = svc.get("deployment")
+    if dep is not None:
+        sources.append(k8s_object_ref("Deployment", dep.get("deployment_namespace"), dep.get("deployment_name")))
+    return sources
+
 # The dictionary objects for input are K8s specifications.
 # These spec are then further parsed to extract relevant informtation from K8s objects
 # such as deployments, secrets, configmap, service, pod, and container
@@ -602,49 +619,58 @@ def k8s_parser(dict_list):
     configs_and_secrets = []
     service_accounts = []
     security_groups = []
+    shared_sources = []
     for k8s_obj in dict_list:
         if k8s_obj is None:
             continue
         kind = k8s_obj.get("kind","")
-        if kind == "Deployment":
-            output_dict["deployments"].append(k8s_deployment_handler(k8s_obj))
-        if kind == "Service":
-            output_dict["services"].append(k8s_service_handler(k8s_obj))
-        if kind == "Pod":
-            output_dict["pods"].append(k8s_pod_handler(k8s_obj))
-        if kind == "ConfigMap":
-            ssm_parameter_list+=k8s_config_handler(k8s_obj)
-            configs_and_secrets.append(k8s_obj)
-        if kind == "Secret":
-            secret_parameter_list+=k8s_secret_handler(k8s_obj)
-            configs_and_secrets.append(k8s_obj)
-        if kind == "Ingress":
-            ingress_list.append(k8s_ingress_handler(k8s_obj))
-        if kind == "ServiceAccount":
-            service_accounts.append(k8s_sa_handler(k8s_obj))
-        if kind == "SecurityGroupPolicy":
-            security_groups.append(k8s_sgp_handler(k8s_obj))
+        metadata = k8s_obj.get("metadata") or {}
+        count("k8s.objects."+(kind or "unknown"))
+        with stage("k8s_parser."+(kind or "unknown"), kind=kind, namespace=metadata.get("namespace") or "default", name=metadata.get("name") or ""):
+            if kind in ["ConfigMap", "Secret", "Ingress"]:
+                shared_sources.append(k8s_object_ref(kind, metadata.get("namespace"), metadata.get("name")))
+            if kind == "Deployment":
+                output_dict["deployments"].append(k8s_deployment_handler(k8s_obj))
+            if kind == "Service":
+                output_dict["services"].append(k8s_service_handler(k8s_obj))
+            if kind == "Pod":
+                output_dict["pods"].append(k8s_pod_handler(k8s_obj))
+            if kind == "ConfigMap":
+                ssm_parameter_list+=k8s_config_handler(k8s_obj)
+                configs_and_secrets.append(k8s_obj)
+            if kind == "Secret":
+                secret_parameter_list+=k8s_secret_handler(k8s_obj)
+                configs_and_secrets.append(k8s_obj)
+            if kind == "Ingress":
+                ingress_list.append(k8s_ingress_handler(k8s_obj))
+            if kind == "ServiceAccount":
+                service_accounts.append(k8s_sa_handler(k8s_obj))
+            if kind == "SecurityGroupPolicy":
+                security_groups.append(k8s_sgp_handler(k8s_obj))
 
     output_dict["configmaps"]=[{"ssm_parameters":ssm_parameter_list}]
     output_dict["secrets"]=[{"ssm_secrets":secret_parameter_list}]
 
     # associate services to deployments
-    associated_services = associate_svc_to_dep(output_dict["services"],output_dict["deployments"])
-    merge_services(associated_services)
-    associate_task_iam_role(associated_services, service_accounts)
-    associate_sgp_to_pod(security_groups, service_accounts, associated_services)
-    fill_envfrom(associated_services, configs_and_secrets)
-    handle_named_ports(associated_services)
-    configure_lb_health_check(associated_services)
-    create_ingress_target_groups(ingress_list, associated_services)
-    output_dict["ingress"]=merge_ingress(ingress_list)
+    with stage("associations"):
+        associated_services = associate_svc_to_dep(output_dict["services"],output_dict["deployments"])
+        merge_services(associated_services)
+        associate_task_iam_role(associated_services, service_accounts)
+        associate_sgp_to_pod(security_groups, service_accounts, associated_services)
+        fill_envfrom(associated_services, configs_and_secrets)
+        handle_named_ports(associated_services)
+        configure_lb_health_check(associated_services)
+        create_ingress_target_groups(ingress_list, associated_services)
+        output_dict["ingress"]=merge_ingress(ingress_list)
     output_dict["services"]=associated_services
+    count("k8s.services", len(associated_services))
     namespaces=[]
     for svc in associated_services:
         svc_namespace = svc.get("service_namespace")
         if svc_namespace is not None and len(svc_namespace)>0:
             namespaces.append(svc_namespace)
     output_dict["namespaces"]=[*set(namespaces)]
+    output_dict["shared_sources"]=shared_sources
 
     # print(output_dict)
     return(output_dict)
@@ -5,6 +5,8 @@ from pprint import pprint
 import json
 import yaml
 from pick import pick
+import threading
+from ..profiler import timed, stage
 import logging
 
 logger = logging.getLogger(__name__)
@@ -27,18 +29,31 @@ def pick_k8s_context():
     logger.info("Selected kubeconfig context is %s"%(option))
     return(option)
 
+# one ApiClient per kubeconfig context for the life of the process, so the
+# requests of specctl -m serve reuse the kubeconfig and the connections
+_api_clients = {}
+_api_clients_lock = threading.Lock()
+
+def get_api_client(contextname):
+    with _api_clients_lock:
+        api_client = _api_clients.get(contextname)
+        if api_client is None:
+            api_client = config.new_client_from_config(context=contextname)
+            _api_clients[contextname] = api_client
+    return api_client
+
+@timed("read")
 def k8s_cluster_extract(namespace_list, contextname=""):
     if len(contextname)<=0:
         contextname = pick_k8s_context()
 
-    config.load_kube_config(context=contextname)
-
-    #config.load_kube_config()
-    coreApiV1 = client.CoreV1Api()
-    appsApiV1 = client.AppsV1Api()
-    netApiV1  = client.NetworkingV1Api()
-    coApiV1   = client.CustomObjectsApi()
-    ns_objs = coreApiV1.list_namespace()
+    api_client = get_api_client(contextname)
+    coreApiV1 = client.CoreV1Api(api_client)
+    appsApiV1 = client.AppsV1Api(api_client)
+    netApiV1  = client.NetworkingV1Api(api_client)
+    coApiV1   = client.CustomObjectsApi(api_client)
+    with stage("k8s_api.list_namespace", context=contextname):
+        ns_objs = coreApiV1.list_namespace()
     namespaces = []
     all_namespaces = []
     for ns in ns_objs.items:
@@ -62,7 +77,8 @@ def k8s_cluster_extract(namespace_list, contextname=""):
     for ns in namespaces:
         if ns.startswith("kube-"):
             continue
-        svc_objs = coreApiV1.list_namespaced_service(ns)
+        with stage("k8s_api.list_namespaced_service", context=contextname, namespace=ns, kind="Service"):
+            svc_objs = coreApiV1.list_namespaced_service(ns)
         logger.info("%s namespace has %d services"%(ns,len(svc_objs.items)))
         for svc in svc_objs.items:
             annt = svc.metadata.annotations
@@ -70,7 +86,8 @@ def k8s_cluster_extract(namespace_list, contextname=""):
                 last_cfg = annt.get("kubectl.kubernetes.io/last-applied-configuration")
                 if last_cfg is not None:
                     services.append(json.loads(last_cfg))
-        dep_objs = appsApiV1.list_namespaced_deployment(ns)
+        with stage("k8s_api.list_namespaced_deployment", context=contextname, namespace=ns, kind="Deployment"):
+            dep_objs = appsApiV1.list_namespaced_deployment(ns)
         logger.info("%s namespace has %d deployments"%(ns,len(dep_objs.items)))
         for dep in dep_objs.items:
             annt = dep.metadata.annotations
@@ -78,7 +95,8 @@ def k8s_cluster_extract(namespace_list, contextname=""):
                 last_cfg = annt.get("kubectl.kubernetes.io/last-applied-configuration")
                 if last_cfg is not None:
                     deployments.append(json.loads(last_cfg))
-        cfgmap_objs = coreApiV1.list_namespaced_config_map(ns)
+        with stage("k8s_api.list_namespaced_config_map", context=contextname, namespace=ns, kind="ConfigMap"):
+            cfgmap_objs = coreApiV1.list_namespaced_config_map(ns)
         logger.info("%s namespace has %d configmaps"%(ns,len(cfgmap_objs.items)))
         for cfgmap in cfgmap_objs.items:
             annt = cfgmap.metadata.annotations
@@ -87,7 +105,8 @@ def k8s_cluster_extract(namespace_list, contextname=""):
                 if last_cfg is not None:
                     configmaps.append(json.loads(last_cfg))
 
-        secret_objs = coreApiV1.list_namespaced_secret(ns)
+        with stage("k8s_api.list_namespaced_secret", context=contextname, namespace=ns, kind="Secret"):
+            secret_objs = coreApiV1.list_namespaced_secret(ns)
         logger.info("%s namespace has %d secrets"%(ns,len(secret_objs.items)))
         for secret in secret_objs.items:
             annt = secret.metadata.annotations
@@ -96,7 +115,8 @@ def k8s_cluster_extract(namespace_list, contextname=""):
                 if last_cfg is not None:
                     secrets.append(json.loads(last_cfg))
         
-        ingress_objs = netApiV1.list_namespaced_ingress(ns)
+        with stage("k8s_api.list_namespaced_ingress", context=contextname, namespace=ns, kind="Ingress"):
+            ingress_objs = netApiV1.list_namespaced_ingress(ns)
         logger.info("%s namespace has %d ingress objects"%(ns,len(ingress_objs.items)))
         for ig in ingress_objs.items:
             annt = ig.metadata.annotations
@@ -105,7 +125,8 @@ def k8s_cluster_extract(namespace_list, contextname=""):
                 if last_cfg is not None:
                     ingress.append(json.loads(last_cfg))
         
-        sa_objects = coreApiV1.list_namespaced_service_account(ns)
+        with stage("k8s_api.list_namespaced_service_account", context=contextname, namespace=ns, kind="ServiceAccount"):
+            sa_objects = coreApiV1.list_namespaced_service_account(ns)
         logger.info("%s namespace has %d service_account objects"%(ns,len(sa_objects.items)))
         for sa in sa_objects.items:
             annt = sa.metadata.annotations
@@ -120,7 +141,8 @@ def k8s_cluster_extract(namespace_list, contextname=""):
                     sa_obj["metadata"]["annotations"] = sa.metadata.annotations
                     sa_obj["metadata"]["labels"] = sa.metadata.labels
                     service_accounts.append(sa_obj)
-        sgp_objects = coApiV1.list_namespaced_custom_object("vpcresources.k8s.aws", "v1beta1", ns, "securitygrouppolicies")
+        with stage("k8s_api.list_namespaced_custom_object", context=contextname, namespace=ns, kind="SecurityGroupPolicy"):
+            sgp_objects = coApiV1.list_namespaced_custom_object("vpcresources.k8s.aws", "v1beta1", ns, "securitygrouppolicies")
         logger.info("%s namespace has %d pod security group objects"%(ns,len(sgp_objects["items"])))
         for sgp in sgp_objects["items"]:
             annt = sgp["metadata"]["annotations"]
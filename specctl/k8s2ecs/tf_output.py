@@ -2,38 +2,145 @@
 # // SPDX-License-Identifier: Apache-2.0
 import json
 import os
-import shutil
+import re
+import threading
+from .emitter import k2e_emit
+from ..output_writer import open_output_writer, OutputSink
 import logging
 
 logger = logging.getLogger(__name__)
 
+# --tf_layout namespace writes roots/<namespace>, cluster writes roots/cluster
+GROUPED_ROOTS_DIR = "roots"
+CLUSTER_ROOT = "cluster"
+
 # This will generate TFvars format output key = value
 def hcl_fmt(value):
     if type(value) == int or type(value) == float:
         return str(value)
     return (json.dumps(value, indent=2, separators=[",", " = "]))
 
-def write_hcl(key, value, tf_file):
-    with open(tf_file, 'a') as tf:
-        tf.write(key.strip()+" = "+hcl_fmt(value)+"\n")
+def hcl_line(key, value):
+    return key.strip()+" = "+hcl_fmt(value)+"\n"
 
-def write_hcl_dict(dict_obj, tf_file, ignore_keys=[]):
+def hcl_dict(dict_obj, ignore_keys=[]):
+    lines = []
     for key, value in dict_obj.items():
         if key in ignore_keys:
             continue
-        write_hcl(key, value, tf_file)
+        lines.append(hcl_line(key, value))
+    return "".join(lines)
+
+def hcl_dict_list(dict_list_obj, ignore_keys=[]):
+    return "".join(hcl_dict(dict_obj, ignore_keys) for dict_obj in dict_list_obj)
+
+# Module files are read once per process and again only when they change,
+# every service copies the same few files and specctl -m serve keeps them
+# across requests. {path: ((mtime, size), content bytes)}
+_tf_file_cache = {}
+_tf_file_cache_lock = threading.Lock()
 
-def write_hcl_dict_list(dict_list_obj, tf_file, ignore_keys=[]):
-    for dict_obj in dict_list_obj:
-        write_hcl_dict(dict_obj, tf_file, ignore_keys)
+def read_tf_file(src_file):
+    st = os.stat(src_file)
+    signature = (st.st_mtime_ns, st.st_size)
+    with _tf_file_cache_lock:
+        cached = _tf_file_cache.get(src_file)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    with open(src_file, 'rb') as sf:
+        content = sf.read()
+    with _tf_file_cache_lock:
+        _tf_file_cache[src_file] = (signature, content)
+    return content
 
-def copy_tf_modules(src_dir, dest_dir, tf_files):
+# the file as text with universal newlines like open(src_file, 'r')
+def read_tf_text(src_file):
+    return read_tf_file(src_file).decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+
+def copy_tf_modules(src_dir, dest_dir, tf_files, writer, sources=[]):
     for fn in tf_files:
         src_file = os.path.join(src_dir, fn)
         if not os.path.isfile(src_file): continue
         logger.info("Copying TF modules %s to %s"%(src_file, dest_dir))
-        shutil.copy(src_file, dest_dir)
+        writer.write(os.path.join(dest_dir, fn), read_tf_file(src_file), sources)
     return
+
+# returns the index just past the bracket that closes the one at index start
+# quoted strings are skipped while counting
+def hcl_block_end(text, start):
+    depth = 0
+    in_string = False
+    i = start
+    while i < len(text):
+        ch = text[i]
+        if in_string:
+            if ch == "\\":
+                i += 1
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[(":
+            depth += 1
+        elif ch in "}])":
+            depth -= 1
+            if depth == 0:
+                return i+1
+        i += 1
+    return len(text)
+
+# removes top level blocks like provider "aws" { ... } from HCL text
+def strip_hcl_blocks(text, block_type):
+    expr = re.compile(r'^%s\s+"[^"]*"\s*\{'%(block_type), re.MULTILINE)
+    mo = expr.search(text)
+    while mo is not None:
+        end = hcl_block_end(text, mo.end()-1)
+        text = text[:mo.start()]+text[end:].lstrip("\n")
+        mo = expr.search(text)
+    return text
+
+# Modules that configure their own provider cannot be used with for_each,
+# so the provider blocks are dropped and configured once in the root instead
+def copy_tf_modules_without_providers(src_dir, dest_dir, tf_files, writer, sources=[]):
+    for fn in tf_files:
+        src_file = os.path.join(src_dir, fn)
+        if not os.path.isfile(src_file): continue
+        logger.info("Copying TF modules %s to %s"%(src_file, dest_dir))
+        text = read_tf_text(src_file)
+        writer.write(os.path.join(dest_dir, fn), strip_hcl_blocks(text, "provider"), sources)
+    return
+
+# reads the variable blocks of a module and returns
+# {variable_name: default expression text or None if required}
+def get_tf_module_variables(src_dir, tf_files):
+    variables = {}
+    var_expr = re.compile(r'^variable\s+"([^"]+)"\s*\{', re.MULTILINE)
+    default_expr = re.compile(r'^\s*default\s*=\s*', re.MULTILINE)
+    for fn in tf_files:
+        src_file = os.path.join(src_dir, fn)
+        if not os.path.isfile(src_file): continue
+        text = read_tf_text(src_file)
+        for mo in var_expr.finditer(text):
+            block = text[mo.end()-1:hcl_block_end(text, mo.end()-1)]
+            default = None
+            dmo = default_expr.search(block)
+            if dmo is not None:
+                value = block[dmo.end():]
+                if value[:1] in "{[":
+                    default = value[:hcl_block_end(value, 0)]
+                else:
+                    default = value.split("\n")[0].strip()
+            variables[mo.group(1)] = default
+    return variables
+
+def get_tf_module_outputs(src_dir, tf_files):
+    outputs = []
+    output_expr = re.compile(r'^output\s+"([^"]+)"\s*\{', re.MULTILINE)
+    for fn in tf_files:
+        src_file = os.path.join(src_dir, fn)
+        if not os.path.isfile(src_file): continue
+        outputs += output_expr.findall(read_tf_text(src_file))
+    return outputs
 def get_tf_modules_directory_map(tf_modules_directory, tf_modules_name_map):
     tf_modules_list = tf_modules_name_map.split(",")
     tf_modules_directory_map = {}
@@ -46,80 +153,165 @@ def get_tf_modules_directory_map(tf_modules_directory, tf_modules_name_map):
             logger.error("Terraform module path %s for key %s doesn't exist"%(value_with_path,key))
     return tf_modules_directory_map
 
-def terraform_print(output_dict, options):
-    # where are the terraform modules
-    tf_modules_directory = options.get("tf_modules_directory")
-    tf_modules_name_map = options.get("tf_modules_name_map")
-    tf_files = [f.strip() for f in options.get("tf_files").split(",")]
-    tf_modules_directory_map = get_tf_modules_directory_map(tf_modules_directory, tf_modules_name_map)
+# returns the (key, value) pairs written in a service tfvars file
+def get_service_tfvars(svc, svc_namespace):
+    tfvars = []
+    lb_ports = svc.get("lb_ports",[])
+    lb_container_name = ""
+    if len(lb_ports) > 0:
+        tfvars += lb_ports[0].items()
+        lb_container_name = lb_ports[0].get("lb_container_name","")
+
+    dep = svc.get("deployment", None)
+    if dep is not None:
+        containers = dep.get("containers",[])
+        cont_dict = {}
+        for c in containers:
+            c_name = c.get("name")
+            cont_dict[c_name] = c
+        tfvars.append(("containers", cont_dict))
+
+        if lb_container_name == "" and len(containers) >0:
+            lb_container_name = containers[0].get("name")
+            tfvars.append(("lb_container_name", lb_container_name))
+
+        tfvars += [(k, v) for k, v in dep.items() if k != "containers"]
+
+    svc_vars = dict(svc)
+    svc_vars["service_namespace"] = svc_namespace
+    tfvars += [(k, v) for k, v in svc_vars.items() if k not in ["deployment","lb_ports"]]
+    return tfvars
+
+def get_service_tf_module(svc):
+    if svc.get("service_type","ClusterIP") == "LoadBalancer":
+        return "ecs-lb-service"
+    return "ecs-backend-service"
+
+def tf_identifier(name):
+    return name.replace("-","_")
+
+# Writes a single Terraform root holding every service of a namespace or cluster.
+# module_services is {tf_module: {service_key: service tfvars}} and each module
+# is copied once under modules/ and instantiated with for_each over its map
+def write_grouped_root(root_dir, module_services, tf_modules_directory_map, tf_files, options, writer, sources):
+    root_modules_dir = os.path.join(root_dir, "modules")
+    main_tf = ['provider "aws" {\n  region = var.region\n}\n',
+               'variable "region" {\n  description = "The aws region for the services"\n  type        = string\n  default     = "us-west-2"\n}\n']
+    tfvars_file = os.path.join(root_dir, options.get("tfvars_file"))
+    tfvars = ["# TFvars generated by parsing K8s Services and Deployments\n"]
+
+    for tf_module in sorted(module_services.keys()):
+        services = module_services[tf_module]
+        src_dir = tf_modules_directory_map[tf_module]
+        module_dir = os.path.join(root_modules_dir, tf_module)
+        copy_tf_modules_without_providers(src_dir, module_dir, tf_files, writer)
+        module_variables = get_tf_module_variables(src_dir, tf_files)
+        used_keys = set()
+        for svc_tfvars in services.values():
+            used_keys.update(svc_tfvars.keys())
+
+        var_name = tf_identifier(tf_module)+"s"
+        module_name = tf_identifier(tf_module)
+        main_tf.append('variable "%s" {\n  description = "Map of services created with the %s module"\n  type        = any\n  default     = {}\n}\n'%(var_name, tf_module))
+        module_args = ['  source   = "./modules/%s"'%(tf_module), "  for_each = var.%s\n"%(var_name)]
+        if "region" in module_variables:
+            module_args.append("  region = var.region")
+        for key in sorted(used_keys):
+            if key == "region" or key not in module_variables: continue
+            default = module_variables[key]
+            if default is None:
+                module_args.append("  %s = each.value.%s"%(key, key))
+            else:
+                module_args.append("  %s = try(each.value.%s, %s)"%(key, key, default))
+        main_tf.append('module "%s" {\n%s\n}\n'%(module_name, "\n".join(module_args)))
+        for output in get_tf_module_outputs(src_dir, tf_files):
+            main_tf.append('output "%s_%s" {\n  value = { for k, m in module.%s : k => m.%s }\n}\n'%(module_name, output, module_name, output))
+
+        logger.info("Writing %d services for %s module to %s"%(len(services), tf_module, tfvars_file))
+        tfvars.append(hcl_line(var_name, services))
+
+    writer.write(tfvars_file, "".join(tfvars), sources)
+    main_tf_file = os.path.join(root_dir, "main.tf")
+    logger.info("Writing Terraform root module %s"%(main_tf_file))
+    writer.write(main_tf_file, "# Terraform root generated by specctl\n\n"+"\n".join(main_tf), sources)
+    # the required providers of the service modules also apply to the root
+    for tf_module in module_services.keys():
+        versions_file = os.path.join(tf_modules_directory_map[tf_module], "versions.tf")
+        if "versions.tf" in tf_files and os.path.isfile(versions_file):
+            writer.write(os.path.join(root_dir, "versions.tf"), read_tf_file(versions_file))
+            break
+    return
+
+class TerraformSink(OutputSink):
+    stage_name = "terraform_print"
+
+    def __init__(self, options, writer):
+        self.options = options
+        self.writer = writer
+        # where are the terraform modules
+        tf_modules_directory = options.get("tf_modules_directory")
+        tf_modules_name_map = options.get("tf_modules_name_map")
+        self.tf_files = [f.strip() for f in options.get("tf_files").split(",")]
+        self.tf_modules_directory_map = get_tf_modules_directory_map(tf_modules_directory, tf_modules_name_map)
+        self.tf_layout = options.get("tf_layout","service")
 
     # ssm secrets, parameters, and namespaces are written in output/namespaces/terraform.tfvars
-    output_dir = os.path.join(options.get("output_directory"),"namespaces")
-    try:
-        os.makedirs(output_dir)
-    except FileExistsError:
-        pass
-    tfvars_file = os.path.join(output_dir, options.get("tfvars_file"))
-    with open(tfvars_file, 'w') as tf:
-        tf.write("# TFvars generated by parsing K8s ConfigMaps, Secrets, and Namespaces \n")
-    ingress = output_dict.get("ingress",{})
-    configmaps = output_dict.get("configmaps",[])
-    secrets = output_dict.get("secrets",[])
-    namespaces = output_dict.get("namespaces",[])
-    namespaces.append("default")
-    namespaces = [*set(namespaces)]
-    total_params = configmaps+secrets
-    logger.info("Writing %d configmaps %d secrets and %d namespaces in %s"%(len(configmaps), len(secrets), len(namespaces), tfvars_file))
-    write_hcl_dict_list(total_params, tfvars_file, [])
-    write_hcl("namespaces", namespaces, tfvars_file)
-    write_hcl_dict(ingress, tfvars_file)
-    copy_tf_modules(tf_modules_directory_map.get("namespaces"), output_dir, tf_files)
+    def begin(self, output_dict):
+        output_dir = os.path.join(self.options.get("output_directory"),"namespaces")
+        tfvars_file = os.path.join(output_dir, self.options.get("tfvars_file"))
+        tfvars = ["# TFvars generated by parsing K8s ConfigMaps, Secrets, and Namespaces \n"]
+        ingress = output_dict.get("ingress",{})
+        configmaps = output_dict.get("configmaps",[])
+        secrets = output_dict.get("secrets",[])
+        namespaces = sorted(set(output_dict.get("namespaces",[])+["default"]))
+        sources = output_dict.get("shared_sources",[])+["Namespace/%s"%(n) for n in namespaces]
+        total_params = configmaps+secrets
+        logger.info("Writing %d configmaps %d secrets and %d namespaces in %s"%(len(configmaps), len(secrets), len(namespaces), tfvars_file))
+        tfvars.append(hcl_dict_list(total_params, []))
+        tfvars.append(hcl_line("namespaces", namespaces))
+        tfvars.append(hcl_dict(ingress))
+        self.writer.write(tfvars_file, "".join(tfvars), sources)
+        copy_tf_modules(self.tf_modules_directory_map.get("namespaces"), output_dir, self.tf_files, self.writer)
+
     # rest are written in output/namespace/service/terraform.tfvars
-    services = output_dict.get("services",[])
-    for svc in services:
-        svc_namespace = svc.get("service_namespace")
-        svc_name = svc.get("service_name","")
-        if svc_namespace is None or len(svc_namespace)<=0:
-            svc_namespace = "default"
-            svc["service_namespace"]="default"
-        output_dir = os.path.join(options.get("output_directory"),svc_namespace, svc_name)
-        try:
-            os.makedirs(output_dir)
-        except FileExistsError:
-            pass
-
-        file_name = options.get("tfvars_file")
-        tfvars_file = os.path.join(output_dir, file_name)
+    # or grouped into one root per namespace or for the whole cluster in end()
+    def service(self, ctx):
+        if self.tf_layout != "service":
+            return
+        svc = ctx["service"]
+        tfvars_file = os.path.join(ctx["output_dir"], self.options.get("tfvars_file"))
         logger.info("Writing service tfvars to %s"%(tfvars_file))
-        with open(tfvars_file, 'w') as tf:
-            tf.write("# TFvars generated by parsing K8s Service and Deployment\n")
-
-        lb_ports = svc.get("lb_ports",[])
-        lb_container_name = ""
-        if len(lb_ports) > 0:
-            write_hcl_dict(lb_ports[0], tfvars_file)
-            lb_container_name = lb_ports[0].get("lb_container_name","")
-
-        dep = svc.get("deployment", None)
-        if dep is not None:
-            containers = dep.get("containers",[])
-            cont_dict = {}
-            for c in containers:
-                c_name = c.get("name")
-                cont_dict[c_name] = c
-            write_hcl_dict({"containers":cont_dict}, tfvars_file)
-
-            if lb_container_name == "" and len(containers) >0:
-                lb_container_name = containers[0].get("name")
-                write_hcl("lb_container_name", lb_container_name, tfvars_file)
-
-            write_hcl_dict(dep, tfvars_file, ["containers"])
-
-        write_hcl_dict(svc, tfvars_file, ["deployment","lb_ports"])
-        svc_type = svc.get("service_type","ClusterIP")
-        if svc_type == "LoadBalancer":
-            copy_tf_modules(tf_modules_directory_map["ecs-lb-service"], output_dir, tf_files)
-        else:
-            copy_tf_modules(tf_modules_directory_map["ecs-backend-service"], output_dir, tf_files)
-
-    logger.log(100, "Please see %s directory for terraform tfvars" %(options.get("output_directory")))
+        tfvars = ["# TFvars generated by parsing K8s Service and Deployment\n"]
+        for key, value in get_service_tfvars(svc, ctx["namespace"]):
+            tfvars.append(hcl_line(key, value))
+        self.writer.write(tfvars_file, "".join(tfvars), ctx["sources"])
+        copy_tf_modules(self.tf_modules_directory_map[get_service_tf_module(svc)], ctx["output_dir"], self.tf_files, self.writer)
+
+    def end(self, contexts):
+        if self.tf_layout != "service":
+            grouped_services = {}
+            grouped_sources = {}
+            # grouped roots live under roots/ so that a K8s namespace named
+            # namespaces or services can't overwrite another root
+            roots_dir = os.path.join(self.options.get("output_directory"), GROUPED_ROOTS_DIR)
+            for ctx in contexts:
+                root_dir = os.path.join(roots_dir, CLUSTER_ROOT)
+                svc_key = ctx["namespace"]+"/"+ctx["name"]
+                if self.tf_layout == "namespace":
+                    root_dir = os.path.join(roots_dir, ctx["namespace"])
+                    svc_key = ctx["name"]
+                root = grouped_services.setdefault(root_dir, {})
+                tf_module = get_service_tf_module(ctx["service"])
+                root.setdefault(tf_module, {})[svc_key] = dict(get_service_tfvars(ctx["service"], ctx["namespace"]))
+                grouped_sources.setdefault(root_dir, []).extend(ctx["sources"])
+            for root_dir, module_services in grouped_services.items():
+                write_grouped_root(root_dir, module_services, self.tf_modules_directory_map, self.tf_files, self.options, self.writer, grouped_sources[root_dir])
+        logger.log(100, "Please see %s directory for terraform tfvars" %(self.options.get("output_directory")))
+
+def terraform_print(output_dict, options, writer=None):
+    own_writer = writer is None
+    if own_writer:
+        writer = open_output_writer(options)
+    k2e_emit(output_dict, options, [TerraformSink(options, writer)])
+    if own_writer:
+        writer.close()
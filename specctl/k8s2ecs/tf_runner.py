@@ -0,0 +1,186 @@
+# // Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# // SPDX-License-Identifier: Apache-2.0
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Runs terraform init and apply/plan/destroy over the output tree of k2e
+# Every directory with a tfvars file is a Terraform root. The namespaces root
+# creates the CloudMap namespaces, SSM parameters and ALBs that the service
+# roots read, so it is applied first and destroyed last.
+
+STATE_FILE = ".specctl_apply_state.json"
+LOG_FILE = "specctl-terraform.log"
+PLUGIN_CACHE_DIR = ".terraform-plugin-cache"
+NAMESPACES_ROOT = "namespaces"
+
+# files that terraform itself writes in a root and are not inputs
+IGNORED_NAMES = [".terraform", ".terraform.lock.hcl", "terraform.tfstate", "terraform.tfstate.backup", LOG_FILE]
+
+def find_tf_roots(output_directory):
+    roots = []
+    for dir_path, dir_names, file_names in os.walk(output_directory):
+        dir_names[:] = sorted([d for d in dir_names if d not in IGNORED_NAMES and d != PLUGIN_CACHE_DIR])
+        if any(f.endswith(".tfvars") for f in file_names):
+            roots.append(os.path.relpath(dir_path, output_directory))
+    return roots
+
+# hash of every input file of a root including the copied modules
+def tf_root_hash(root_dir):
+    digest = hashlib.sha256()
+    for dir_path, dir_names, file_names in os.walk(root_dir):
+        dir_names[:] = sorted([d for d in dir_names if d not in IGNORED_NAMES])
+        for fn in sorted(file_names):
+            if fn in IGNORED_NAMES or not fn.endswith((".tf", ".tfvars")):
+                continue
+            file_path = os.path.join(dir_path, fn)
+            digest.update(os.path.relpath(file_path, root_dir).encode("utf-8"))
+            with open(file_path, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+# returns {root: set of roots it depends on}
+def get_tf_dependencies(roots, tf_command):
+    dependencies = {root:set() for root in roots}
+    if NAMESPACES_ROOT not in dependencies:
+        return dependencies
+    for root in roots:
+        if root == NAMESPACES_ROOT: continue
+        if tf_command == "destroy":
+            dependencies[NAMESPACES_ROOT].add(root)
+        else:
+            dependencies[root].add(NAMESPACES_ROOT)
+    return dependencies
+
+def read_apply_state(output_directory):
+    state_file = os.path.join(output_directory, STATE_FILE)
+    if not os.path.isfile(state_file):
+        return {}
+    with open(state_file, 'r') as sf:
+        try:
+            return json.loads(sf.read())
+        except ValueError:
+            logger.warning("Ignoring unreadable apply state file %s"%(state_file))
+            return {}
+
+def write_apply_state(output_directory, state):
+    state_file = os.path.join(output_directory, STATE_FILE)
+    with open(state_file, 'w') as sf:
+        sf.write(json.dumps(state, sort_keys=True, indent=2))
+        sf.write("\n")
+
+def run_terraform(terraform_bin, args, root_dir, env, log):
+    log.write("$ terraform %s\n"%(" ".join(args)))
+    log.flush()
+    result = subprocess.run([terraform_bin]+args, cwd=root_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    return result.returncode == 0
+
+# terraform init is not safe to run concurrently against a shared
+# plugin cache, so inits are serialized and the command runs in parallel
+def tf_root_runner(terraform_bin, root_dir, tf_command, env, init_lock):
+    tf_args = [tf_command, "-input=false"]
+    if tf_command in ["apply", "destroy"]:
+        tf_args.append("-auto-approve")
+    with open(os.path.join(root_dir, LOG_FILE), 'w') as log:
+        with init_lock:
+            if not run_terraform(terraform_bin, ["init", "-input=false"], root_dir, env, log):
+                return False
+        return run_terraform(terraform_bin, tf_args, root_dir, env, log)
+
+def print_apply_summary(results, total_time):
+    lines = ["%-60s %-10s %8s"%("ROOT", "STATUS", "SECONDS")]
+    for root in sorted(results.keys()):
+        status, elapsed = results[root]
+        lines.append("%-60s %-10s %8.1f"%(root, status, elapsed))
+    counts = {}
+    for status, _ in results.values():
+        counts[status] = counts.get(status, 0)+1
+    lines.append("Total %.1f seconds, %s"%(total_time, ", ".join("%d %s"%(v, k) for k, v in sorted(counts.items()))))
+    logger.log(100, "\n".join(lines))
+
+# options needs output_directory, tf_command and jobs
+# returns True if terraform finished in every root, False if it is missing,
+# there are no roots, or a root failed or was blocked by a failed dependency
+def terraform_apply(options):
+    output_directory = options.get("output_directory")
+    tf_command = options.get("tf_command", "apply")
+    jobs = max(1, options.get("jobs", 1))
+    terraform_bin = shutil.which("terraform")
+    if terraform_bin is None:
+        logger.critical("Cannot find terraform executable in PATH")
+        return False
+
+    roots = find_tf_roots(output_directory)
+    if len(roots) <= 0:
+        logger.error("Found no Terraform tfvars under %s"%(output_directory))
+        return False
+
+    env = dict(os.environ)
+    if len(env.get("TF_PLUGIN_CACHE_DIR", "")) <= 0:
+        env["TF_PLUGIN_CACHE_DIR"] = os.path.abspath(os.path.join(output_directory, PLUGIN_CACHE_DIR))
+    try:
+        os.makedirs(env["TF_PLUGIN_CACHE_DIR"])
+    except FileExistsError:
+        pass
+    env["TF_IN_AUTOMATION"] = "1"
+
+    state = read_apply_state(output_directory)
+    dependencies = get_tf_dependencies(roots, tf_command)
+    results = {}
+    root_hashes = {}
+    init_lock = threading.Lock()
+    start_time = time.time()
+
+    def run_root(root):
+        root_dir = os.path.join(output_directory, root)
+        root_start = time.time()
+        if tf_command == "apply" and state.get(root) == root_hashes[root]:
+            logger.info("Skipping unchanged Terraform root %s"%(root))
+            return ("unchanged", 0.0)
+        logger.info("Running terraform %s in %s"%(tf_command, root_dir))
+        ok = tf_root_runner(terraform_bin, root_dir, tf_command, env, init_lock)
+        elapsed = time.time()-root_start
+        if not ok:
+            logger.error("terraform %s failed in %s, see %s"%(tf_command, root_dir, os.path.join(root_dir, LOG_FILE)))
+            return ("failed", elapsed)
+        return ("done", elapsed)
+
+    for root in roots:
+        root_hashes[root] = tf_root_hash(os.path.join(output_directory, root))
+
+    pending = set(roots)
+    running = {}
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while len(pending) > 0 or len(running) > 0:
+            for root in sorted(pending):
+                deps = dependencies[root]
+                if any(results.get(d, ("",))[0] in ["failed", "blocked"] for d in deps):
+                    logger.error("Not running %s because a dependency failed"%(root))
+                    results[root] = ("blocked", 0.0)
+                    pending.remove(root)
+                elif all(d in results for d in deps):
+                    running[executor.submit(run_root, root)] = root
+                    pending.remove(root)
+            if len(running) <= 0:
+                continue
+            done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+            for future in done:
+                root = running.pop(future)
+                results[root] = future.result()
+                status = results[root][0]
+                if status == "done" and tf_command == "apply":
+                    state[root] = root_hashes[root]
+                if status == "done" and tf_command == "destroy":
+                    state.pop(root, None)
+                write_apply_state(output_directory, state)
+
+    print_apply_summary(results, time.time()-start_time)
+    return all(status in ["done", "unchanged"] for status, _ in results.values())
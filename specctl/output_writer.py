@@ -0,0 +1,299 @@
+# // Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# // SPDX-License-Identifier: Apache-2.0
+import os
+import io
+import json
+import time
+import base64
+import hashlib
+import threading
+from .profiler import stage, count
+import logging
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+BUNDLE_FILE = "specctl-output"
+BUNDLE_FORMATS = ["tar", "zip", "jsonl"]
+
+def content_hash(content):
+    return hashlib.sha256(content).hexdigest()
+
+# All generated files go through an OutputWriter. It keeps a manifest.json in
+# the output directory with the sha256 of every file and the input objects that
+# produced it, and doesn't rewrite a file whose content is unchanged so mtimes
+# stay put and downstream tooling only sees the files that really changed.
+#
+# manifest.json format
+# {
+#   "files": {"<path relative to output directory>": {"sha256": "", "sources": []}},
+#   "changed": [<files written by the last run>],
+#   "changed_sources": [<sources of the files written by the last run>]
+# }
+class OutputWriter:
+    # False for writers that don't put files in the output directory
+    on_disk = True
+
+    def __init__(self, output_directory):
+        self.output_directory = output_directory
+        self.manifest_file = os.path.join(output_directory, MANIFEST_FILE)
+        self.previous = {}
+        self.files = {}
+        self.changed = []
+        self.created_dirs = set()
+        self.lock = threading.Lock()
+        if os.path.isfile(self.manifest_file):
+            with open(self.manifest_file, 'r') as mf:
+                try:
+                    self.previous = json.loads(mf.read()).get("files", {})
+                except ValueError:
+                    logger.warning("Ignoring unreadable manifest %s"%(self.manifest_file))
+
+    def relpath(self, file_path):
+        return os.path.relpath(file_path, self.output_directory).replace(os.sep, "/")
+
+    def makedirs(self, dir_path):
+        if dir_path in self.created_dirs:
+            return
+        try:
+            os.makedirs(dir_path)
+        except FileExistsError:
+            pass
+        self.created_dirs.add(dir_path)
+
+    # the file on disk is hashed even when the manifest has an entry for it,
+    # so a generated file edited by hand, even to the same size, is restored
+    def is_unchanged(self, file_path, digest, size):
+        if not os.path.isfile(file_path) or os.path.getsize(file_path) != size:
+            return False
+        with open(file_path, 'rb') as f:
+            return content_hash(f.read()) == digest
+
+    # writes content (str or bytes) to file_path unless it is already there
+    # sources are the input objects like "Deployment/default/nginx"
+    # returns True if the file was written
+    def write(self, file_path, content, sources=[]):
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        digest = content_hash(content)
+        key = self.relpath(file_path)
+        unchanged = self.is_unchanged(file_path, digest, len(content))
+        if not unchanged:
+            with stage("write", file=key, bytes=len(content)):
+                self.makedirs(os.path.dirname(file_path))
+                with open(file_path, 'wb') as f:
+                    f.write(content)
+            count("output.files_written")
+            count("output.bytes_written", len(content))
+        else:
+            logger.debug("Skipping unchanged %s"%(file_path))
+            count("output.files_unchanged")
+        with self.lock:
+            self.files[key] = {"sha256": digest, "sources": sorted(set(sources))}
+            if not unchanged:
+                self.changed.append(key)
+        return not unchanged
+
+    # carries the files of dir_path from the previous manifest over to this
+    # one without writing them. returns False if there were none or some
+    # of them are gone, then the caller has to write them again
+    def keep(self, dir_path):
+        prefix = self.relpath(dir_path)+"/"
+        kept = {k: v for k, v in self.previous.items() if k.startswith(prefix)}
+        if len(kept) <= 0:
+            return False
+        for key in kept:
+            if not os.path.isfile(os.path.join(self.output_directory, key)):
+                return False
+        with self.lock:
+            self.files.update(kept)
+        return True
+
+    def copy(self, src_file, dest_dir, sources=[]):
+        with open(src_file, 'rb') as f:
+            content = f.read()
+        return self.write(os.path.join(dest_dir, os.path.basename(src_file)), content, sources)
+
+    def close(self):
+        content = (json.dumps(self.manifest(), sort_keys=True, indent=2)+"\n").encode("utf-8")
+        if not self.is_unchanged(self.manifest_file, content_hash(content), len(content)):
+            self.makedirs(self.output_directory)
+            with open(self.manifest_file, 'wb') as mf:
+                mf.write(content)
+        logger.info("Wrote %d files, %d unchanged, manifest in %s"%(len(self.changed), len(self.files)-len(self.changed), self.manifest_file))
+
+    def manifest(self):
+        changed_sources = set()
+        for key in self.changed:
+            changed_sources.update(self.files[key]["sources"])
+        return {
+            "files": self.files,
+            "changed": sorted(self.changed),
+            "changed_sources": sorted(changed_sources)
+        }
+
+# Streams every output file into a single tar, zip or JSON Lines file
+# <output_directory>/specctl-output.<format> instead of thousands of small files.
+# The manifest is stored in the bundle as manifest.json. The bundle is written
+# to a temporary file and renamed on close so readers never see a partial one.
+class BundleWriter(OutputWriter):
+    def __init__(self, output_directory, output_format):
+        OutputWriter.__init__(self, output_directory)
+        self.previous = {}
+        self.output_format = output_format
+        self.bundle_file = os.path.join(output_directory, BUNDLE_FILE+"."+output_format)
+        self.tmp_file = self.bundle_file+".tmp"
+        try:
+            os.makedirs(output_directory)
+        except FileExistsError:
+            pass
+        # tarfile and zipfile are only imported for bundles
+        import tarfile, zipfile
+        if output_format == "tar":
+            self.bundle = tarfile.open(self.tmp_file, "w")
+        elif output_format == "zip":
+            self.bundle = zipfile.ZipFile(self.tmp_file, "w", zipfile.ZIP_DEFLATED)
+        else:
+            self.bundle = open(self.tmp_file, "w")
+
+    def add(self, key, content):
+        import tarfile
+        if self.output_format == "tar":
+            info = tarfile.TarInfo(name=key)
+            info.size = len(content)
+            info.mtime = int(time.time())
+            self.bundle.addfile(info, io.BytesIO(content))
+        elif self.output_format == "zip":
+            self.bundle.writestr(key, content)
+        else:
+            entry = {"path": key}
+            try:
+                entry["content"] = content.decode("utf-8")
+            except UnicodeDecodeError:
+                entry["content_base64"] = base64.b64encode(content).decode("ascii")
+            self.bundle.write(json.dumps(entry)+"\n")
+
+    def makedirs(self, dir_path):
+        return
+
+    # a bundle always holds every file
+    def keep(self, dir_path):
+        return False
+
+    def write(self, file_path, content, sources=[]):
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        key = self.relpath(file_path)
+        with self.lock, stage("write", file=key, bytes=len(content)):
+            self.add(key, content)
+            self.files[key] = {"sha256": content_hash(content), "sources": sorted(set(sources))}
+            self.changed.append(key)
+        count("output.files_written")
+        count("output.bytes_written", len(content))
+        return True
+
+    def close(self):
+        content = (json.dumps(self.manifest(), sort_keys=True, indent=2)+"\n").encode("utf-8")
+        self.add(MANIFEST_FILE, content)
+        self.bundle.close()
+        os.replace(self.tmp_file, self.bundle_file)
+        logger.log(100, "Wrote %d files to %s"%(len(self.files), self.bundle_file))
+
+# Keeps every output file in memory for the library API in specctl.api,
+# nothing is read from or written to the output directory
+class MemoryWriter(OutputWriter):
+    on_disk = False
+
+    def __init__(self, output_directory="."):
+        self.output_directory = output_directory
+        self.manifest_file = os.path.join(output_directory, MANIFEST_FILE)
+        self.previous = {}
+        self.files = {}
+        self.changed = []
+        self.contents = {}
+        self.lock = threading.Lock()
+
+    def makedirs(self, dir_path):
+        return
+
+    def keep(self, dir_path):
+        return False
+
+    def write(self, file_path, content, sources=[]):
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        key = self.relpath(file_path)
+        with self.lock:
+            self.contents[key] = content
+            self.files[key] = {"sha256": content_hash(content), "sources": sorted(set(sources))}
+            self.changed.append(key)
+        count("output.files_written")
+        count("output.bytes_written", len(content))
+        return True
+
+    def close(self):
+        logger.info("Kept %d files in memory"%(len(self.files)))
+
+# options["output_writer"] is used as it is when the caller opened the writer
+def open_output_writer(options):
+    if options.get("output_writer") is not None:
+        return options.get("output_writer")
+    output_format = options.get("output_format", "dir")
+    if output_format in BUNDLE_FORMATS:
+        return BundleWriter(options.get("output_directory"), output_format)
+    return OutputWriter(options.get("output_directory"))
+
+# yields (path, content bytes) for every file in a bundle
+def read_bundle(bundle_file):
+    import tarfile, zipfile
+    if tarfile.is_tarfile(bundle_file):
+        with tarfile.open(bundle_file, "r") as tf:
+            for member in tf.getmembers():
+                if not member.isfile(): continue
+                yield member.name, tf.extractfile(member).read()
+    elif zipfile.is_zipfile(bundle_file):
+        with zipfile.ZipFile(bundle_file, "r") as zf:
+            for name in zf.namelist():
+                yield name, zf.read(name)
+    else:
+        with open(bundle_file, "r") as jf:
+            for line in jf:
+                if len(line.strip()) <= 0: continue
+                entry = json.loads(line)
+                if "content_base64" in entry:
+                    yield entry["path"], base64.b64decode(entry["content_base64"])
+                else:
+                    yield entry["path"], entry.get("content","").encode("utf-8")
+
+# writes the files of a bundle into output_directory, unchanged files
+# already in the directory are left as they are
+def extract_bundle(bundle_file, output_directory):
+    files = dict(read_bundle(bundle_file))
+    manifest = {}
+    if MANIFEST_FILE in files:
+        manifest = json.loads(files.pop(MANIFEST_FILE).decode("utf-8")).get("files", {})
+    writer = OutputWriter(output_directory)
+    for key, content in files.items():
+        if os.path.isabs(key) or ".." in key.split("/"):
+            logger.error("Skipping unsafe path %s in %s"%(key, bundle_file))
+            continue
+        sources = manifest.get(key, {}).get("sources", [])
+        writer.write(os.path.join(output_directory, key), content, sources)
+    writer.close()
+    logger.log(100, "Extracted %d files from %s to %s"%(len(files), bundle_file, output_directory))
+
+# A sink turns parsed objects into output files through an OutputWriter.
+# begin and end run once on the calling thread, service runs once per
+# service and may run on a thread pool so it must only touch its own service.
+class OutputSink:
+    # the --profile stage the time of the sink is counted in
+    stage_name = "sink"
+
+    def begin(self, output_dict):
+        return
+
+    def service(self, ctx):
+        return
+
+    def end(self, contexts):
+        return
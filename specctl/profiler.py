@@ -0,0 +1,296 @@
+# // Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# // SPDX-License-Identifier: Apache-2.0
+import os
+import json
+import time
+import itertools
+import threading
+import functools
+import contextvars
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Stage timers and counters for specctl --profile, and spans for
+# specctl --trace. The converters call
+#
+#   with stage("read", source=path):
+#       ...
+#   count("k8s.objects.Deployment")
+#
+# which do nothing unless start_profiling() or start_tracing() was called,
+# so they can stay on the hot paths. Stage times are wall clock and
+# inclusive, a stage running inside another one counts for both, and with
+# -j the stages of the worker threads add up to more than the elapsed time.
+# With tracing every stage is also a span with its keyword attributes,
+# like the namespace, kind, service or AWS operation.
+
+REPORT_FILE = "specctl-profile.json"
+PSTATS_FILE = "specctl-profile.pstats"
+# spans per line of an OTLP JSON Lines trace
+OTLP_BATCH_SIZE = 1000
+
+class Profiler:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def add_time(self, name, seconds):
+        with self.lock:
+            timing = self.stages.get(name)
+            if timing is None:
+                timing = self.stages[name] = {"calls": 0, "seconds": 0.0, "max_seconds": 0.0}
+            timing["calls"] += 1
+            timing["seconds"] += seconds
+            timing["max_seconds"] = max(timing["max_seconds"], seconds)
+
+    def add(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0)+n
+
+    def report(self):
+        with self.lock:
+            stages = {k: dict(v) for k, v in self.stages.items()}
+            counters = dict(self.counters)
+        for timing in stages.values():
+            timing["seconds"] = round(timing["seconds"], 6)
+            timing["max_seconds"] = round(timing["max_seconds"], 6)
+        return {"elapsed_seconds": round(time.perf_counter()-self.started, 6), "stages": stages, "counters": counters}
+
+# Keeps the spans of a run in memory until they are written by write_trace
+class Tracer:
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        # spans are timed with perf_counter_ns and placed on the wall clock
+        # relative to the start of the trace
+        self.epoch_ns = time.time_ns()
+        self.perf_ns = time.perf_counter_ns()
+        self.span_ids = itertools.count(1)
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def new_span_id(self):
+        return "%016x"%(next(self.span_ids))
+
+    def add(self, span):
+        with self.lock:
+            self.spans.append(span)
+
+    def unix_ns(self, perf_ns):
+        return self.epoch_ns+perf_ns-self.perf_ns
+
+# the span the current thread or task is in, e2k copies its context into
+# the worker threads so their spans have the cluster export as parent
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+class StageTimer:
+    def __init__(self, profiler, tracer, name, attributes):
+        self.profiler = profiler
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        if self.tracer is not None:
+            self.span_id = self.tracer.new_span_id()
+            self.parent_id = _current_span.get()
+            self.token = _current_span.set(self.span_id)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = time.perf_counter_ns()
+        if self.profiler is not None:
+            self.profiler.add_time(self.name, (end-self.start)/1e9)
+        if self.tracer is not None:
+            _current_span.reset(self.token)
+            thread = threading.current_thread()
+            self.tracer.add({
+                "name": self.name,
+                "span_id": self.span_id,
+                "parent_id": self.parent_id,
+                "start_ns": self.tracer.unix_ns(self.start),
+                "end_ns": self.tracer.unix_ns(end),
+                "thread_id": thread.ident,
+                "thread_name": thread.name,
+                "attributes": self.attributes,
+                "error": "" if exc_type is None else "%s: %s"%(exc_type.__name__, exc_value)
+            })
+        return False
+
+class NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+NULL_STAGE = NullStage()
+
+# the profiler and tracer of the process, None when --profile or --trace is off
+_profiler = None
+_tracer = None
+
+def stage(stage_name, **attributes):
+    profiler = _profiler
+    tracer = _tracer
+    if profiler is None and tracer is None:
+        return NULL_STAGE
+    return StageTimer(profiler, tracer, stage_name, attributes)
+
+# decorator for functions that are a stage as a whole
+def timed(name):
+    def decorate(function):
+        @functools.wraps(function)
+        def timed_function(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return timed_function
+    return decorate
+
+def count(name, n=1):
+    profiler = _profiler
+    if profiler is not None:
+        profiler.add(name, n)
+
+def start_profiling():
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+# returns the report of the stopped profiler
+def stop_profiling():
+    global _profiler
+    profiler, _profiler = _profiler, None
+    return profiler.report() if profiler is not None else {}
+
+def start_tracing():
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+# returns the stopped tracer with its spans
+def stop_tracing():
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+def print_profile_summary(report):
+    lines = ["%-48s %8s %10s %10s %10s"%("STAGE", "CALLS", "SECONDS", "MEAN MS", "MAX MS")]
+    for name, timing in sorted(report.get("stages", {}).items(), key=lambda i: -i[1]["seconds"]):
+        lines.append("%-48s %8d %10.3f %10.3f %10.3f"%(name, timing["calls"], timing["seconds"], 1000*timing["seconds"]/timing["calls"], 1000*timing["max_seconds"]))
+    lines.append("")
+    lines.append("%-48s %8s"%("COUNTER", "VALUE"))
+    for name, value in sorted(report.get("counters", {}).items()):
+        lines.append("%-48s %8d"%(name, value))
+    lines.append("Total %.3f seconds"%(report.get("elapsed_seconds", 0)))
+    logger.log(100, "\n".join(lines))
+
+def write_profile_report(report, output_directory):
+    report_file = os.path.join(output_directory, REPORT_FILE)
+    with open(report_file, 'w') as rf:
+        rf.write(json.dumps(report, sort_keys=True, indent=2)+"\n")
+    logger.log(100, "Profile report in %s"%(report_file))
+    return report_file
+
+# runs run() under cProfile and dumps the pstats file to output_directory.
+# cProfile only sees the calling thread, use -j 1 to profile all the work
+def run_cprofile(run, output_directory):
+    import cProfile
+    import pstats
+    import io
+    pstats_file = os.path.join(output_directory, PSTATS_FILE)
+    profile = cProfile.Profile()
+    try:
+        profile.runcall(run)
+    finally:
+        profile.dump_stats(pstats_file)
+        stream = io.StringIO()
+        # the hot path functions of specctl itself, by cumulative time
+        pstats.Stats(profile, stream=stream).sort_stats("cumulative").print_stats("specctl", 25)
+        logger.log(100, "%sPython profile in %s, see python -m pstats %s"%(stream.getvalue(), pstats_file, pstats_file))
+
+# attribute values are kept as strings, numbers and booleans
+def span_attribute(value):
+    if isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+# Chrome trace event format, opens in chrome://tracing and ui.perfetto.dev.
+# Every thread is a row, the attributes show as the args of a span
+def write_chrome_trace(tracer, trace_file):
+    pid = os.getpid()
+    events = []
+    threads = {}
+    for span in tracer.spans:
+        threads[span["thread_id"]] = span["thread_name"]
+        args = {k: span_attribute(v) for k, v in span["attributes"].items()}
+        if len(span["error"]) > 0:
+            args["error"] = span["error"]
+        events.append({
+            "name": span["name"],
+            "cat": span["name"].partition(".")[0],
+            "ph": "X",
+            "ts": (span["start_ns"]-tracer.epoch_ns)/1000,
+            "dur": (span["end_ns"]-span["start_ns"])/1000,
+            "pid": pid,
+            "tid": span["thread_id"],
+            "args": args
+        })
+    for tid, thread_name in threads.items():
+        events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": thread_name}})
+    with open(trace_file, 'w') as tf:
+        tf.write(json.dumps({"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"trace_id": tracer.trace_id}})+"\n")
+
+def otlp_value(value):
+    value = span_attribute(value)
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": value}
+
+# OTLP JSON, one ExportTraceServiceRequest per line like the file exporter
+# of the OpenTelemetry collector writes, so the file can be replayed into
+# any OTLP backend later
+def write_otlp_trace(tracer, trace_file):
+    resource = {"attributes": [
+        {"key": "service.name", "value": {"stringValue": "specctl"}},
+        {"key": "process.pid", "value": {"intValue": str(os.getpid())}}
+    ]}
+    with open(trace_file, 'w') as tf:
+        for i in range(0, len(tracer.spans), OTLP_BATCH_SIZE):
+            spans = []
+            for span in tracer.spans[i:i+OTLP_BATCH_SIZE]:
+                attributes = dict(span["attributes"], **{"thread.id": span["thread_id"], "thread.name": span["thread_name"]})
+                otlp_span = {
+                    "traceId": tracer.trace_id,
+                    "spanId": span["span_id"],
+                    "name": span["name"],
+                    "kind": 1,
+                    "startTimeUnixNano": str(span["start_ns"]),
+                    "endTimeUnixNano": str(span["end_ns"]),
+                    "attributes": [{"key": k, "value": otlp_value(v)} for k, v in attributes.items()],
+                    "status": {"code": 2, "message": span["error"]} if len(span["error"]) > 0 else {}
+                }
+                if span["parent_id"] is not None:
+                    otlp_span["parentSpanId"] = span["parent_id"]
+                spans.append(otlp_span)
+            request = {"resourceSpans": [{"resource": resource, "scopeSpans": [{"scope": {"name": "specctl"}, "spans": spans}]}]}
+            tf.write(json.dumps(request)+"\n")
+
+# a trace_file ending in .jsonl is written as OTLP JSON Lines, any other
+# as a Chrome trace
+def write_trace(tracer, trace_file):
+    trace_dir = os.path.dirname(trace_file)
+    if len(trace_dir) > 0:
+        os.makedirs(trace_dir, exist_ok=True)
+    if trace_file.endswith(".jsonl"):
+        write_otlp_trace(tracer, trace_file)
+    else:
+        write_chrome_trace(tracer, trace_file)
+    logger.log(100, "Wrote %d spans to %s"%(len(tracer.spans), trace_file))
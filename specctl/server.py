@@ -0,0 +1,214 @@
+# // Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# // SPDX-License-Identifier: Apache-2.0
+import os
+import json
+import time
+import threading
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from . import api
+from .profiler import stage
+import logging
+
+logger = logging.getLogger(__name__)
+
+# specctl -m serve runs the conversions of specctl.api behind a local HTTP
+# server on a TCP port or a Unix socket. The process keeps the converters
+# imported, the boto3 clients, kube API clients and Terraform module files
+# warm across requests, and runs up to -j conversions at a time.
+#
+#   POST /k2e  {"specs": <YAML text, object or list>} or {"context": "", "namespaces": []}
+#   POST /e2k  {"cluster_name": "", "region_name": ""}
+#   POST /d2k  {"documents": <YAML text, object or list>, "env": {}}
+#   GET  /health
+#
+# Every POST body can carry "options" with the REQUEST_OPTIONS for that
+# request and "output_directory", a directory under the -o of serve, to also
+# write the files there on the server. The response is
+# {"files": {path: content}, "manifest": {}, "seconds": 0.1}, or
+# {"error": ""} with status 400 for a bad request and 500 for a failure,
+# which is logged with its traceback.
+
+MAX_BODY_SIZE = 64*1024*1024
+# Options a request may set. Paths to read or write and the AWS client
+# mode (record, replay, api_rate), which is global to the process, only
+# come from the command line serve was started with
+REQUEST_OPTIONS = ["tf_layout", "sgp", "launch_types", "scheduling_strategies", "td_file", "sd_file", "tfvars_file"]
+# request options that name an output file and must not be a path
+FILE_NAME_OPTIONS = ["td_file", "sd_file", "tfvars_file"]
+
+# returns the options of a request, raises ValueError for the ones a
+# request may not set
+def request_options(options):
+    if not isinstance(options, dict):
+        raise ValueError("options must be a JSON object")
+    denied = [k for k in options if k not in REQUEST_OPTIONS]
+    if len(denied) > 0:
+        raise ValueError("Options %s can't be set per request, allowed are %s"%(", ".join(sorted(denied)), ", ".join(REQUEST_OPTIONS)))
+    for k in FILE_NAME_OPTIONS:
+        value = options.get(k)
+        if value is not None and (not isinstance(value, str) or os.path.basename(value) != value or value in ["", ".", ".."]):
+            raise ValueError("%s must be a file name"%(k))
+    return options
+
+# returns the directory under root_dir that a request asked to write to
+def request_output_directory(root_dir, output_directory):
+    if not isinstance(output_directory, str) or os.path.isabs(output_directory):
+        raise ValueError("output_directory must be a path relative to the output directory of the server")
+    relative = os.path.normpath(output_directory)
+    if relative == ".." or relative.startswith(".."+os.sep):
+        raise ValueError("output_directory must be inside the output directory of the server")
+    return os.path.join(root_dir, relative)
+
+def convert_k2e(body, options):
+    if body.get("context"):
+        return api.convert_k8s_cluster_to_ecs(body["context"], body.get("namespaces", []), **options)
+    return api.convert_k8s_to_ecs(body.get("specs", []), **options)
+
+def convert_e2k(body, options):
+    return api.convert_ecs_to_k8s(body.get("cluster_name", ""), body.get("region_name", ""), **options)
+
+def convert_d2k(body, options):
+    return api.convert_compose_to_k8s(body.get("documents", []), body.get("env"), **options)
+
+CONVERTERS = {"/k2e": convert_k2e, "/e2k": convert_e2k, "/d2k": convert_d2k}
+
+class ConversionServer:
+    def __init__(self, options):
+        # the options specctl serve was started with are the defaults of every
+        # request, -j is the number of requests converted at a time
+        per_request = ["output_directory", "jobs", "cluster_name", "region_name", "namespaces"]
+        self.defaults = {k: v for k, v in options.items() if k in api.DEFAULT_OPTIONS and k not in per_request}
+        self.output_directory = options.get("output_directory") or "."
+        self.slots = threading.BoundedSemaphore(options.get("jobs", 1))
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.stats = {"requests": 0, "failed": 0, "busy_seconds": 0.0}
+
+    # imports the converters and reads the Terraform modules before the
+    # first request, a converter whose libraries are missing stays unavailable
+    def warm(self):
+        for module in ["specctl.k8s2ecs.emitter", "specctl.k8s2ecs.ecs_output", "specctl.k8s2ecs.tf_output", "specctl.dc2k8s.dc_reader_writer", "specctl.ecs2k8s.ecs_reader_writer"]:
+            try:
+                __import__(module)
+            except ImportError as error:
+                logger.warning("%s is not available %s"%(module, error))
+        try:
+            from .k8s2ecs.tf_output import get_tf_modules_directory_map, get_tf_module_variables
+            tf_files = [f.strip() for f in self.defaults.get("tf_files", api.DEFAULT_OPTIONS["tf_files"]).split(",")]
+            tf_map = get_tf_modules_directory_map(self.defaults.get("tf_modules_directory", api.DEFAULT_OPTIONS["tf_modules_directory"]), self.defaults.get("tf_modules_name_map", api.DEFAULT_OPTIONS["tf_modules_name_map"]))
+            for src_dir in tf_map.values():
+                get_tf_module_variables(src_dir, tf_files)
+        except ImportError:
+            pass
+
+    # returns (status, response dict)
+    def convert(self, path, body):
+        converter = CONVERTERS.get(path)
+        if converter is None:
+            return 404, {"error": "Unknown path %s, use one of %s"%(path, ", ".join(sorted(CONVERTERS)))}
+        if not isinstance(body, dict):
+            return 400, {"error": "Request body must be a JSON object"}
+        start = time.time()
+        with self.slots, stage("request", path=path):
+            try:
+                options = dict(self.defaults, **request_options(body.get("options") or {}))
+                output_directory = None
+                if body.get("output_directory"):
+                    output_directory = request_output_directory(self.output_directory, body["output_directory"])
+                result = converter(body, options)
+                response = {"files": result.files, "manifest": result.manifest}
+                if output_directory is not None:
+                    response["written"] = result.write(output_directory)
+                status = 200
+            except ValueError as error:
+                status, response = 400, {"error": str(error)}
+            except Exception as error:
+                logger.exception("%s conversion failed"%(path))
+                status, response = 500, {"error": str(error)}
+        elapsed = time.time()-start
+        response["seconds"] = round(elapsed, 3)
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["failed"] += 0 if status == 200 else 1
+            self.stats["busy_seconds"] += elapsed
+        logger.info("%s %d in %.3f seconds"%(path, status, elapsed))
+        return status, response
+
+    def health(self):
+        with self.lock:
+            stats = dict(self.stats)
+        stats["busy_seconds"] = round(stats["busy_seconds"], 3)
+        stats["uptime_seconds"] = round(time.time()-self.started, 3)
+        stats["status"] = "ok"
+        return stats
+
+class ConversionRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def send_json(self, status, response):
+        content = json.dumps(response).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(200, self.server.conversions.health())
+        else:
+            self.send_json(404, {"error": "Unknown path %s"%(self.path)})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_SIZE:
+            self.close_connection = True
+            self.send_json(413, {"error": "Request body is larger than %d bytes"%(MAX_BODY_SIZE)})
+            return
+        try:
+            body = json.loads(self.rfile.read(length).decode("utf-8") or "{}")
+        except ValueError as error:
+            self.send_json(400, {"error": "Invalid JSON %s"%(error)})
+            return
+        status, response = self.server.conversions.convert(self.path, body)
+        self.send_json(status, response)
+
+    # client_address of a Unix socket is an empty string
+    def address_string(self):
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def log_message(self, format, *args):
+        logger.debug("%s %s"%(self.address_string(), format%args))
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+# listen is HOST:PORT, :PORT or unix:/path/to/socket
+def open_server(listen, conversions):
+    if listen.startswith("unix:"):
+        socket_path = listen[len("unix:"):]
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = ThreadingUnixHTTPServer(socket_path, ConversionRequestHandler)
+    else:
+        host, _, port = listen.rpartition(":")
+        server = ThreadingHTTPServer((host or "127.0.0.1", int(port)), ConversionRequestHandler)
+    server.conversions = conversions
+    return server
+
+def serve(options):
+    listen = options.get("listen")
+    conversions = ConversionServer(options)
+    conversions.warm()
+    server = open_server(listen, conversions)
+    logger.log(100, "Serving k2e, e2k and d2k conversions on %s with %d workers"%(listen, options.get("jobs", 1)))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if listen.startswith("unix:") and os.path.exists(listen[len("unix:"):]):
+            os.remove(listen[len("unix:"):])
+        logger.log(100, "Served %d requests"%(conversions.health()["requests"]))
@@ -2,21 +2,15 @@
 # // SPDX-License-Identifier: Apache-2.0
 import click
 import json
-import yaml 
-from os import listdir, makedirs
-from os.path import isdir, isfile, join
+import sys
+from os import makedirs
+from os.path import isfile
 
-# ecs to k8s 
-from .ecs2k8s.ecs_reader_writer import ecs_reader_writer
-
-# k8s to ecs
-from .k8s2ecs.k8s_reader import k8s_cluster_extract
-from .k8s2ecs.k8s_parser import k8s_parser
-from .k8s2ecs.ecs_output import ecs_print
-from .k8s2ecs.tf_output import terraform_print
-
-# docker compose to k8s
-from .dc2k8s.dc_reader_writer import dc_reader_writer
+# The converters are imported by the handler of their mode only, so that
+# --help or a d2k run doesn't pay for importing boto3 or the kubernetes
+# client. bin/import_time_check.py checks the import time of every mode.
+from .output_writer import open_output_writer, extract_bundle
+from .yaml_reader import yaml_reader
 
 import logging
 import logging.config
@@ -47,56 +41,102 @@ LOGGING_CONFIG = {
 logging.config.dictConfig(LOGGING_CONFIG)
 logger = logging.getLogger()
 
-# reads yaml file(s) from source and returns dictionary list
-def yaml_reader(source):
-    yaml_files = []
-    dict_list = []
-    if isfile(source) and source.lower().endswith(('.yaml','yml')): yaml_files.append(source)
-    if isdir(source):
-        yaml_files = [join(source,f) for f in listdir(source) if isfile(join(source, f)) and f.lower().endswith(('.yaml','yml'))]   
-   
-    for yf in yaml_files:
-        logger.info("Reading YAML from %s file"%(yf))
-        with open(yf, 'r') as input_stream:
-            try:
-                for schema in yaml.safe_load_all(input_stream):
-                    dict_list.append(schema)
-            except:
-                logger.error("Error reading %s YAML file %s"%(yf, yaml.YAMLError))
-    return (dict_list)
-
 def e2k_cli_handler(options):
+    from .ecs2k8s.ecs_reader_writer import ecs_reader_writer
     ecs_reader_writer(options)
     return
 
-def k2e_cli_handler(source, context, options):
+def k2e_cli_handler(sources, context, options):
+    from .k8s2ecs.k8s_parser import k8s_parser
+    from .k8s2ecs.ecs_output import EcsJsonSink
+    from .k8s2ecs.tf_output import TerraformSink
+    from .k8s2ecs.emitter import k2e_emit
     spec_list = []
-    if len(source)<=0:
+    if len(sources)<=0:
+        # the kubernetes client is only needed to read from a cluster
+        from .k8s2ecs.k8s_reader import k8s_cluster_extract
         spec_list=k8s_cluster_extract(options.get("namespaces"), context)    
     else:
-        spec_list=yaml_reader(source)
+        for source in sources:
+            spec_list+=yaml_reader(source)
     
     if len(spec_list) <= 0:
         logger.warning("Found no K8s specification object")
         return
     output_dict=k8s_parser(spec_list)
-    ecs_print(output_dict, options)
-    terraform_print(output_dict, options)
+    writer = open_output_writer(options)
+    sinks = [EcsJsonSink(options, writer), TerraformSink(options, writer)]
+    k2e_emit(output_dict, options, sinks)
+    writer.close()
     return
 
-def d2k_cli_handler(source, options):
-    spec_list=yaml_reader(source)
-    if len(spec_list) <= 0:
-        logger.warning("Found no docker compose specification object")
+def apply_cli_handler(options):
+    from .k8s2ecs.tf_runner import terraform_apply
+    if not terraform_apply(options):
+        sys.exit(1)
+    return
+
+def extract_cli_handler(source, options):
+    if not isfile(source):
+        logger.error("Pass the bundle file to extract with -s")
+        sys.exit(1)
+    extract_bundle(source, options.get("output_directory"))
+    return
+
+def batch_cli_handler(source, options):
+    from .batch import run_batch
+    if not isfile(source):
+        logger.error("Pass the jobs file to run with -s")
+        sys.exit(1)
+    results = run_batch(source, options)
+    if len(results) <= 0 or any(r["status"] != "ok" for r in results):
+        sys.exit(1)
+    return
+
+# --profile times the stages of the run and counts objects, API calls and
+# files, --profile=cprofile also runs it under cProfile. --trace writes a
+# span per stage to the trace file
+def profile_cli_handler(profile, trace, mode, sources, context, options):
+    from .profiler import start_profiling, stop_profiling, print_profile_summary, write_profile_report, run_cprofile, start_tracing, stop_tracing, write_trace
+    if profile is not None:
+        start_profiling()
+    if len(trace) > 0:
+        start_tracing()
+    try:
+        if profile == "cprofile":
+            run_cprofile(lambda: run_mode(mode, sources, context, options), options.get("output_directory"))
+        else:
+            run_mode(mode, sources, context, options)
+    finally:
+        if profile is not None:
+            report = stop_profiling()
+            report["mode"] = mode
+            print_profile_summary(report)
+            write_profile_report(report, options.get("output_directory"))
+        if len(trace) > 0:
+            write_trace(stop_tracing(), trace)
+    return
+
+def serve_cli_handler(options):
+    from .server import serve
+    serve(options)
+    return
+
+# several sources are merged in order like docker compose -f a.yml -f b.yml
+def d2k_cli_handler(sources, options):
+    if len(sources) <= 0:
+        logger.warning("Pass the docker compose files to convert with -s")
         return
-    dc_reader_writer(spec_list, options)
+    from .dc2k8s.dc_reader_writer import dc_compose_reader_writer
+    if not dc_compose_reader_writer(sources, options):
+        sys.exit(1)
     return 
 
 
 # Click cli entry point function
 @click.command()
-@click.option("-m","--mode", default="k2e", type=click.Choice(["k2e","e2k","d2k"], case_sensitive=False), help="Transform mode - k2e K8s-to-ECS, e2k ECS-to-K8s, d2k Docker Compose-to-K8s")
-@click.option("-s", "--source", default="", type=str, help="Path to YAML specification file or directory")
+@click.option("-m","--mode", default="k2e", type=click.Choice(["k2e","e2k","d2k","apply","extract","serve","batch"], case_sensitive=False), help="Transform mode - k2e K8s-to-ECS, e2k ECS-to-K8s, d2k Docker Compose-to-K8s, apply runs Terraform over the k2e output directory, extract unpacks an output bundle, serve runs a conversion server, batch runs the jobs of the -s jobs file")
+@click.option("-s", "--source", multiple=True, type=str, help="Path to YAML specification file or directory, can be repeated. In d2k mode later compose files override earlier ones")
 @click.option("-c", "--context", default="", type=str, help="Kubeconfig context name to load")
 @click.option("-l", "--log_level", default="WARNING", type=click.Choice(["DEBUG","INFO","WARNING","ERROR","CRITICAL"], case_sensitive=False), help="Select log level")
 @click.option("-n", "--namespaces", default="", type=str, help="Only fetch namespaces specified here as comma separated string. Applies only when converting from K8s clusters and not from spec files")
@@ -107,12 +147,25 @@ def d2k_cli_handler(source, options):
 @click.option("-d", "--tf_modules_directory", default="./terraform", help="Path to Terraform modules directory")
 @click.option("--tf_modules_name_map", default="namespaces:namespaces,ecs-lb-service:ecs-lb-service,ecs-backend-service:ecs-backend-service", help="Change the value in this map to your terraform modules directory")
 @click.option("--tf_files", default="main.tf,versions.tf,variables.tf,outputs.tf", help="List of files to use from Terraform modules")
+@click.option("--tf_layout", default="service", type=click.Choice(["service","namespace","cluster"], case_sensitive=False), help="Terraform root per service, one root per namespace, or one root for the whole cluster")
 @click.option("-o", "--output_directory", default="./output", help="Path to output directory")
-@click.option("--ecs_cluster_name", default="", type=str, help="ECS cluster to extract services and tasks")
-@click.option("--ecs_region_name", default="", type=str, help="Region name for ECS cluster")
+@click.option("--output_format", default="dir", type=click.Choice(["dir","tar","zip","jsonl"], case_sensitive=False), help="Write output files to the output directory or into a single bundle file in it")
+@click.option("--ecs_cluster_name", default="", type=str, help="ECS cluster to extract services and tasks. Comma separated names or globs export several clusters")
+@click.option("--ecs_region_name", default="", type=str, help="Region name for ECS cluster. Comma separated names or globs export from several regions")
+@click.option("--launch_type", default=["FARGATE"], multiple=True, type=click.Choice(["FARGATE","EC2","EXTERNAL"], case_sensitive=False), help="ECS launch type of the services to export in e2k mode, can be repeated")
+@click.option("--scheduling_strategy", default=["REPLICA"], multiple=True, type=click.Choice(["REPLICA","DAEMON"], case_sensitive=False), help="ECS scheduling strategy of the services to export in e2k mode, can be repeated. DAEMON services become DaemonSets")
+@click.option("--api_rate", default=0, type=click.IntRange(min=0), help="Maximum AWS API calls per second per region in e2k mode, 0 for no limit")
+@click.option("--full_export", is_flag=True, help="Export every ECS service in e2k mode, not only the ones changed since the last run")
+@click.option("--record", default="", type=str, help="Directory to save every AWS response of an e2k run to")
+@click.option("--replay", default="", type=str, help="Directory of saved AWS responses to run e2k from instead of calling AWS")
 @click.option("--sgp", is_flag="True", help="Create EKS Security Group Policy from task security groups")
 @click.option("-e", "--env_file", default="", help="Path to the environment file to use for docker compose external values")
-def transform(mode, source, context, log_level, namespaces, td_file, sd_file, input_file, tfvars_file, tf_modules_directory, tf_modules_name_map, tf_files, output_directory, ecs_cluster_name, ecs_region_name, sgp, env_file):
+@click.option("--tf_command", default="apply", type=click.Choice(["apply","plan","destroy"], case_sensitive=False), help="Terraform command to run in apply mode")
+@click.option("--listen", default="127.0.0.1:8080", type=str, help="HOST:PORT or unix:/path/to/socket the serve mode listens on")
+@click.option("--profile", default=None, is_flag=False, flag_value="summary", type=click.Choice(["summary","cprofile"], case_sensitive=False), help="Print the time spent per stage and the object, API call and file counts, and write them to specctl-profile.json in the output directory. cprofile also dumps a pstats file")
+@click.option("--trace", default="", type=str, help="File to write a span per reader call, parser handler, AWS call and file write to. Chrome trace event JSON for chrome://tracing or Perfetto, or OTLP JSON Lines if the name ends in .jsonl")
+@click.option("-j", "--jobs", default=1, type=click.IntRange(min=1), help="Number of parallel workers")
+def transform(mode, source, context, log_level, namespaces, td_file, sd_file, input_file, tfvars_file, tf_modules_directory, tf_modules_name_map, tf_files, tf_layout, output_directory, output_format, ecs_cluster_name, ecs_region_name, launch_type, scheduling_strategy, api_rate, full_export, record, replay, sgp, env_file, tf_command, listen, profile, trace, jobs):
     logger.setLevel(getattr(logging,log_level.upper()))
     for handler in logger.handlers:
         handler.setLevel(getattr(logging,log_level.upper()))
@@ -132,20 +185,50 @@ def transform(mode, source, context, log_level, namespaces, td_file, sd_file, in
         "tf_modules_directory": tf_modules_directory,
         "tf_modules_name_map": tf_modules_name_map,
         "tf_files": tf_files,
+        "tf_layout": tf_layout.lower(),
         "output_directory" : output_directory,
+        "output_format" : output_format.lower(),
         "cluster_name" : ecs_cluster_name,
         "region_name" : ecs_region_name,
+        "launch_types" : [lt.upper() for lt in launch_type],
+        "scheduling_strategies" : [ss.upper() for ss in scheduling_strategy],
+        "api_rate" : api_rate,
+        "full_export" : full_export,
+        "record" : record,
+        "replay" : replay,
         "sgp": sgp,
-        "env_file": env_file
+        "env_file": env_file,
+        "tf_command": tf_command.lower(),
+        "listen": listen,
+        "jobs": jobs
         }
+    sources = list(source)
+    if profile is None and len(trace) <= 0:
+        run_mode(mode, sources, context, options)
+        return
+    profile_cli_handler(profile.lower() if profile is not None else None, trace, mode, sources, context, options)
+
+def run_mode(mode, sources, context, options):
     if mode == "k2e":
-        k2e_cli_handler(source, context, options)
+        k2e_cli_handler(sources, context, options)
         return
     if mode == "e2k":
         e2k_cli_handler(options)
         return
     if mode == "d2k":
-        d2k_cli_handler(source, options)
+        d2k_cli_handler(sources, options)
+        return
+    if mode == "apply":
+        apply_cli_handler(options)
+        return
+    if mode == "extract":
+        extract_cli_handler(sources[0] if len(sources) > 0 else "", options)
+        return
+    if mode == "batch":
+        batch_cli_handler(sources[0] if len(sources) > 0 else "", options)
+        return
+    if mode == "serve":
+        serve_cli_handler(options)
         return
     if mode == "e2f":
         logger.info("ECS EC2 to ECS FG is coming soon!")
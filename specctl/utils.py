@@ -12,6 +12,7 @@ FARGATE_AVAILABLE_SKUS = {
     8192  : {"min":16384, "max":61440,  "incr":4096},
     16384 : {"min":32768, "max":122880, "incr":8192}
 }
+FARGATE_CPU_SIZES = sorted(FARGATE_AVAILABLE_SKUS.keys())
 
 # In Kubernetes, 
 # 1 CPU unit is equivalent to 1 physical CPU core, 
@@ -29,9 +30,7 @@ def get_fargate_sku(cpu, mem):
     if cpu <=256 and mem <=512:
         return {"cpu":256, "memory":512}
     fg_sku = {}
-    fg_cpus = list(FARGATE_AVAILABLE_SKUS.keys())
-    fg_cpus.sort()
-    for c in fg_cpus:
+    for c in FARGATE_CPU_SIZES:
         if c >= cpu:
             fg_mem = FARGATE_AVAILABLE_SKUS.get(c)
             fg_mem_min = fg_mem.get("min")
@@ -47,6 +46,15 @@ def get_fargate_sku(cpu, mem):
                 break
     return(fg_sku)
 
+# copies the plain dict and list spec templates of k8s_objects and
+# ecs_objects, much cheaper than copy.deepcopy on these small trees
+def copy_spec(obj):
+    if isinstance(obj, dict):
+        return {k: copy_spec(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [copy_spec(v) for v in obj]
+    return obj
+
 # simple util functions
 def dict_check(dict):
     if dict is None or len(dict)==0: return False
@@ -0,0 +1,59 @@
+# // Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# // SPDX-License-Identifier: Apache-2.0
+import os
+import threading
+import yaml
+from os.path import isdir, isfile, join
+from .utils import copy_spec
+from .profiler import stage, count
+import logging
+
+logger = logging.getLogger(__name__)
+
+# the libyaml loader builds the same objects as the pure Python one, faster
+try:
+    from yaml import CSafeLoader as _SafeLoader
+except ImportError:
+    _SafeLoader = yaml.SafeLoader
+
+# Parsed YAML files are kept by path, mtime and size for the life of the
+# process, so the jobs of specctl -m batch and the requests of serve that
+# read the same files parse them once. Callers get their own copy.
+_yaml_cache = {}
+_yaml_cache_lock = threading.Lock()
+
+# returns the documents of a YAML file, the ones before a syntax error
+# if there is one
+def read_yaml_file(yaml_file):
+    st = os.stat(yaml_file)
+    signature = (st.st_mtime_ns, st.st_size)
+    with _yaml_cache_lock:
+        cached = _yaml_cache.get(yaml_file)
+    if cached is None or cached[0] != signature:
+        logger.info("Reading YAML from %s file"%(yaml_file))
+        documents = []
+        with stage("read_yaml", file=yaml_file), open(yaml_file, 'r') as input_stream:
+            try:
+                for schema in yaml.load_all(input_stream, Loader=_SafeLoader):
+                    documents.append(schema)
+            except Exception as error:
+                logger.error("Error reading %s YAML file %s"%(yaml_file, error))
+        count("input.files_read")
+        count("input.bytes_read", st.st_size)
+        cached = (signature, documents)
+        with _yaml_cache_lock:
+            _yaml_cache[yaml_file] = cached
+    return copy_spec(cached[1])
+
+# reads yaml file(s) from source and returns dictionary list
+def yaml_reader(source):
+    yaml_files = []
+    dict_list = []
+    if isfile(source) and source.lower().endswith(('.yaml','yml')): yaml_files.append(source)
+    if isdir(source):
+        yaml_files = [join(source,f) for f in os.listdir(source) if isfile(join(source, f)) and f.lower().endswith(('.yaml','yml'))]
+
+    with stage("read", source=source):
+        for yf in yaml_files:
+            dict_list += read_yaml_file(yf)
+    return (dict_list)
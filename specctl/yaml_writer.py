@@ -0,0 +1,29 @@
+# // Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# // SPDX-License-Identifier: Apache-2.0
+import yaml
+import logging
+
+logger = logging.getLogger(__name__)
+
+# The generated specs are plain dicts, lists and scalars so the safe dumper
+# is enough, and its libyaml version is much faster than the pure Python one
+try:
+    from yaml import CSafeDumper as _SafeDumper
+except ImportError:
+    _SafeDumper = yaml.SafeDumper
+
+# shared objects like a selector used in several places are written out
+# each time instead of as &anchor/*alias
+class _NoAliasDumper(_SafeDumper):
+    def ignore_aliases(self, data):
+        return True
+
+# every document is followed by "---"
+def dump_yaml(spec_list):
+    if len(spec_list) <= 0:
+        return ""
+    return yaml.dump_all(spec_list, Dumper=_NoAliasDumper)+"---\n"
+
+def write_yaml(writer, filename, spec_list, sources=[]):
+    logger.info("Writing K8s spec to %s"%(filename))
+    writer.write(filename, dump_yaml(spec_list), sources)